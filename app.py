@@ -4,6 +4,9 @@ with Datadog LLM Observability integration
 """
 
 import os
+import time
+from collections import deque
+from types import SimpleNamespace
 try:
     from dotenv import load_dotenv
     # Load environment variables from .env file
@@ -12,11 +15,20 @@ except ImportError:
     # python-dotenv not installed, environment variables must be set manually
     pass
 
-from google import genai
-from typing import Optional
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+from response_cache import cache_key, get_response_cache
+from single_flight import flight_key, get_single_flight
+from metrics import get_metrics
+from request_log import get_request_log
+from token_budget import TokenBudget, TokenBudgetExceeded, get_token_budget
+from token_estimator import PromptTooLong, get_token_estimator, token_caps
 
+# google.genai is imported on first use: it takes over half a second to import
+if TYPE_CHECKING:
+    from google import genai
 
-def initialize_gemini(api_key: Optional[str] = None) -> genai.Client:
+
+def initialize_gemini(api_key: Optional[str] = None) -> "genai.Client":
     """
     Initialize the Gemini client.
     
@@ -32,13 +44,235 @@ def initialize_gemini(api_key: Optional[str] = None) -> genai.Client:
             "GEMINI_API_KEY environment variable must be set or passed as argument"
         )
     
+    from google import genai
+    
     # Initialize the client with API key
     client = genai.Client(api_key=api_key)
     
     return client
 
 
-def chat(client: genai.Client, message: str) -> str:
+def response_token_count(response: Any, message: str = "") -> int:
+    """
+    Return the total tokens used by a Gemini response.
+    
+    Falls back to the local token estimator when the response carries no
+    usage metadata.
+    
+    Args:
+        response: generate_content response
+        message: Prompt sent, used for the fallback estimate
+    
+    Returns:
+        Total (prompt + output) token count
+    """
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None) if usage is not None else None
+    if total is not None:
+        return total
+    estimator = get_token_estimator()
+    return estimator.estimate(message) + estimator.estimate(getattr(response, "text", None) or "")
+
+
+class _PreparedRequest:
+    """Pre-flight state shared by chat() and chat_stream()."""
+    
+    __slots__ = (
+        "message", "user_id", "request", "budget", "reserved", "cache", "cache_key", "cached", "used_tokens",
+        "flight_key"
+    )
+    
+    def __init__(self, message: str, user_id: Optional[str]):
+        self.message = message
+        self.user_id = user_id
+        self.request: Dict[str, Any] = {}
+        self.budget: Optional[TokenBudget] = None
+        self.reserved = 0
+        self.cache = None
+        self.cache_key: Optional[str] = None
+        self.cached: Optional[str] = None
+        self.used_tokens = 0
+        self.flight_key: Optional[str] = None
+
+
+def _prepare_request(
+    message: str,
+    user_id: Optional[str],
+    budget: Optional[TokenBudget],
+    max_input_tokens: Optional[int],
+    max_output_tokens: Optional[int]
+) -> _PreparedRequest:
+    """
+    Run the pre-flight checks for a chat request.
+    
+    Estimates the prompt size against the input cap and looks the prompt
+    up in the response cache. Tokens are reserved separately, by
+    _reserve_budget(), once the request is known to need a model call.
+    
+    Raises:
+        PromptTooLong: If the estimated prompt size exceeds the input cap
+    """
+    default_input_cap, default_output_cap = token_caps()
+    max_input_tokens = max_input_tokens or default_input_cap
+    max_output_tokens = max_output_tokens or default_output_cap
+    
+    prepared = _PreparedRequest(message, user_id)
+    estimated_tokens = get_token_estimator().estimate(message)
+    if max_input_tokens is not None and estimated_tokens > max_input_tokens:
+        raise PromptTooLong(estimated_tokens, max_input_tokens)
+    
+    # Get model name from environment or use default
+    model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+    prepared.request = {"model": model_name, "contents": message}
+    if max_output_tokens is not None:
+        prepared.request["config"] = {"max_output_tokens": max_output_tokens}
+    
+    prepared.cache_key = cache_key(model_name, message, max_output_tokens)
+    prepared.cache = get_response_cache()
+    if prepared.cache is not None:
+        prepared.cached = prepared.cache.get(prepared.cache_key)
+        if prepared.cached is not None:
+            return prepared
+    
+    if get_single_flight() is not None:
+        # Exact prompt rather than cache_key's normalized one, since
+        # coalesced callers receive another caller's response
+        prepared.flight_key = flight_key(model_name, message, max_output_tokens)
+    prepared.budget = budget or get_token_budget()
+    prepared.reserved = estimated_tokens + (max_output_tokens or 0)
+    return prepared
+
+
+def _reserve_budget(prepared: _PreparedRequest) -> None:
+    """
+    Reserve the request's estimated tokens in the token budget.
+    
+    Raises:
+        TokenBudgetExceeded: If the request does not fit the token budget
+    """
+    if prepared.budget is not None:
+        prepared.budget.acquire(prepared.user_id, prepared.reserved)
+
+
+def _release_budget(prepared: _PreparedRequest) -> None:
+    """Return a reservation that no model call settled (e.g. a coalesced request's)."""
+    reserved, prepared.reserved = prepared.reserved, 0
+    if prepared.budget is not None and reserved:
+        prepared.budget.record(prepared.user_id, 0, reserved=reserved)
+
+
+def _call_model(client: "genai.Client", prepared: _PreparedRequest) -> Tuple[str, int]:
+    """Call generate_content and settle the reservation; returns (text, tokens used)."""
+    try:
+        # Generate content using the new API
+        response = client.models.generate_content(**prepared.request)
+    except Exception as e:
+        _settle_request(prepared, None)
+        print(f"Error in chat function: {e}")
+        raise
+    
+    return response.text, _settle_request(prepared, response)
+
+
+async def _acall_model(client: "genai.Client", prepared: _PreparedRequest) -> Tuple[str, int]:
+    """Async _call_model() using client.aio."""
+    import asyncio
+    
+    try:
+        response = await client.aio.models.generate_content(**prepared.request)
+    except BaseException as e:
+        # Settled inline: the event loop may be cancelling this task
+        _settle_request(prepared, None)
+        if not isinstance(e, asyncio.CancelledError):
+            print(f"Error in chat function: {e}")
+        raise
+    
+    return response.text, await asyncio.to_thread(_settle_request, prepared, response)
+
+
+def _settle_request(prepared: _PreparedRequest, response: Any, text: Optional[str] = None) -> int:
+    """
+    Feed a finished response back into the estimator, budget and cache.
+    
+    Args:
+        prepared: State from _prepare_request()
+        response: Response (or final stream chunk) carrying usage_metadata,
+            or None if the call failed before any usage was reported
+        text: Full response text (default: response.text)
+    
+    Returns:
+        Tokens charged for the request
+    """
+    message = prepared.message
+    if response is None:
+        used_tokens = 0
+    else:
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) if usage is not None else None
+        if prompt_tokens:
+            get_token_estimator().observe(message, prompt_tokens)
+        if text is None:
+            text = response.text
+        used_tokens = response_token_count(
+            SimpleNamespace(usage_metadata=usage, text=text), message
+        )
+    metrics = get_metrics()
+    if metrics is not None and used_tokens:
+        # The metric the DoW monitor (datadog_monitoring.create_dow_monitor) alerts on
+        metrics.increment("llm.usage.total_tokens", used_tokens, tags=(f"model:{prepared.request['model']}",))
+    # Taken first: a cancelled achat() may release it concurrently
+    reserved, prepared.reserved = prepared.reserved, 0
+    if prepared.budget is not None:
+        # A failed call was not billed; this returns the reservation
+        prepared.budget.record(prepared.user_id, used_tokens, reserved=reserved)
+    if prepared.cache is not None and text:
+        prepared.cache.put(prepared.cache_key, text, used_tokens)
+    prepared.used_tokens = used_tokens
+    return used_tokens
+
+
+def _rejection_outcome(error: Exception) -> str:
+    """Metric outcome tag for a request refused before the model call."""
+    return "too_long" if isinstance(error, PromptTooLong) else "budget_rejected"
+
+
+def _record_chat(
+    started: float,
+    outcome: str,
+    message: str,
+    user_id: Optional[str],
+    prepared: Optional[_PreparedRequest],
+    kind: str = "chat"
+) -> None:
+    """Emit request count and latency metrics for a chat request and add it to the request log."""
+    latency_ms = (time.perf_counter() - started) * 1000.0
+    metrics = get_metrics()
+    if metrics is not None:
+        tags = (f"outcome:{outcome}", f"kind:{kind}")
+        metrics.increment("sentinel.chat.requests", tags=tags)
+        metrics.histogram("sentinel.chat.latency", latency_ms, tags=tags)
+    request_log = get_request_log()
+    if request_log is not None:
+        # Coalesced and cached requests were not charged, so they log 0 tokens
+        request_log.log({
+            "type": kind,
+            "user_id": user_id,
+            "prompt": message,
+            "outcome": outcome,
+            "model": prepared.request.get("model") if prepared is not None else None,
+            "tokens": prepared.used_tokens if prepared is not None else 0,
+            "latency_ms": round(latency_ms, 3)
+        })
+
+
+def chat(
+    client: "genai.Client",
+    message: str,
+    user_id: Optional[str] = None,
+    budget: Optional[TokenBudget] = None,
+    max_input_tokens: Optional[int] = None,
+    max_output_tokens: Optional[int] = None
+) -> str:
     """
     Standard chat function that sends a message to Gemini and returns the response.
     
@@ -47,26 +281,279 @@ def chat(client: genai.Client, message: str) -> str:
     - Input/output tokens
     - Model metadata
     
+    Before calling the model, the prompt's token count is estimated locally
+    (see token_estimator.py) and checked against the input cap; the output
+    cap is passed to Gemini as max_output_tokens. When a token budget is
+    configured (see token_budget.get_token_budget), the estimated input
+    plus the output cap is reserved up front and settled against the usage
+    reported in the response, so exhausted budgets refuse or throttle the
+    call before generate_content.
+    
+    When a response cache is configured (see response_cache.py), repeated
+    prompts for the same model are answered from it without calling the
+    model or charging the budget. With CHAT_SINGLE_FLIGHT=1, identical
+    requests (same model, output cap and exact prompt) arriving while one is
+    already in progress wait for it and share its response (see
+    single_flight.py). Every request must fit its own user's budget before
+    it joins, but only the one that calls the model is charged for it.
+    
     Args:
         client: Initialized genai.Client instance
         message: User message to send to the model
+        user_id: User making the request, for per-user budgets
+        budget: Token budget to enforce (default: the shared budget, if configured)
+        max_input_tokens: Input token cap (default: GEMINI_MAX_INPUT_TOKENS env var, if set)
+        max_output_tokens: Output token cap (default: GEMINI_MAX_OUTPUT_TOKENS env var, if set)
     
     Returns:
         Model response as a string
+    
+    Raises:
+        PromptTooLong: If the estimated prompt size exceeds the input cap
+        TokenBudgetExceeded: If the request does not fit the token budget
     """
+    started = time.perf_counter()
+    outcome = "error"
+    prepared = None
     try:
-        # Get model name from environment or use default
-        model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
+        prepared = _prepare_request(message, user_id, budget, max_input_tokens, max_output_tokens)
+        if prepared.cached is not None:
+            outcome = "cache_hit"
+            return prepared.cached
         
-        # Generate content using the new API
-        response = client.models.generate_content(
-            model=model_name,
-            contents=message
+        _reserve_budget(prepared)
+        try:
+            flights = get_single_flight()
+            if flights is None:
+                text, shared = _call_model(client, prepared)[0], False
+            else:
+                text, shared = flights.do(prepared.flight_key, lambda: _call_model(client, prepared))
+        finally:
+            _release_budget(prepared)
+        outcome = "coalesced" if shared else "ok"
+        return text
+    except (PromptTooLong, TokenBudgetExceeded) as e:
+        outcome = _rejection_outcome(e)
+        raise
+    finally:
+        _record_chat(started, outcome, message, user_id, prepared)
+
+
+async def achat(
+    client: "genai.Client",
+    message: str,
+    user_id: Optional[str] = None,
+    budget: Optional[TokenBudget] = None,
+    max_input_tokens: Optional[int] = None,
+    max_output_tokens: Optional[int] = None
+) -> str:
+    """
+    Asyncio variant of chat() using the SDK's async client (client.aio).
+    
+    Applies the same input/output caps, token budget, response cache and
+    single-flight coalescing as chat(). The pre-flight and settlement steps can block (throttling
+    budgets, the SQLite stores), so they run in the default executor. If
+    the call fails or is cancelled (e.g. by a deadline), the budget
+    reservation is returned.
+    
+    Args:
+        client: Initialized genai.Client instance
+        message: User message to send to the model
+        user_id: User making the request, for per-user budgets
+        budget: Token budget to enforce (default: the shared budget, if configured)
+        max_input_tokens: Input token cap (default: GEMINI_MAX_INPUT_TOKENS env var, if set)
+        max_output_tokens: Output token cap (default: GEMINI_MAX_OUTPUT_TOKENS env var, if set)
+    
+    Returns:
+        Model response as a string
+    
+    Raises:
+        PromptTooLong: If the estimated prompt size exceeds the input cap
+        TokenBudgetExceeded: If the request does not fit the token budget
+    """
+    import asyncio
+    
+    started = time.perf_counter()
+    outcome = "error"
+    prepared = None
+    try:
+        prepared = await asyncio.to_thread(
+            _prepare_request, message, user_id, budget, max_input_tokens, max_output_tokens
         )
-        return response.text
+        if prepared.cached is not None:
+            outcome = "cache_hit"
+            return prepared.cached
+        
+        await asyncio.to_thread(_reserve_budget, prepared)
+        try:
+            flights = get_single_flight()
+            if flights is None:
+                text, shared = (await _acall_model(client, prepared))[0], False
+            else:
+                text, shared = await flights.ado(prepared.flight_key, lambda: _acall_model(client, prepared))
+        finally:
+            # Inline: the event loop may be cancelling this task
+            _release_budget(prepared)
+        outcome = "coalesced" if shared else "ok"
+        return text
+    except (PromptTooLong, TokenBudgetExceeded) as e:
+        outcome = _rejection_outcome(e)
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        _record_chat(started, outcome, message, user_id, prepared)
+
+
+# Per-request streaming metrics of the most recent streamed responses
+_stream_metrics: Deque[Dict[str, Any]] = deque(maxlen=1000)
+
+
+def chat_stream(
+    client: "genai.Client",
+    message: str,
+    user_id: Optional[str] = None,
+    budget: Optional[TokenBudget] = None,
+    max_input_tokens: Optional[int] = None,
+    max_output_tokens: Optional[int] = None,
+    metrics: Optional[Dict[str, Any]] = None
+) -> Iterator[str]:
+    """
+    Streaming variant of chat() that yields response text as it arrives.
+    
+    Uses generate_content_stream, with the same input/output caps, token
+    budget and response cache as chat(). Once the stream ends (or the
+    caller stops iterating), per-request metrics are written into
+    `metrics` and kept for stream_stats():
+    - ttft_seconds: time from the call to the first text chunk
+    - duration_seconds: time from the call to the last chunk
+    - output_tokens: tokens generated (from usage_metadata, else estimated)
+    - tokens_per_second: output tokens over the time after the first chunk
+      (None for interrupted streams)
+    - completed: False if the stream failed or the caller stopped early
+    - cached: True if the response came from the response cache
+    
+    Args:
+        client: Initialized genai.Client instance
+        message: User message to send to the model
+        user_id: User making the request, for per-user budgets
+        budget: Token budget to enforce (default: the shared budget, if configured)
+        max_input_tokens: Input token cap (default: GEMINI_MAX_INPUT_TOKENS env var, if set)
+        max_output_tokens: Output token cap (default: GEMINI_MAX_OUTPUT_TOKENS env var, if set)
+        metrics: Optional dictionary filled with this request's metrics
+    
+    Yields:
+        Response text chunks
+    
+    Raises:
+        PromptTooLong: If the estimated prompt size exceeds the input cap
+        TokenBudgetExceeded: If the request does not fit the token budget
+    """
+    metrics = metrics if metrics is not None else {}
+    started = time.perf_counter()
+    prepared = None
+    try:
+        prepared = _prepare_request(message, user_id, budget, max_input_tokens, max_output_tokens)
+        if prepared.cached is None:
+            _reserve_budget(prepared)
+    except (PromptTooLong, TokenBudgetExceeded) as e:
+        _record_chat(started, _rejection_outcome(e), message, user_id, prepared, kind="stream")
+        raise
+    if prepared.cached is not None:
+        metrics.update({
+            "ttft_seconds": time.perf_counter() - started,
+            "duration_seconds": time.perf_counter() - started,
+            "output_tokens": get_token_estimator().estimate(prepared.cached),
+            "tokens_per_second": None,
+            "completed": True,
+            "cached": True
+        })
+        _stream_metrics.append(dict(metrics))
+        _record_chat(started, "cache_hit", message, user_id, prepared, kind="stream")
+        yield prepared.cached
+        return
+    
+    chunks: List[str] = []
+    first_chunk_at = None
+    last_chunk = None
+    completed = False
+    try:
+        for chunk in client.models.generate_content_stream(**prepared.request):
+            last_chunk = chunk
+            text = chunk.text
+            if not text:
+                continue
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            chunks.append(text)
+            yield text
+        completed = True
     except Exception as e:
         print(f"Error in chat function: {e}")
         raise
+    finally:
+        finished = time.perf_counter()
+        if not chunks:
+            # Failed before any text, or the stream was empty (e.g. blocked
+            # by safety filters): settle whatever usage was reported
+            _settle_request(prepared, last_chunk, "")
+        else:
+            text = "".join(chunks)
+            usage = getattr(last_chunk, "usage_metadata", None)
+            if not completed:
+                # Never cache a partial response
+                prepared.cache = None
+            _settle_request(prepared, SimpleNamespace(usage_metadata=usage, text=text), text)
+            output_tokens = getattr(usage, "candidates_token_count", None) if usage is not None else None
+            if output_tokens is None:
+                output_tokens = get_token_estimator().estimate(text)
+            generating = finished - first_chunk_at
+            metrics.update({
+                "ttft_seconds": first_chunk_at - started,
+                "duration_seconds": finished - started,
+                "output_tokens": output_tokens,
+                # Rates of interrupted streams would only add noise
+                "tokens_per_second": output_tokens / generating if completed and generating > 0 else None,
+                "completed": completed,
+                "cached": False
+            })
+            _stream_metrics.append(dict(metrics))
+            statsd = get_metrics()
+            if statsd is not None:
+                statsd.histogram("sentinel.chat.ttft", metrics["ttft_seconds"] * 1000.0)
+                if metrics["tokens_per_second"]:
+                    statsd.histogram("sentinel.chat.tokens_per_second", metrics["tokens_per_second"])
+        _record_chat(
+            started, "ok" if completed else ("interrupted" if chunks else "error"),
+            message, user_id, prepared, kind="stream"
+        )
+
+
+def stream_stats() -> Dict[str, Any]:
+    """
+    Summarise metrics of recent streamed responses (cache hits excluded).
+    
+    Returns:
+        Dictionary with requests, cached, and p50/p95 time-to-first-token
+        and mean tokens/sec over the last 1000 streamed requests
+    """
+    recent = [m for m in list(_stream_metrics) if not m["cached"]]
+    ttfts = sorted(m["ttft_seconds"] for m in recent)
+    rates = [m["tokens_per_second"] for m in recent if m["tokens_per_second"]]
+    
+    def percentile(values: List[float], fraction: float) -> Optional[float]:
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+    
+    return {
+        "requests": len(recent),
+        "cached": len(_stream_metrics) - len(recent),
+        "ttft_p50_seconds": percentile(ttfts, 0.5),
+        "ttft_p95_seconds": percentile(ttfts, 0.95),
+        "tokens_per_second_mean": sum(rates) / len(rates) if rates else None
+    }
 
 
 def main():
@@ -91,9 +578,9 @@ def main():
                 continue
             
             print("Gemini: ", end="", flush=True)
-            response = chat(client, user_input)
-            print(response)
-            print()
+            for chunk in chat_stream(client, user_input):
+                print(chunk, end="", flush=True)
+            print("\n")
             
         except KeyboardInterrupt:
             print("\n\nGoodbye!")
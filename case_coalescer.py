@@ -0,0 +1,301 @@
+"""
+Prompt Injection Case Coalescing
+Groups repeated detections from the same user into one Datadog case per
+window, so case volume grows with the number of offenders rather than the
+number of prompts
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+from case_queue import CaseSubmissionQueue, PendingCase, get_case_queue
+
+
+# Prompt characters kept per sample in summaries
+SAMPLE_PROMPT_CHARS = 200
+
+
+class _UserWindow:
+    """Aggregated detections for one user within the current window."""
+
+    __slots__ = (
+        "opened_at", "last_seen", "handle", "opened", "error", "count", "reported", "patterns", "samples",
+        "first_prompt"
+    )
+
+    def __init__(self, opened_at: float, first_prompt: str):
+        self.opened_at = opened_at
+        self.last_seen = opened_at
+        # Set once the case has been submitted (outside the coalescer's lock)
+        self.handle: Optional[PendingCase] = None
+        self.opened = threading.Event()
+        # Exception raised by the submission, if it failed
+        self.error: Optional[BaseException] = None
+        self.first_prompt = first_prompt[:SAMPLE_PROMPT_CHARS]
+        # The first detection is described by the case itself
+        self.count = 1
+        self.reported = 1
+        self.patterns: Dict[str, int] = {}
+        self.samples: List[str] = []
+
+
+class CaseCoalescer:
+    """
+    Opens at most one case per user per window.
+
+    The first detection for a user opens a case through the submission
+    queue. Later detections inside the window are only counted; when the
+    window closes (on the user's next detection after it, when the user is
+    evicted, on the periodic sweep, or on flush()) a single comment
+    summarising the extra hits, the distinct patterns and a few sample
+    prompts is appended to the case. Expired windows are swept every
+    sweep_interval seconds by a background thread, so quiet users get
+    their summary without waiting for another detection.
+
+    State is bounded: at most max_users windows are kept, each with at most
+    max_patterns distinct patterns and max_samples sample prompts.
+    """
+
+    def __init__(
+        self,
+        window_seconds: Optional[float] = None,
+        max_users: int = 10000,
+        max_patterns: int = 20,
+        max_samples: int = 3,
+        case_queue: Optional[CaseSubmissionQueue] = None,
+        sweep_interval: Optional[float] = None
+    ):
+        """
+        Args:
+            window_seconds: Coalescing window per user (default: CASE_COALESCE_WINDOW
+                env var or 600 seconds)
+            max_users: Maximum number of users tracked at once; the oldest
+                window is closed early when exceeded
+            max_patterns: Distinct patterns tracked per window (the rest are
+                counted as "other")
+            max_samples: Sample prompts kept per window
+            case_queue: Submission queue (default: the shared queue)
+            sweep_interval: Seconds between sweeps for expired windows
+                (default: the window, at most 60 seconds)
+        """
+        if window_seconds is None:
+            window_seconds = float(os.getenv("CASE_COALESCE_WINDOW", "600"))
+        if max_users <= 0:
+            raise ValueError("max_users must be positive")
+        self.window_seconds = window_seconds
+        self.max_users = max_users
+        self.max_patterns = max_patterns
+        self.max_samples = max_samples
+        self.sweep_interval = min(window_seconds, 60.0) if sweep_interval is None else sweep_interval
+        self._queue = case_queue
+        # Ordered by window opening time, so expired windows are at the front
+        self._windows: "OrderedDict[str, _UserWindow]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_pid: Optional[int] = None
+        self.stats = {"cases_opened": 0, "detections_coalesced": 0, "summaries_sent": 0, "windows_evicted": 0}
+
+    @property
+    def case_queue(self) -> CaseSubmissionQueue:
+        if self._queue is None:
+            self._queue = get_case_queue()
+        return self._queue
+
+    def record(
+        self,
+        user_id: str,
+        prompt: str,
+        matched_pattern: Optional[str] = None,
+        additional_context: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Record a detection, opening a case only if the user has no open window.
+
+        Args:
+            user_id: ID of the user who triggered the prompt injection
+            prompt: The prompt string that was flagged as injection
+            matched_pattern: Pattern that flagged the prompt
+            additional_context: Context for the case (used when a case is opened)
+
+        Returns:
+            Dictionary with "handle" (PendingCase of the user's case),
+            "coalesced" (True if no new case was opened) and "count"
+            (detections in the current window)
+
+        Raises:
+            Exception: Whatever queueing the user's case raised (e.g. an
+                OSError writing the spool), also for detections coalesced
+                onto that case while it was being queued
+        """
+        if self._sweeper_pid != os.getpid():
+            self._start_sweeper()
+        now = time.monotonic()
+        closed = []
+        opening = False
+        with self._lock:
+            closed.extend(self._evict_expired(now))
+            window = self._windows.get(user_id)
+            if window is not None:
+                window.count += 1
+                window.last_seen = now
+                self._add_pattern(window, matched_pattern)
+                if len(window.samples) < self.max_samples:
+                    window.samples.append(prompt[:SAMPLE_PROMPT_CHARS])
+                self.stats["detections_coalesced"] += 1
+                count = window.count
+            else:
+                while len(self._windows) >= self.max_users:
+                    closed.append(self._windows.popitem(last=False))
+                    self.stats["windows_evicted"] += 1
+                # Placeholder: the case is submitted (a spool write and
+                # fsync) after the lock is released
+                window = _UserWindow(now, prompt)
+                self._add_pattern(window, matched_pattern)
+                self._windows[user_id] = window
+                self.stats["cases_opened"] += 1
+                opening = True
+                count = 1
+
+        if opening:
+            try:
+                window.handle = self.case_queue.submit(
+                    user_id=user_id,
+                    offending_prompt=prompt,
+                    additional_context=additional_context
+                )
+            except BaseException as e:
+                window.error = e
+                with self._lock:
+                    if self._windows.get(user_id) is window:
+                        del self._windows[user_id]
+                raise
+            finally:
+                window.opened.set()
+        else:
+            # Only waits if the case is still being submitted by another thread
+            window.opened.wait()
+            if window.error is not None:
+                # Coalesced onto a case that could not be queued
+                raise window.error
+        for closed_user, closed_window in closed:
+            self._send_summary(closed_user, closed_window)
+        return {"handle": window.handle, "coalesced": not opening, "count": count}
+
+    def _start_sweeper(self) -> None:
+        # Threads do not survive fork; each process starts its own sweeper
+        with self._lock:
+            if self._sweeper_pid != os.getpid():
+                self._sweeper = threading.Thread(target=self._sweep, name="case-coalescer-sweep", daemon=True)
+                self._sweeper_pid = os.getpid()
+                self._sweeper.start()
+
+    def _sweep(self) -> None:
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.flush_expired()
+            except Exception as e:
+                print(f"Error sending coalesced case summaries: {e}")
+
+    def close(self) -> None:
+        """Stop the background sweep and flush every open window."""
+        self._stop.set()
+        self.flush()
+
+    def flush(self) -> None:
+        """Close every open window, sending summaries for unreported detections."""
+        with self._lock:
+            closed = list(self._windows.items())
+            self._windows.clear()
+        for user_id, window in closed:
+            self._send_summary(user_id, window)
+
+    def flush_expired(self) -> None:
+        """Close windows older than window_seconds."""
+        with self._lock:
+            closed = self._evict_expired(time.monotonic())
+        for user_id, window in closed:
+            self._send_summary(user_id, window)
+
+    def open_windows(self) -> int:
+        """Number of users with an open window."""
+        return len(self._windows)
+
+    def _evict_expired(self, now: float) -> List[tuple]:
+        closed = []
+        while self._windows:
+            user_id, window = next(iter(self._windows.items()))
+            if now - window.opened_at < self.window_seconds:
+                break
+            closed.append(self._windows.popitem(last=False))
+        return closed
+
+    def _add_pattern(self, window: _UserWindow, pattern: Optional[str]) -> None:
+        if pattern is None:
+            return
+        if pattern not in window.patterns and len(window.patterns) >= self.max_patterns:
+            pattern = "other"
+        window.patterns[pattern] = window.patterns.get(pattern, 0) + 1
+
+    def _send_summary(self, user_id: str, window: _UserWindow) -> None:
+        unreported = window.count - window.reported
+        if unreported <= 0:
+            return
+        window.opened.wait()
+        if window.handle is None:
+            # Opening the case failed; there is nothing to comment on
+            return
+        window.reported = window.count
+        duration = window.last_seen - window.opened_at
+
+        comment = f"""**Repeated Prompt Injection Attempts**
+
+**User ID:** {user_id}
+**Additional Detections:** {unreported} (total {window.count} in {duration:.0f}s)
+"""
+        if window.patterns:
+            comment += "\n**Patterns Hit:**\n"
+            for pattern, hits in sorted(window.patterns.items(), key=lambda item: -item[1]):
+                comment += f"- `{pattern}`: {hits}\n"
+        if window.samples:
+            comment += "\n**Sample Prompts:**\n"
+            for sample in window.samples:
+                comment += f"```\n{sample}\n```\n"
+
+        self.case_queue.submit_comment(
+            window.handle,
+            comment,
+            user_id=user_id,
+            offending_prompt=window.samples[0] if window.samples else window.first_prompt,
+            additional_context={
+                "coalesced_detections": window.count,
+                "patterns_hit": dict(window.patterns),
+                "window_seconds": round(duration)
+            }
+        )
+        self.stats["summaries_sent"] += 1
+
+
+_default_coalescer: Optional[CaseCoalescer] = None
+_default_coalescer_lock = threading.Lock()
+
+
+def get_case_coalescer() -> CaseCoalescer:
+    """
+    Return the process-wide case coalescer.
+
+    Returns:
+        Shared CaseCoalescer
+    """
+    global _default_coalescer
+    with _default_coalescer_lock:
+        if _default_coalescer is None:
+            # Created after the queue so its atexit flush runs before the
+            # queue shuts down; summaries are spooled either way
+            _default_coalescer = CaseCoalescer(case_queue=get_case_queue())
+            atexit.register(_default_coalescer.close)
+        return _default_coalescer
@@ -0,0 +1,446 @@
+"""
+Asynchronous Datadog Case Submission
+Background worker with a bounded queue, retry with exponential backoff and a
+disk-backed spool so that cases survive restarts and Datadog outages
+"""
+
+import atexit
+import heapq
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from typing import Optional, Dict, Any, Callable, List, Tuple
+from ttl_cache import TTLCache
+
+
+# Default spool location (one JSON file per pending case)
+DEFAULT_SPOOL_DIR = os.path.join(".sentinel", "case_spool")
+
+
+class PendingCase:
+    """
+    Handle for a case that has been queued but not necessarily created yet.
+
+    status is "pending" until the worker either creates the case ("created")
+    or gives up on it ("failed"); result then holds the dictionary returned
+    by create_prompt_injection_case.
+    """
+
+    def __init__(self, case_key: str):
+        self.case_key = case_key
+        self.status = "pending"
+        self.result: Optional[Dict[str, Any]] = None
+        self._done = threading.Event()
+
+    @property
+    def case_id(self) -> Optional[str]:
+        """Datadog case ID once created."""
+        return self.result.get("case_id") if self.result else None
+
+    def done(self) -> bool:
+        """Whether the case has been created or abandoned."""
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Block until the case is resolved.
+
+        Args:
+            timeout: Maximum seconds to wait (None: wait forever)
+
+        Returns:
+            The case creation result, or None if still pending
+        """
+        self._done.wait(timeout)
+        return self.result
+
+    def _resolve(self, status: str, result: Dict[str, Any]) -> None:
+        self.status = status
+        self.result = result
+        self._done.set()
+
+    def __repr__(self) -> str:
+        return f"PendingCase(case_key={self.case_key!r}, status={self.status!r})"
+
+
+class CaseSubmissionQueue:
+    """
+    Submits prompt injection cases to Datadog from a background thread.
+
+    Every case is written to the spool directory before submit() returns and
+    removed only once Datadog has accepted it (or it failed permanently), so
+    a crash, restart or Datadog outage never loses a case. The in-memory
+    queue is bounded; cases that do not fit stay in the spool and are picked
+    up by the worker's periodic rescan, as are cases left over from a
+    previous run.
+
+    A failed attempt does not block the worker: the case is rescheduled
+    with a not-before time (kept in its spool file) and the worker moves on
+    to the next one.
+    """
+
+    def __init__(
+        self,
+        spool_dir: Optional[str] = None,
+        max_queue_size: int = 1000,
+        max_attempts: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        rescan_interval: float = 30.0,
+        submit_func: Optional[Callable[..., Dict[str, Any]]] = None,
+        comment_func: Optional[Callable[..., Dict[str, Any]]] = None
+    ):
+        """
+        Args:
+            spool_dir: Directory for spooled cases (default: CASE_SPOOL_DIR env
+                var or .sentinel/case_spool)
+            max_queue_size: Maximum number of cases held in memory
+            max_attempts: Attempts before a case is moved to the failed spool
+            base_delay: First retry delay in seconds
+            max_delay: Upper bound for the retry delay in seconds
+            rescan_interval: Seconds between spool rescans while idle
+            submit_func: Case creation function (default:
+                datadog_monitoring.create_prompt_injection_case)
+            comment_func: Case comment function (default:
+                datadog_monitoring.comment_prompt_injection_case)
+        """
+        self.spool_dir = spool_dir or os.getenv("CASE_SPOOL_DIR", DEFAULT_SPOOL_DIR)
+        self.failed_dir = os.path.join(self.spool_dir, "failed")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rescan_interval = rescan_interval
+        self._submit_func = submit_func
+        self._comment_func = comment_func
+        # case_key -> Datadog case ID for cases created by this process
+        self._case_ids = TTLCache(max_entries=10000, ttl_seconds=None)
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=max_queue_size)
+        self._queued: set = set()
+        # (not-before epoch time, path) of cases waiting to be retried
+        self._delayed: List[Tuple[float, str]] = []
+        self._handles: Dict[str, PendingCase] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"submitted": 0, "created": 0, "retried": 0, "failed": 0, "spooled_only": 0}
+
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def start(self) -> "CaseSubmissionQueue":
+        """Start the background worker (idempotent)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="case-submission", daemon=True)
+                self._thread.start()
+        return self
+
+    def shutdown(self, timeout: Optional[float] = 5.0) -> None:
+        """
+        Stop the worker. Cases not yet submitted stay in the spool.
+
+        Args:
+            timeout: Seconds to wait for an in-flight submission to finish
+        """
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def submit(
+        self,
+        user_id: str,
+        offending_prompt: str,
+        additional_context: Optional[Dict[str, Any]] = None,
+        assignee_id: Optional[str] = None
+    ) -> PendingCase:
+        """
+        Queue a prompt injection case without waiting for Datadog.
+
+        Args:
+            user_id: ID of the user who triggered the prompt injection
+            offending_prompt: The prompt string that was flagged as injection
+            additional_context: Optional dictionary with additional context
+            assignee_id: Optional Datadog user ID to assign the case to
+
+        Returns:
+            PendingCase handle
+        """
+        return self._submit_record({
+            "kind": "case",
+            "user_id": user_id,
+            "offending_prompt": offending_prompt,
+            "additional_context": dict(additional_context) if additional_context else None,
+            "assignee_id": assignee_id
+        })
+
+    def submit_comment(
+        self,
+        parent: PendingCase,
+        comment: str,
+        user_id: str,
+        offending_prompt: str,
+        additional_context: Optional[Dict[str, Any]] = None
+    ) -> PendingCase:
+        """
+        Queue a comment on a previously submitted case.
+
+        If the parent case cannot be found (it failed, or was created by an
+        earlier run of this process), a new case is created from user_id,
+        offending_prompt and additional_context instead so the comment's
+        information is not lost.
+
+        Args:
+            parent: Handle returned by submit() for the case to comment on
+            comment: Comment text (Markdown)
+            user_id: ID of the user the case is about
+            offending_prompt: Prompt used if a replacement case is needed
+            additional_context: Context used if a replacement case is needed
+
+        Returns:
+            PendingCase handle for the comment
+        """
+        return self._submit_record({
+            "kind": "comment",
+            "parent_key": parent.case_key,
+            "case_id": parent.case_id,
+            "comment": comment,
+            "user_id": user_id,
+            "offending_prompt": offending_prompt,
+            "additional_context": dict(additional_context) if additional_context else None,
+            "assignee_id": None
+        })
+
+    def _submit_record(self, record: Dict[str, Any]) -> PendingCase:
+        case_key = uuid.uuid4().hex
+        record.update(case_key=case_key, attempts=0, queued_at=time.time())
+        path = self._spool_path(case_key)
+        self._write_record(path, record)
+
+        handle = PendingCase(case_key)
+        with self._lock:
+            self._handles[case_key] = handle
+            self.stats["submitted"] += 1
+        self._enqueue(path)
+        self.start()
+        return handle
+
+    def pending_count(self) -> int:
+        """Number of cases currently in the spool."""
+        return sum(1 for name in os.listdir(self.spool_dir) if name.endswith(".json"))
+
+    def _spool_path(self, case_key: str) -> str:
+        return os.path.join(self.spool_dir, f"{case_key}.json")
+
+    @staticmethod
+    def _write_record(path: str, record: Dict[str, Any]) -> None:
+        # Write-then-rename so a crash never leaves a truncated spool file
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(record, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def _enqueue(self, path: str) -> bool:
+        with self._lock:
+            if path in self._queued:
+                return True
+            try:
+                self._queue.put_nowait(path)
+            except queue.Full:
+                # Stays in the spool; the next rescan picks it up
+                self.stats["spooled_only"] += 1
+                return False
+            self._queued.add(path)
+            return True
+
+    def _rescan(self) -> None:
+        """Queue spooled cases that are not already queued, oldest first."""
+        try:
+            names = sorted(
+                (name for name in os.listdir(self.spool_dir) if name.endswith(".json")),
+                key=lambda name: os.path.getmtime(os.path.join(self.spool_dir, name))
+            )
+        except OSError:
+            return
+        for name in names:
+            if not self._enqueue(os.path.join(self.spool_dir, name)):
+                break
+
+    def _next_path(self, timeout: float) -> Optional[str]:
+        """Return a retry that is due, else wait up to timeout for a queued case."""
+        with self._lock:
+            if self._delayed:
+                retry_at, path = self._delayed[0]
+                wait = retry_at - time.time()
+                if wait <= 0:
+                    heapq.heappop(self._delayed)
+                    return path
+                timeout = min(timeout, wait)
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _run(self) -> None:
+        self._rescan()
+        next_rescan = time.monotonic() + self.rescan_interval
+        while not self._stop.is_set():
+            path = self._next_path(max(0.0, next_rescan - time.monotonic()))
+            if path is not None:
+                retry_at = None
+                try:
+                    retry_at = self._process(path)
+                finally:
+                    with self._lock:
+                        if retry_at is None:
+                            self._queued.discard(path)
+                        else:
+                            # Stays in _queued so rescans do not bypass the delay
+                            heapq.heappush(self._delayed, (retry_at, path))
+                if not self._queue.empty():
+                    continue
+            if path is None and time.monotonic() < next_rescan:
+                # Woke up for a delayed retry
+                continue
+            self._rescan()
+            next_rescan = time.monotonic() + self.rescan_interval
+
+    def _process(self, path: str) -> Optional[float]:
+        """Make one attempt; returns the time to retry at, or None if the case is done."""
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            # Already handled elsewhere or unreadable
+            return None
+        not_before = record.get("not_before")
+        if not_before is not None and not_before > time.time():
+            # Rescheduled by an earlier run of this process
+            return not_before
+
+        permanent = False
+        try:
+            result = self._create_case(record)
+        except ValueError as e:
+            # Missing credentials or invalid input: retrying cannot help
+            result = {"success": False, "error": str(e), "message": f"Failed to create case: {e}"}
+            permanent = True
+        except Exception as e:
+            result = {"success": False, "error": str(e), "message": f"Failed to create case: {e}"}
+
+        if result.get("parent_pending"):
+            # Waiting for the parent is not a failed attempt; the parent
+            # itself either gets created or fails (then a new case is made)
+            record["parent_waits"] = record.get("parent_waits", 0) + 1
+            # Checking the parent costs no API call, so poll at least every rescan
+            delay = min(self.base_delay * 2 ** (record["parent_waits"] - 1), self.max_delay, self.rescan_interval)
+        else:
+            record["attempts"] += 1
+            if result.get("success"):
+                self._finish(path, record, "created", result)
+                return None
+            if permanent or record["attempts"] >= self.max_attempts:
+                self._finish(path, record, "failed", result)
+                return None
+            with self._lock:
+                self.stats["retried"] += 1
+            delay = min(self.base_delay * 2 ** (record["attempts"] - 1), self.max_delay)
+
+        # Full jitter keeps many workers from retrying in lockstep
+        record["not_before"] = time.time() + random.uniform(delay / 2, delay)
+        self._write_record(path, record)
+        return record["not_before"]
+
+    def _create_case(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        if record.get("kind") == "comment":
+            case_id = record.get("case_id") or self._case_ids.get(record["parent_key"])
+            if case_id is not None:
+                comment = self._comment_func
+                if comment is None:
+                    from datadog_monitoring import comment_prompt_injection_case
+                    comment = comment_prompt_injection_case
+                return comment(case_id=case_id, comment=record["comment"])
+            with self._lock:
+                parent_pending = record["parent_key"] in self._handles
+            if parent_pending:
+                return {
+                    "success": False,
+                    "error": "Parent case not created yet",
+                    "message": "Parent case pending",
+                    "parent_pending": True
+                }
+
+        submit = self._submit_func
+        if submit is None:
+            from datadog_monitoring import create_prompt_injection_case
+            submit = create_prompt_injection_case
+        return submit(
+            user_id=record["user_id"],
+            offending_prompt=record["offending_prompt"],
+            additional_context=record.get("additional_context"),
+            assignee_id=record.get("assignee_id")
+        )
+
+    def _finish(self, path: str, record: Dict[str, Any], status: str, result: Dict[str, Any]) -> None:
+        if status == "created":
+            if record.get("kind", "case") == "case" and result.get("case_id"):
+                self._case_ids.put(record["case_key"], result["case_id"])
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        else:
+            record["last_error"] = result.get("error")
+            self._write_record(path, record)
+            os.replace(path, os.path.join(self.failed_dir, os.path.basename(path)))
+
+        with self._lock:
+            self.stats[status] += 1
+            handle = self._handles.pop(record["case_key"], None)
+        if handle is not None:
+            handle._resolve(status, result)
+
+
+_default_queue: Optional[CaseSubmissionQueue] = None
+_default_queue_lock = threading.Lock()
+
+
+def get_case_queue() -> CaseSubmissionQueue:
+    """
+    Return the process-wide case submission queue, starting it on first use.
+
+    Returns:
+        Shared CaseSubmissionQueue
+    """
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = CaseSubmissionQueue().start()
+            atexit.register(_default_queue.shutdown)
+        return _default_queue
+
+
+def list_failed_cases(spool_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Return cases that exhausted their retries.
+
+    Args:
+        spool_dir: Spool directory (default: CASE_SPOOL_DIR env var or .sentinel/case_spool)
+
+    Returns:
+        List of spooled case records
+    """
+    failed_dir = os.path.join(spool_dir or os.getenv("CASE_SPOOL_DIR", DEFAULT_SPOOL_DIR), "failed")
+    records = []
+    if os.path.isdir(failed_dir):
+        for name in sorted(os.listdir(failed_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(failed_dir, name)) as f:
+                    records.append(json.load(f))
+    return records
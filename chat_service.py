@@ -0,0 +1,292 @@
+"""
+Asyncio Chat Service
+Serves many concurrent chat sessions over HTTP (TCP or a Unix socket) with
+prompt injection screening, a concurrency limit, per-request deadlines and
+backpressure
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+from typing import Optional, Dict, Any, Tuple, TYPE_CHECKING
+
+from app import achat, initialize_gemini
+from prompt_injection_detector import handle_prompt_injection
+from token_budget import TokenBudgetExceeded
+from token_estimator import PromptTooLong
+
+if TYPE_CHECKING:
+    from google import genai
+
+
+# Largest request body accepted
+MAX_BODY_BYTES = 1_000_000
+
+# Most header lines, and header bytes in total, accepted per request
+MAX_HEADERS = 100
+MAX_HEADER_BYTES = 16 * 1024
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 429: "Too Many Requests", 431: "Request Header Fields Too Large", 500: "Internal Server Error",
+    503: "Service Unavailable", 504: "Gateway Timeout"
+}
+
+
+class ChatService:
+    """
+    HTTP front end for achat() with admission control.
+
+    At most max_concurrency requests are processed at once; up to max_queue
+    more wait for a slot. Beyond that, requests are refused immediately with
+    503 and a Retry-After header instead of piling up, so latency stays
+    bounded under overload. Each request (queueing included) must finish
+    within deadline_seconds or it is cancelled and answered with 504.
+
+    Endpoints:
+    - POST /chat {"message": ..., "user_id": ...} -> {"response": ...}
+    - GET /health
+    - GET /stats
+    """
+
+    def __init__(
+        self,
+        client: "genai.Client",
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        deadline_seconds: Optional[float] = None
+    ):
+        """
+        Args:
+            client: Initialized genai.Client instance (or anything with client.aio.models)
+            max_concurrency: Requests processed at once (default: CHAT_SERVICE_CONCURRENCY
+                env var or 64)
+            max_queue: Requests allowed to wait for a slot (default: CHAT_SERVICE_QUEUE
+                env var or 256)
+            deadline_seconds: Per-request deadline (default: CHAT_SERVICE_DEADLINE
+                env var or 30)
+        """
+        self.client = client
+        self.max_concurrency = max_concurrency or int(os.getenv("CHAT_SERVICE_CONCURRENCY", "64"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("CHAT_SERVICE_QUEUE", "256"))
+        self.deadline_seconds = deadline_seconds or float(os.getenv("CHAT_SERVICE_DEADLINE", "30"))
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._admitted = 0
+        self.stats = {
+            "requests": 0, "completed": 0, "blocked": 0, "rejected_overload": 0,
+            "rejected_budget": 0, "deadline_exceeded": 0, "errors": 0, "connections": 0
+        }
+
+    async def chat(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Screen and answer one chat request.
+
+        Args:
+            payload: Request body with "message" and optional "user_id"
+
+        Returns:
+            (HTTP status, response body)
+        """
+        message = payload.get("message")
+        if not isinstance(message, str) or not message.strip():
+            return 400, {"error": "message must be a non-empty string"}
+        user_id = str(payload.get("user_id") or "anonymous")
+
+        self.stats["requests"] += 1
+        if self._admitted >= self.max_concurrency + self.max_queue:
+            self.stats["rejected_overload"] += 1
+            return 503, {"error": "Server overloaded", "retry_after": 1}
+
+        self._admitted += 1
+        try:
+            return await asyncio.wait_for(self._process(message, user_id), self.deadline_seconds)
+        except asyncio.TimeoutError:
+            self.stats["deadline_exceeded"] += 1
+            return 504, {"error": f"Deadline of {self.deadline_seconds:g}s exceeded"}
+        finally:
+            self._admitted -= 1
+
+    async def _process(self, message: str, user_id: str) -> Tuple[int, Dict[str, Any]]:
+        async with self._slots:
+            detection = await asyncio.to_thread(
+                handle_prompt_injection,
+                prompt=message,
+                user_id=user_id,
+                create_case=True,
+                additional_context={"source": "chat_service"}
+            )
+            if detection["injection_detected"]:
+                self.stats["blocked"] += 1
+                return 403, {
+                    "error": "I cannot process this request due to security concerns.",
+                    "matched_pattern": detection.get("matched_pattern"),
+                    "case_message": detection.get("case_message")
+                }
+            if detection["token_limit_exceeded"]:
+                return 413, {"error": f"Prompt is too long (about {detection['estimated_tokens']:,} tokens)"}
+
+            try:
+                response = await achat(self.client, message, user_id=user_id)
+            except TokenBudgetExceeded as e:
+                self.stats["rejected_budget"] += 1
+                # Larger than the whole limit: retrying will never help
+                retry_after = None if math.isinf(e.retry_after) else e.retry_after
+                return 429, {"error": str(e), "retry_after": retry_after}
+            except PromptTooLong as e:
+                return 413, {"error": str(e)}
+            except Exception as e:
+                self.stats["errors"] += 1
+                return 500, {"error": str(e)}
+            self.stats["completed"] += 1
+            return 200, {"response": response}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve HTTP/1.1 requests (with keep-alive) on one connection."""
+        self.stats["connections"] += 1
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    # Longer than the stream's line limit
+                    await self._respond(writer, 400, {"error": "Request line too long"}, False)
+                    break
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+                headers = {}
+                header_lines = header_bytes = 0
+                rejected = None
+                while True:
+                    try:
+                        line = await reader.readline()
+                    except (ValueError, asyncio.LimitOverrunError):
+                        rejected = (400, "Header line too long")
+                        break
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    # Lines, not distinct names: repeated names overwrite each other
+                    header_lines += 1
+                    header_bytes += len(line)
+                    if header_lines > MAX_HEADERS or header_bytes > MAX_HEADER_BYTES:
+                        rejected = (431, "Too many or too large headers")
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if rejected is not None:
+                    await self._respond(writer, rejected[0], {"error": rejected[1]}, False)
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "Invalid Content-Length"}, False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "Request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, result = await self._route(method, path, body)
+                await self._respond(writer, status, result, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        if path == "/chat":
+            if method != "POST":
+                return 405, {"error": "Use POST"}
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                return 400, {"error": "Body must be JSON"}
+            if not isinstance(payload, dict):
+                return 400, {"error": "Body must be a JSON object"}
+            return await self.chat(payload)
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/stats":
+            return 200, {**self.stats, "in_flight": self._admitted}
+        return 404, {"error": "Not found"}
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, result: Dict[str, Any], keep_alive: bool) -> None:
+        body = json.dumps(result).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        )
+        if result.get("retry_after") is not None:
+            head += f"Retry-After: {max(1, int(result['retry_after'] + 0.999))}\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+        # Waits while the client's receive buffer is full
+        await writer.drain()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080, unix_path: Optional[str] = None) -> asyncio.AbstractServer:
+        """
+        Start listening.
+
+        Args:
+            host: TCP host
+            port: TCP port (0 picks a free one)
+            unix_path: Listen on this Unix socket instead of TCP
+
+        Returns:
+            The running asyncio server
+        """
+        # Room for queued requests; connections beyond it wait in the kernel backlog
+        backlog = self.max_concurrency + self.max_queue
+        if unix_path:
+            return await asyncio.start_unix_server(self.handle_connection, path=unix_path, backlog=backlog)
+        return await asyncio.start_server(self.handle_connection, host, port, backlog=backlog)
+
+
+async def serve(host: str, port: int, unix_path: Optional[str] = None) -> None:
+    """
+    Run the chat service until cancelled.
+
+    Args:
+        host: TCP host
+        port: TCP port
+        unix_path: Listen on this Unix socket instead of TCP
+    """
+    service = ChatService(initialize_gemini())
+    server = await service.start(host, port, unix_path)
+    print(f"Chat service listening on {unix_path or f'http://{host}:{port}'}")
+    print(f"  concurrency {service.max_concurrency}, queue {service.max_queue}, "
+          f"deadline {service.deadline_seconds:g}s")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """
+    Command-line entry point for the chat service.
+    """
+    parser = argparse.ArgumentParser(description="Sentinel asyncio chat service")
+    parser.add_argument("--host", default=os.getenv("CHAT_SERVICE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CHAT_SERVICE_PORT", "8080")))
+    parser.add_argument("--unix", help="Listen on a Unix socket path instead of TCP")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print("\nShutting down")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""
+Offline Corpus Scanner
+Re-scores JSONL request logs with detect_prompt_injection, e.g. after
+INJECTION_PATTERNS changes
+
+Usage:
+    python corpus_scanner.py scan requests.jsonl -o verdicts.tsv
+    python corpus_scanner.py scan requests.jsonl -o verdicts.tsv --resume
+    python corpus_scanner.py summary verdicts.tsv
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+from collections import Counter
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+
+import prompt_injection_detector
+from prompt_injection_detector import INJECTION_PATTERNS, detect_prompt_injection, enable_verdict_cache
+
+
+# Fields tried, in order, for the prompt text of a log record
+DEFAULT_PROMPT_FIELDS = ("prompt", "message", "body")
+
+# Records with a "type" field are only scanned if it is this
+SCANNED_TYPE = "detection"
+
+# Bytes of input per task sent to a worker
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Verdict codes; a flagged line concatenates every code that applies
+CODE_CLEAN = "-"
+CODE_RULE = "R"
+CODE_REPETITION = "F"
+CODE_LENGTH = "L"
+CODE_INVALID = "E"
+
+_CODE_NAMES = {CODE_RULE: "rule", CODE_REPETITION: "repetition", CODE_LENGTH: "length", CODE_INVALID: "invalid"}
+
+
+class ScanSummary:
+    """
+    Counters for a scan: lines, flagged prompts, hits per rule, reasons and
+    the users with the most flagged prompts.
+
+    Workers fill one per block and the parent merges them; on resume the
+    summary is rebuilt from the verdict file written so far.
+    """
+
+    def __init__(self, rule_count: int):
+        self.lines = 0
+        self.flagged = 0
+        self.invalid = 0
+        self.rule_hits = [0] * rule_count
+        self.reasons: Counter = Counter()
+        self.users: Counter = Counter()
+
+    def add(self, code: str, rules: Sequence[int], user_id: str) -> None:
+        """Count one verdict line."""
+        self.lines += 1
+        if code == CODE_CLEAN:
+            return
+        if code == CODE_INVALID:
+            self.invalid += 1
+            return
+        self.flagged += 1
+        for letter in code:
+            self.reasons[_CODE_NAMES[letter]] += 1
+        for index in rules:
+            if index < len(self.rule_hits):
+                self.rule_hits[index] += 1
+        if user_id:
+            self.users[user_id] += 1
+
+    def merge(self, other: "ScanSummary") -> None:
+        """Add another summary's counters to this one."""
+        self.lines += other.lines
+        self.flagged += other.flagged
+        self.invalid += other.invalid
+        for index, hits in enumerate(other.rule_hits):
+            self.rule_hits[index] += hits
+        self.reasons.update(other.reasons)
+        self.users.update(other.users)
+
+    @classmethod
+    def from_verdicts(cls, path: str, rule_count: int, limit: Optional[int] = None) -> "ScanSummary":
+        """
+        Rebuild a summary from a verdict file.
+
+        Args:
+            path: Verdict file written by scan()
+            rule_count: Number of rules in the scanned rule set
+            limit: Only read this many bytes (None: the whole file)
+
+        Returns:
+            ScanSummary
+        """
+        summary = cls(rule_count)
+        remaining = os.path.getsize(path) if limit is None else limit
+        with open(path, "rb") as handle:
+            while remaining > 0:
+                line = handle.readline(remaining)
+                if not line:
+                    break
+                remaining -= len(line)
+                _, code, rules, user_id = line.decode("utf-8").rstrip("\n").split("\t")
+                summary.add(code, [int(index) for index in rules.split(",")] if rules else (), user_id)
+        return summary
+
+    def as_dict(self, top_users: int = 10) -> Dict[str, Any]:
+        """
+        Return the summary as a dictionary.
+
+        Args:
+            top_users: Number of most-flagged users included
+
+        Returns:
+            Dictionary with lines, prompts, flagged, invalid, hit_rate,
+            rule_hits, rule_hit_rates, reasons and top_users
+        """
+        prompts = self.lines - self.invalid
+        return {
+            "lines": self.lines,
+            "prompts": prompts,
+            "flagged": self.flagged,
+            "invalid": self.invalid,
+            "hit_rate": self.flagged / prompts if prompts else 0.0,
+            "rule_hits": list(self.rule_hits),
+            "rule_hit_rates": [hits / prompts if prompts else 0.0 for hits in self.rule_hits],
+            "reasons": dict(self.reasons),
+            "top_users": self.users.most_common(top_users)
+        }
+
+    def format(self, patterns: Sequence[str], top_users: int = 10) -> str:
+        """
+        Format the summary as a text report.
+
+        Args:
+            patterns: Rule set the verdicts were produced with
+            top_users: Number of most-flagged users listed
+
+        Returns:
+            Multi-line report
+        """
+        summary = self.as_dict(top_users)
+        lines = [
+            f"Prompts: {summary['prompts']:,}  flagged: {summary['flagged']:,} "
+            f"({summary['hit_rate']:.2%})  invalid lines: {summary['invalid']:,}",
+            "Reasons: " + (", ".join(f"{name} {count:,}" for name, count in sorted(self.reasons.items())) or "none"),
+            "",
+            f"{'rule':>5}{'hits':>12}{'rate':>9}  pattern"
+        ]
+        for index, pattern in enumerate(patterns):
+            lines.append(f"{index:>5}{summary['rule_hits'][index]:>12,}{summary['rule_hit_rates'][index]:>9.3%}  {pattern[:50]}")
+        if summary["top_users"]:
+            lines.append("")
+            lines.append(f"{'flagged':>12}  user")
+            for user_id, count in summary["top_users"]:
+                lines.append(f"{count:>12,}  {user_id}")
+        return "\n".join(lines)
+
+
+# Per-process scan state (set by _init_scan_worker)
+_scan_map: Optional[mmap.mmap] = None
+_scan_prompt_fields: Tuple[str, ...] = DEFAULT_PROMPT_FIELDS
+_scan_user_field = "user_id"
+_scan_rule_index: Dict[str, int] = {}
+
+
+def _init_scan_worker(
+    path: str,
+    patterns: List[str],
+    prompt_fields: Tuple[str, ...],
+    user_field: str,
+    cache_size: int
+) -> None:
+    """Process pool initializer: map the input, adopt the rule set and compile it once."""
+    global _scan_map, _scan_prompt_fields, _scan_user_field, _scan_rule_index
+    prompt_injection_detector._init_batch_worker(patterns)
+    with open(path, "rb") as handle:
+        _scan_map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    _scan_prompt_fields = prompt_fields
+    _scan_user_field = user_field
+    _scan_rule_index = {pattern: index for index, pattern in enumerate(INJECTION_PATTERNS)}
+    if cache_size:
+        # Logs repeat bot prompts; each distinct prompt is scanned once per worker
+        enable_verdict_cache(max_entries=cache_size, ttl_seconds=None)
+
+
+def _verdict_line(line: bytes) -> Optional[Tuple[str, List[int], str]]:
+    """Score one JSONL record; returns (code, rule indexes, user ID), or None to skip it."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return CODE_INVALID, [], ""
+    if not isinstance(record, dict):
+        return CODE_INVALID, [], ""
+    if record.get("type", SCANNED_TYPE) != SCANNED_TYPE:
+        # request_log.py chat/stream records repeat a prompt its detection record has
+        return None
+    prompt = None
+    for field in _scan_prompt_fields:
+        value = record.get(field)
+        if isinstance(value, str):
+            prompt = value
+            break
+    if prompt is None:
+        return CODE_INVALID, [], ""
+    user_id = record.get(_scan_user_field)
+    user_id = "" if user_id is None else str(user_id).replace("\t", " ").replace("\n", " ")
+
+    is_injection, _, metadata = detect_prompt_injection(prompt, user_id or None)
+    if not is_injection:
+        return CODE_CLEAN, [], user_id
+    code = ""
+    rules = [_scan_rule_index.get(match.pattern, -1) for match in metadata.rule_matches]
+    if rules:
+        code += CODE_RULE
+    if metadata.high_repetition:
+        code += CODE_REPETITION
+    if metadata.extremely_long_prompt:
+        code += CODE_LENGTH
+    return code, rules, user_id
+
+
+def _scan_block(start: int, end: int) -> Tuple[int, int, bytes, ScanSummary]:
+    """
+    Score the lines that begin in [start, end) of the mapped input.
+
+    A line belongs to the block its first byte falls in, so blocks can be
+    cut at arbitrary offsets (including a resumed checkpoint offset).
+
+    Returns:
+        (start, end, verdict lines, summary of the block)
+    """
+    data = _scan_map
+    size = len(data)
+    position = start
+    if start > 0 and data[start - 1] != 0x0A:
+        newline = data.find(b"\n", start)
+        position = size if newline == -1 else newline + 1
+
+    summary = ScanSummary(len(INJECTION_PATTERNS))
+    output = []
+    while position < end:
+        newline = data.find(b"\n", position)
+        stop = size if newline == -1 else newline
+        line = data[position:stop].strip()
+        verdict = _verdict_line(line) if line else None
+        if verdict is not None:
+            code, rules, user_id = verdict
+            summary.add(code, rules, user_id)
+            output.append(f"{position}\t{code}\t{','.join(map(str, rules))}\t{user_id}\n")
+        position = stop + 1
+    return start, end, "".join(output).encode("utf-8"), summary
+
+
+def _rules_digest(patterns: Sequence[str]) -> str:
+    import hashlib
+    return hashlib.sha256("\n".join(patterns).encode("utf-8")).hexdigest()[:16]
+
+
+def _write_checkpoint(path: str, state: Dict[str, Any]) -> None:
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        json.dump(state, handle)
+    os.replace(temporary, path)
+
+
+def scan(
+    input_path: str,
+    output_path: str,
+    workers: Optional[int] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    prompt_field: Optional[str] = None,
+    user_field: str = "user_id",
+    resume: bool = False,
+    checkpoint_path: Optional[str] = None,
+    checkpoint_interval: float = 5.0,
+    cache_size: int = 10000,
+    progress: bool = False
+) -> ScanSummary:
+    """
+    Scan a JSONL log and write one verdict line per record.
+
+    The input is memory-mapped and cut into blocks that worker processes
+    score independently; verdicts are written in input order. Each verdict
+    line is tab-separated:
+
+        <byte offset of the record>  <code>  <rule indexes>  <user ID>
+
+    where code is "-" (clean), "E" (unparsable or no prompt field) or a
+    combination of "R" (rule match), "F" (repetition) and "L" (length).
+    Records with a "type" other than "detection" (request_log.py usage
+    records) get no verdict line, so each screened prompt counts once.
+    The checkpoint records how far input and output are complete, so an
+    interrupted scan continues with resume=True.
+
+    Args:
+        input_path: JSONL file with one request per line
+        output_path: Verdict file
+        workers: Worker processes (default: CPU count; 1 scans in-process)
+        block_size: Input bytes per worker task
+        prompt_field: Record field holding the prompt (default: the first of
+            DEFAULT_PROMPT_FIELDS that is present)
+        user_field: Record field holding the user ID
+        resume: Continue from the checkpoint instead of starting over
+        checkpoint_path: Checkpoint file (default: output_path + ".checkpoint")
+        checkpoint_interval: Seconds between checkpoint writes
+        cache_size: Per-worker verdict cache entries (0 disables it)
+        progress: Print progress to stderr at every checkpoint
+
+    Returns:
+        ScanSummary of the whole input (including resumed work)
+    """
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+    patterns = list(INJECTION_PATTERNS)
+    prompt_fields = (prompt_field,) if prompt_field else DEFAULT_PROMPT_FIELDS
+    size = os.path.getsize(input_path)
+    state = {
+        "input": os.path.abspath(input_path),
+        "rules": _rules_digest(patterns),
+        "prompt_fields": list(prompt_fields),
+        "user_field": user_field,
+        "offset": 0,
+        "output_offset": 0
+    }
+
+    summary = ScanSummary(len(patterns))
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding="utf-8") as handle:
+            saved = json.load(handle)
+        for key in ("input", "rules", "prompt_fields", "user_field"):
+            if saved.get(key) != state[key]:
+                raise ValueError(f"Checkpoint {checkpoint_path} was written with a different {key}; rescan without resume")
+        if saved["offset"] > size:
+            raise ValueError(f"{input_path} is shorter than the checkpoint offset")
+        state["offset"] = saved["offset"]
+        state["output_offset"] = saved["output_offset"]
+        summary = ScanSummary.from_verdicts(output_path, len(patterns), state["output_offset"])
+        output = open(output_path, "r+b")
+        output.truncate(state["output_offset"])
+        output.seek(state["output_offset"])
+    else:
+        output = open(output_path, "wb")
+
+    blocks = iter(range(state["offset"], size, block_size))
+    initargs = (input_path, patterns, prompt_fields, user_field, cache_size)
+    started = time.perf_counter()
+    scanned_lines = summary.lines
+    last_checkpoint = started
+
+    def commit(end: int, data: bytes, block_summary: ScanSummary) -> None:
+        nonlocal last_checkpoint
+        output.write(data)
+        summary.merge(block_summary)
+        state["offset"] = end
+        state["output_offset"] += len(data)
+        now = time.perf_counter()
+        if now - last_checkpoint >= checkpoint_interval:
+            output.flush()
+            _write_checkpoint(checkpoint_path, state)
+            last_checkpoint = now
+            if progress:
+                rate = (summary.lines - scanned_lines) / (now - started)
+                print(f"{end / max(size, 1):6.1%}  {summary.lines:,} lines  {rate:,.0f} lines/s", file=sys.stderr)
+
+    try:
+        workers = workers or os.cpu_count() or 1
+        if state["offset"] >= size:
+            pass
+        elif workers == 1 or size - state["offset"] <= block_size:
+            # Scanning in-process must not leave the scan's verdict cache behind
+            verdict_cache = prompt_injection_detector._verdict_cache
+            _init_scan_worker(*initargs)
+            try:
+                for start in blocks:
+                    _, end, data, block_summary = _scan_block(start, min(start + block_size, size))
+                    commit(end, data, block_summary)
+            finally:
+                prompt_injection_detector._verdict_cache = verdict_cache
+                _scan_map.close()
+        else:
+            from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_scan_worker, initargs=initargs) as executor:
+                pending = set()
+                finished: Dict[int, Tuple[int, bytes, ScanSummary]] = {}
+                next_start = state["offset"]
+                max_pending = workers * 4
+                exhausted = False
+                while True:
+                    while not exhausted and len(pending) + len(finished) < max_pending:
+                        start = next(blocks, None)
+                        if start is None:
+                            exhausted = True
+                            break
+                        pending.add(executor.submit(_scan_block, start, min(start + block_size, size)))
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        start, end, data, block_summary = future.result()
+                        finished[start] = (end, data, block_summary)
+                    # Blocks complete out of order; output and checkpoint advance in order
+                    while next_start in finished:
+                        end, data, block_summary = finished.pop(next_start)
+                        commit(end, data, block_summary)
+                        next_start = end
+        state["offset"] = size
+    finally:
+        output.close()
+        _write_checkpoint(checkpoint_path, state)
+    return summary
+
+
+def main():
+    """
+    Command-line entry point for the corpus scanner.
+    """
+    parser = argparse.ArgumentParser(description="Re-score JSONL request logs with the Sentinel detector")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = commands.add_parser("scan", help="Scan a JSONL log and write verdicts")
+    scan_parser.add_argument("input", help="JSONL file, one request per line")
+    scan_parser.add_argument("-o", "--output", help="Verdict file (default: <input>.verdicts.tsv)")
+    scan_parser.add_argument("-j", "--workers", type=int, help="Worker processes (default: CPU count)")
+    scan_parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="Input bytes per worker task")
+    scan_parser.add_argument("--prompt-field", help=f"Field holding the prompt (default: first of {', '.join(DEFAULT_PROMPT_FIELDS)})")
+    scan_parser.add_argument("--user-field", default="user_id", help="Field holding the user ID")
+    scan_parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    scan_parser.add_argument("--cache-size", type=int, default=10000, help="Per-worker verdict cache entries (0: off)")
+    scan_parser.add_argument("--top-users", type=int, default=10, help="Users listed in the summary")
+    scan_parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+
+    summary_parser = commands.add_parser("summary", help="Summarize an existing verdict file")
+    summary_parser.add_argument("verdicts", help="Verdict file written by scan")
+    summary_parser.add_argument("--top-users", type=int, default=10, help="Users listed in the summary")
+    summary_parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+
+    args = parser.parse_args()
+    patterns = list(INJECTION_PATTERNS)
+    if args.command == "summary":
+        summary = ScanSummary.from_verdicts(args.verdicts, len(patterns))
+    else:
+        # Offline rescans must not show up in the live detector metrics
+        os.environ.setdefault("SENTINEL_METRICS", "0")
+        started = time.perf_counter()
+        try:
+            summary = scan(
+                args.input,
+                args.output or f"{args.input}.verdicts.tsv",
+                workers=args.workers,
+                block_size=args.block_size,
+                prompt_field=args.prompt_field,
+                user_field=args.user_field,
+                resume=args.resume,
+                cache_size=args.cache_size,
+                progress=not args.json
+            )
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            sys.exit(1)
+        elapsed = time.perf_counter() - started
+        if not args.json:
+            print(f"Scanned {summary.lines:,} lines in {elapsed:.1f}s")
+
+    if args.json:
+        print(json.dumps(summary.as_dict(args.top_users), indent=2))
+    else:
+        print(summary.format(patterns, args.top_users))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Shared Datadog API Client
+Long-lived, thread-safe API clients with keep-alive connection pooling and
+per-call credential overrides that never touch os.environ
+"""
+
+import atexit
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+try:
+    from dotenv import load_dotenv
+    # Load environment variables from .env file
+    load_dotenv()
+except ImportError:
+    # python-dotenv not installed, environment variables must be set manually
+    pass
+
+from datadog_api_client import ApiClient, Configuration
+from datadog_api_client import rest
+
+
+def resolve_credentials(
+    api_key: Optional[str] = None,
+    app_key: Optional[str] = None,
+    site: Optional[str] = None
+) -> Tuple[str, str, str]:
+    """
+    Resolve Datadog credentials, falling back to environment variables.
+
+    Args:
+        api_key: Datadog API key (optional, uses DD_API_KEY env var if not provided)
+        app_key: Datadog Application key (optional, uses DD_APP_KEY env var if not provided)
+        site: Datadog site (optional, uses DD_SITE env var if not provided)
+
+    Returns:
+        (api_key, app_key, site)
+    """
+    api_key = api_key or os.getenv("DD_API_KEY")
+    app_key = app_key or os.getenv("DD_APP_KEY")
+    site = site or os.getenv("DD_SITE", "datadoghq.com")
+
+    if not api_key:
+        raise ValueError("DD_API_KEY environment variable must be set")
+    if not app_key:
+        raise ValueError("DD_APP_KEY environment variable must be set")
+
+    return api_key, app_key, site
+
+
+def build_configuration(api_key: str, app_key: str, site: str) -> Configuration:
+    """
+    Build a Datadog Configuration for explicit credentials.
+
+    Args:
+        api_key: Datadog API key
+        app_key: Datadog Application key
+        site: Datadog site
+
+    Returns:
+        Configured Datadog Configuration object
+    """
+    configuration = Configuration()
+    configuration.api_key["apiKeyAuth"] = api_key
+    configuration.api_key["appKeyAuth"] = app_key
+    configuration.server_variables["site"] = site
+    return configuration
+
+
+class _PooledApiClient(ApiClient):
+    """ApiClient that uses a connection pool owned by DatadogClientManager."""
+
+    def __init__(self, configuration: Configuration, rest_client: "rest.RESTClientObject"):
+        self._shared_rest_client = rest_client
+        super().__init__(configuration)
+
+    def _build_rest_client(self):
+        return self._shared_rest_client
+
+    def close(self) -> None:
+        # The pool outlives individual callers; DatadogClientManager.close()
+        # releases it
+        pass
+
+
+class DatadogClientManager:
+    """
+    Hands out long-lived ApiClient instances, one per credential set.
+
+    Clients for the same site share one urllib3 pool, so keep-alive
+    connections (and their TLS sessions) are reused across calls, threads
+    and credential sets. Credentials live in each client's Configuration,
+    so per-call overrides never modify process-wide state. At most
+    max_clients credential sets are kept; the least recently used is
+    dropped when the limit is exceeded.
+    """
+
+    def __init__(self, max_clients: int = 16, pool_maxsize: Optional[int] = None):
+        """
+        Args:
+            max_clients: Maximum number of credential sets kept
+            pool_maxsize: Connections kept per host (default: DD_CLIENT_POOL_SIZE
+                env var or 8); also the number of requests that can run in
+                parallel without opening extra connections
+        """
+        if max_clients <= 0:
+            raise ValueError("max_clients must be positive")
+        self.max_clients = max_clients
+        self.pool_maxsize = pool_maxsize or int(os.getenv("DD_CLIENT_POOL_SIZE", "8"))
+        self._clients: "OrderedDict[Tuple[str, str, str], ApiClient]" = OrderedDict()
+        self._pools: Dict[str, "rest.RESTClientObject"] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self.clients_created = 0
+
+    def client(
+        self,
+        api_key: Optional[str] = None,
+        app_key: Optional[str] = None,
+        site: Optional[str] = None
+    ) -> ApiClient:
+        """
+        Return the shared client for a credential set.
+
+        The returned client may be used from any thread and must not be
+        closed by the caller; using it as a context manager is harmless.
+
+        Args:
+            api_key: Datadog API key (optional, uses DD_API_KEY env var if not provided)
+            app_key: Datadog Application key (optional, uses DD_APP_KEY env var if not provided)
+            site: Datadog site (optional, uses DD_SITE env var if not provided)
+
+        Returns:
+            Shared ApiClient
+        """
+        key = resolve_credentials(api_key, app_key, site)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Datadog client manager has been shut down")
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+
+            configuration = build_configuration(*key)
+            pool = self._pools.get(key[2])
+            if pool is None:
+                pool = rest.RESTClientObject(configuration, maxsize=self.pool_maxsize)
+                self._pools[key[2]] = pool
+            client = _PooledApiClient(configuration, pool)
+            self._clients[key] = client
+            self.clients_created += 1
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return client
+
+    def close(self) -> None:
+        """Close every pooled connection. Later client() calls raise RuntimeError."""
+        with self._lock:
+            self._closed = True
+            self._clients.clear()
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.pool_manager.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the manager state.
+
+        Returns:
+            Dictionary with clients, clients_created, pools and pool_maxsize
+        """
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "clients_created": self.clients_created,
+                "pools": len(self._pools),
+                "pool_maxsize": self.pool_maxsize
+            }
+
+
+_manager: Optional[DatadogClientManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_client_manager() -> DatadogClientManager:
+    """
+    Return the process-wide client manager, creating it on first use.
+
+    Returns:
+        Shared DatadogClientManager
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = DatadogClientManager()
+            atexit.register(shutdown_datadog_clients)
+        return _manager
+
+
+def get_api_client(
+    api_key: Optional[str] = None,
+    app_key: Optional[str] = None,
+    site: Optional[str] = None
+) -> ApiClient:
+    """
+    Return the shared ApiClient for the given (or environment) credentials.
+
+    Args:
+        api_key: Datadog API key (optional, uses DD_API_KEY env var if not provided)
+        app_key: Datadog Application key (optional, uses DD_APP_KEY env var if not provided)
+        site: Datadog site (optional, uses DD_SITE env var if not provided)
+
+    Returns:
+        Shared ApiClient
+    """
+    return get_client_manager().client(api_key, app_key, site)
+
+
+def shutdown_datadog_clients() -> None:
+    """Close the shared client manager (a new one is created on next use)."""
+    global _manager
+    with _manager_lock:
+        manager, _manager = _manager, None
+    if manager is not None:
+        manager.close()
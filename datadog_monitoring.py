@@ -4,56 +4,67 @@ Datadog Monitoring and Case Management Integration
 - Case creation for prompt injection detection
 """
 
-import os
 import json
-from dotenv import load_dotenv
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, TYPE_CHECKING
 
-# Load environment variables from .env file
-load_dotenv()
-from datadog_api_client import ApiClient, Configuration
-from datadog_api_client.v1.api.monitors_api import MonitorsApi
-from datadog_api_client.v1.model.monitor import Monitor
-from datadog_api_client.v1.model.monitor_type import MonitorType
-from datadog_api_client.v1.model.monitor_options import MonitorOptions
-from datadog_api_client.v1.model.monitor_thresholds import MonitorThresholds
+# datadog_api_client is imported on first use: it takes ~100 ms to import and
+# most importers (detector workers, CLI tools) never talk to Datadog
+if TYPE_CHECKING:
+    from datadog_api_client import Configuration
 
-# Cases API imports - may not be available in all versions
-try:
-    from datadog_api_client.v2.api.cases_api import CasesApi
-    from datadog_api_client.v2.model.case_create import CaseCreate
-    from datadog_api_client.v2.model.case_create_attributes import CaseCreateAttributes
-    from datadog_api_client.v2.model.case_create_relationships import CaseCreateRelationships
-    from datadog_api_client.v2.model.case_create_relationships_assignee import CaseCreateRelationshipsAssignee
-    from datadog_api_client.v2.model.case_create_relationships_assignee_data import CaseCreateRelationshipsAssigneeData
-    CASES_API_AVAILABLE = True
-except ImportError:
-    # Cases API not available in this version of datadog-api-client
-    CASES_API_AVAILABLE = False
+
+@lru_cache(maxsize=None)
+def _cases_api_available() -> bool:
+    # Cases API imports - may not be available in all versions
+    try:
+        from datadog_api_client.v2.api.cases_api import CasesApi  # noqa: F401
+        from datadog_api_client.v2.model.case_create import CaseCreate  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=None)
+def _case_comments_available() -> bool:
+    # Case comments were added to the Cases API later than case creation
+    if not _cases_api_available():
+        return False
+    try:
+        from datadog_api_client.v2.model.case_comment_request import CaseCommentRequest  # noqa: F401
+    except ImportError:
+        return False
+    return True
 
 
-def get_datadog_config() -> Configuration:
+def __getattr__(name: str) -> Any:
+    # CASES_API_AVAILABLE / CASE_COMMENTS_AVAILABLE are resolved lazily
+    if name == "CASES_API_AVAILABLE":
+        return _cases_api_available()
+    if name == "CASE_COMMENTS_AVAILABLE":
+        return _case_comments_available()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_datadog_config(
+    api_key: Optional[str] = None,
+    app_key: Optional[str] = None,
+    site: Optional[str] = None
+) -> "Configuration":
     """
-    Initialize Datadog API configuration from environment variables.
+    Initialize Datadog API configuration from explicit keys or environment variables.
+    
+    Args:
+        api_key: Datadog API key (optional, uses DD_API_KEY env var if not provided)
+        app_key: Datadog Application key (optional, uses DD_APP_KEY env var if not provided)
+        site: Datadog site (optional, uses DD_SITE env var if not provided)
     
     Returns:
         Configured Datadog Configuration object
     """
-    api_key = os.getenv("DD_API_KEY")
-    app_key = os.getenv("DD_APP_KEY")
-    site = os.getenv("DD_SITE", "datadoghq.com")
-    
-    if not api_key:
-        raise ValueError("DD_API_KEY environment variable must be set")
-    if not app_key:
-        raise ValueError("DD_APP_KEY environment variable must be set")
-    
-    configuration = Configuration()
-    configuration.api_key["apiKeyAuth"] = api_key
-    configuration.api_key["appKeyAuth"] = app_key
-    configuration.server_variables["site"] = site
+    from datadog_client import build_configuration, resolve_credentials
     
-    return configuration
+    return build_configuration(*resolve_credentials(api_key, app_key, site))
 
 
 def create_dow_monitor(
@@ -61,13 +72,15 @@ def create_dow_monitor(
     evaluation_window: str = "last_5m",
     api_key: Optional[str] = None,
     app_key: Optional[str] = None,
-    site: Optional[str] = None
+    site: Optional[str] = None,
+    warning_threshold: Optional[float] = None
 ) -> Dict[str, Any]:
     """
     Create a Datadog monitor for Denial of Wallet (DoW) attack detection.
     
     This monitor alerts when llm.usage.total_tokens exceeds a threshold,
-    indicating potential DoW attacks.
+    indicating potential DoW attacks. Thresholds can be derived from
+    historical usage with dow_thresholds.py.
     
     Args:
         threshold: Token threshold to trigger alert (default: 100000)
@@ -75,21 +88,23 @@ def create_dow_monitor(
         api_key: Datadog API key (optional, uses DD_API_KEY env var if not provided)
         app_key: Datadog Application key (optional, uses DD_APP_KEY env var if not provided)
         site: Datadog site (optional, uses DD_SITE env var if not provided)
+        warning_threshold: Token threshold for a warning (default: half of threshold)
     
     Returns:
         Dictionary containing monitor creation response
     """
-    # Temporarily override env vars if provided
-    if api_key:
-        os.environ["DD_API_KEY"] = api_key
-    if app_key:
-        os.environ["DD_APP_KEY"] = app_key
-    if site:
-        os.environ["DD_SITE"] = site
+    if warning_threshold is None:
+        warning_threshold = threshold * 0.5
     
-    configuration = get_datadog_config()
+    from datadog_api_client.v1.api.monitors_api import MonitorsApi
+    from datadog_api_client.v1.model.monitor import Monitor
+    from datadog_api_client.v1.model.monitor_type import MonitorType
+    from datadog_api_client.v1.model.monitor_options import MonitorOptions
+    from datadog_api_client.v1.model.monitor_thresholds import MonitorThresholds
+    from datadog_client import get_api_client
     
-    with ApiClient(configuration) as api_client:
+    # Shared pooled client; explicit keys override the environment for this call only
+    with get_api_client(api_key, app_key, site) as api_client:
         monitors_api = MonitorsApi(api_client)
         
         query = f"sum({evaluation_window}):sum:llm.usage.total_tokens{{*}}.as_count() > {threshold}"
@@ -116,7 +131,7 @@ def create_dow_monitor(
                 ),
                 thresholds=MonitorThresholds(
                     critical=float(threshold),
-                    warning=float(threshold * 0.5)
+                    warning=float(warning_threshold)
                 ),
                 evaluation_delay=0,
                 new_host_delay=300,
@@ -164,24 +179,23 @@ def create_prompt_injection_case(
     Returns:
         Dictionary containing case creation response
     """
-    if not CASES_API_AVAILABLE:
+    if not _cases_api_available():
         return {
             "success": False,
             "error": "Cases API not available in this version of datadog-api-client",
             "message": "Cases API is not available. Please use Datadog API directly or upgrade datadog-api-client."
         }
     
-    # Temporarily override env vars if provided
-    if api_key:
-        os.environ["DD_API_KEY"] = api_key
-    if app_key:
-        os.environ["DD_APP_KEY"] = app_key
-    if site:
-        os.environ["DD_SITE"] = site
-    
-    configuration = get_datadog_config()
+    from datadog_api_client.v2.api.cases_api import CasesApi
+    from datadog_api_client.v2.model.case_create import CaseCreate
+    from datadog_api_client.v2.model.case_create_attributes import CaseCreateAttributes
+    from datadog_api_client.v2.model.case_create_relationships import CaseCreateRelationships
+    from datadog_api_client.v2.model.case_create_relationships_assignee import CaseCreateRelationshipsAssignee
+    from datadog_api_client.v2.model.case_create_relationships_assignee_data import CaseCreateRelationshipsAssigneeData
+    from datadog_client import get_api_client
     
-    with ApiClient(configuration) as api_client:
+    # Shared pooled client; explicit keys override the environment for this call only
+    with get_api_client(api_key, app_key, site) as api_client:
         cases_api = CasesApi(api_client)
         
         # Build case title and description
@@ -250,6 +264,69 @@ def create_prompt_injection_case(
             }
 
 
+def comment_prompt_injection_case(
+    case_id: str,
+    comment: str,
+    api_key: Optional[str] = None,
+    app_key: Optional[str] = None,
+    site: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Append a comment to an existing prompt injection case.
+    
+    Used to add summaries of repeated detections to an open case instead of
+    creating a new case for every prompt.
+    
+    Args:
+        case_id: ID of the case to comment on
+        comment: Comment text (Markdown)
+        api_key: Datadog API key (optional, uses DD_API_KEY env var if not provided)
+        app_key: Datadog Application key (optional, uses DD_APP_KEY env var if not provided)
+        site: Datadog site (optional, uses DD_SITE env var if not provided)
+    
+    Returns:
+        Dictionary containing comment creation response
+    """
+    if not _case_comments_available():
+        return {
+            "success": False,
+            "error": "Case comments not available in this version of datadog-api-client",
+            "message": "Case comments are not available. Please upgrade datadog-api-client."
+        }
+    
+    from datadog_api_client.v2.api.cases_api import CasesApi
+    from datadog_api_client.v2.model.case_comment import CaseComment
+    from datadog_api_client.v2.model.case_comment_attributes import CaseCommentAttributes
+    from datadog_api_client.v2.model.case_comment_request import CaseCommentRequest
+    from datadog_api_client.v2.model.case_resource_type import CaseResourceType
+    from datadog_client import get_api_client
+    
+    # Shared pooled client; explicit keys override the environment for this call only
+    with get_api_client(api_key, app_key, site) as api_client:
+        cases_api = CasesApi(api_client)
+        
+        body = CaseCommentRequest(
+            data=CaseComment(
+                attributes=CaseCommentAttributes(comment=comment),
+                type=CaseResourceType("case")
+            )
+        )
+        
+        try:
+            cases_api.comment_case(case_id, body=body)
+            return {
+                "success": True,
+                "case_id": case_id,
+                "message": f"Comment added to case {case_id}"
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "message": f"Failed to comment on case: {e}"
+            }
+
+
 def load_monitor_from_json(json_path: str) -> Dict[str, Any]:
     """
     Load monitor definition from JSON file.
@@ -284,17 +361,12 @@ def create_monitor_from_json(
     """
     monitor_def = load_monitor_from_json(json_path)
     
-    # Temporarily override env vars if provided
-    if api_key:
-        os.environ["DD_API_KEY"] = api_key
-    if app_key:
-        os.environ["DD_APP_KEY"] = app_key
-    if site:
-        os.environ["DD_SITE"] = site
-    
-    configuration = get_datadog_config()
+    from datadog_api_client.v1.api.monitors_api import MonitorsApi
+    from datadog_api_client.v1.model.monitor import Monitor
+    from datadog_client import get_api_client
     
-    with ApiClient(configuration) as api_client:
+    # Shared pooled client; explicit keys override the environment for this call only
+    with get_api_client(api_key, app_key, site) as api_client:
         monitors_api = MonitorsApi(api_client)
         
         monitor = Monitor(**monitor_def)
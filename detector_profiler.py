@@ -0,0 +1,213 @@
+"""
+Detector Profiling
+Opt-in per-rule and per-phase timing for detect_prompt_injection, used to
+find expensive or never-firing rules in INJECTION_PATTERNS
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, List, Sequence
+
+
+# Upper bounds (characters) of the prompt length buckets; the last is open
+LENGTH_BUCKETS = (64, 256, 1024, 4096, 16384, 65536)
+
+
+def length_bucket(length: int) -> str:
+    """
+    Return the label of a prompt length's bucket.
+
+    Args:
+        length: Prompt length in characters
+
+    Returns:
+        Label such as "<=256" or ">65536"
+    """
+    for bound in LENGTH_BUCKETS:
+        if length <= bound:
+            return f"<={bound}"
+    return f">{LENGTH_BUCKETS[-1]}"
+
+
+class DetectorProfiler:
+    """
+    Accumulates detector timings while profiling is enabled.
+
+    Per rule: how often its full regex ran (rules skipped by the keyword
+    prefilter cost nothing and are not counted), total and worst time, and
+    how often it matched. Per phase ("prefilter", "rules", "repetition",
+    "base64", "cache"; "rules" includes "prefilter"): calls and time. Per prompt length bucket:
+    prompts and total time. All times are nanoseconds from
+    time.perf_counter_ns().
+
+    With a dump_path, a daemon thread writes stats() as JSON every
+    dump_interval seconds (and once more at exit).
+    """
+
+    def __init__(
+        self,
+        patterns: Sequence[str],
+        dump_path: Optional[str] = None,
+        dump_interval: float = 60.0
+    ):
+        """
+        Args:
+            patterns: Rule set being profiled (rules are reported by index and pattern)
+            dump_path: JSON file for periodic dumps (None: no dumps)
+            dump_interval: Seconds between dumps
+        """
+        self.patterns = list(patterns)
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        size = len(self.patterns)
+        self._rule_runs = [0] * size
+        self._rule_ns = [0] * size
+        self._rule_max_ns = [0] * size
+        self._rule_matches = [0] * size
+        # phase -> [calls, total ns]
+        self._phases: Dict[str, List[int]] = {}
+        # bucket -> [prompts, total ns, injections]
+        self._lengths: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.started_at = time.time()
+        if dump_path:
+            threading.Thread(target=self._run, name="sentinel-detector-profile", daemon=True).start()
+            atexit.register(self.dump)
+
+    def record_rule(self, index: int, elapsed_ns: int, matched: bool) -> None:
+        """Record one full-regex evaluation of a rule."""
+        with self._lock:
+            if index >= len(self._rule_runs):
+                return
+            self._rule_runs[index] += 1
+            self._rule_ns[index] += elapsed_ns
+            if elapsed_ns > self._rule_max_ns[index]:
+                self._rule_max_ns[index] = elapsed_ns
+            if matched:
+                self._rule_matches[index] += 1
+
+    def record_phase(self, phase: str, elapsed_ns: int) -> None:
+        """Record time spent in a detector phase."""
+        with self._lock:
+            entry = self._phases.get(phase)
+            if entry is None:
+                entry = self._phases[phase] = [0, 0]
+            entry[0] += 1
+            entry[1] += elapsed_ns
+
+    def record_prompt(self, length: int, elapsed_ns: int, is_injection: bool) -> None:
+        """Record a whole detect_prompt_injection call."""
+        bucket = length_bucket(length)
+        with self._lock:
+            entry = self._lengths.get(bucket)
+            if entry is None:
+                entry = self._lengths[bucket] = [0, 0, 0]
+            entry[0] += 1
+            entry[1] += elapsed_ns
+            entry[2] += int(is_injection)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the profile.
+
+        Returns:
+            Dictionary with "rules" (sorted by total time, most expensive
+            first), "phases" and "prompt_lengths"; times in microseconds
+        """
+        with self._lock:
+            rules = [
+                {
+                    "index": index,
+                    "pattern": pattern,
+                    "evaluations": self._rule_runs[index],
+                    "matches": self._rule_matches[index],
+                    "total_us": self._rule_ns[index] / 1000,
+                    "mean_us": self._rule_ns[index] / 1000 / self._rule_runs[index] if self._rule_runs[index] else 0.0,
+                    "max_us": self._rule_max_ns[index] / 1000
+                }
+                for index, pattern in enumerate(self.patterns)
+            ]
+            phases = {
+                phase: {"calls": calls, "total_us": total / 1000, "mean_us": total / 1000 / calls}
+                for phase, (calls, total) in self._phases.items()
+            }
+            lengths = {
+                bucket: {
+                    "prompts": prompts,
+                    "injections": injections,
+                    "total_us": total / 1000,
+                    "mean_us": total / 1000 / prompts
+                }
+                for bucket, (prompts, total, injections) in self._lengths.items()
+            }
+        rules.sort(key=lambda rule: -rule["total_us"])
+        return {
+            "since": self.started_at,
+            "rules": rules,
+            "phases": phases,
+            "prompt_lengths": lengths
+        }
+
+    def report(self, top: int = 10) -> str:
+        """
+        Format the most expensive rules and the phase breakdown as text.
+
+        Args:
+            top: Number of rules listed
+
+        Returns:
+            Multi-line report
+        """
+        snapshot = self.stats()
+        lines = [f"{'rule':>5}{'evals':>9}{'matches':>9}{'total ms':>10}{'mean us':>9}{'max us':>9}  pattern"]
+        for rule in snapshot["rules"][:top]:
+            lines.append(
+                f"{rule['index']:>5}{rule['evaluations']:>9}{rule['matches']:>9}"
+                f"{rule['total_us'] / 1000:>10.2f}{rule['mean_us']:>9.2f}{rule['max_us']:>9.1f}  {rule['pattern'][:50]}"
+            )
+        never = [rule["index"] for rule in snapshot["rules"] if rule["evaluations"] and not rule["matches"]]
+        if never:
+            lines.append(f"Evaluated but never matched: {sorted(never)}")
+        lines.append("")
+        lines.append(f"{'phase':<12}{'calls':>9}{'total ms':>10}{'mean us':>9}")
+        for phase, entry in sorted(snapshot["phases"].items(), key=lambda item: -item[1]["total_us"]):
+            lines.append(f"{phase:<12}{entry['calls']:>9}{entry['total_us'] / 1000:>10.2f}{entry['mean_us']:>9.2f}")
+        lines.append("")
+        lines.append(f"{'length':<12}{'prompts':>9}{'flagged':>9}{'mean us':>9}")
+        for bound in [length_bucket(bound) for bound in LENGTH_BUCKETS] + [length_bucket(LENGTH_BUCKETS[-1] + 1)]:
+            entry = snapshot["prompt_lengths"].get(bound)
+            if entry:
+                lines.append(f"{bound:<12}{entry['prompts']:>9}{entry['injections']:>9}{entry['mean_us']:>9.2f}")
+        return "\n".join(lines)
+
+    def dump(self, path: Optional[str] = None) -> None:
+        """
+        Write stats() as JSON, atomically replacing the file.
+
+        Args:
+            path: Destination (default: dump_path)
+        """
+        path = path or self.dump_path
+        if not path:
+            return
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(self.stats(), handle, indent=2)
+        os.replace(temporary, path)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.dump_interval):
+            try:
+                self.dump()
+            except OSError as e:
+                print(f"Error writing detector profile: {e}")
+
+    def close(self) -> None:
+        """Stop periodic dumps, including the one at exit."""
+        self._stop.set()
+        if self.dump_path:
+            atexit.unregister(self.dump)
@@ -0,0 +1,482 @@
+"""
+Adaptive DoW Thresholds
+Derives Denial of Wallet monitor thresholds from historical token usage in
+request logs, using quantile sketches per time of day and user tier
+
+Usage:
+    python dow_thresholds.py logs/requests*.jsonl* --window last_5m
+    python dow_thresholds.py logs/new*.jsonl --state dow_state.json --tiers tiers.json
+    python setup_monitor.py adaptive logs/requests*.jsonl*
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import sys
+from typing import Optional, Dict, Any, List, Iterable, Sequence, Tuple
+
+from log_columns import parse_duration, read_records, record_time
+from quantile_sketch import DDSketch
+
+
+# Chat request kinds that charge tokens (request_log.py record types)
+USAGE_KINDS = ("chat", "stream")
+
+DEFAULT_TIER = "default"
+
+# propose() refuses baselines with more skipped records than this fraction
+MAX_SKIPPED_FRACTION = 0.01
+
+# ... or with a traffic gap longer than this (e.g. a stray old timestamp)
+MAX_GAP_SECONDS = 7 * 86400
+
+
+class DowBaseline:
+    """
+    Streams token usage into per-window totals and quantile sketches.
+
+    Tokens are summed over fixed windows of window_seconds, as the DoW
+    monitor does over its evaluation window. Each closed window adds:
+    - its total to the sketch for its time-of-day bucket (UTC), empty
+      windows included, since quiet periods are part of the baseline
+    - each active user's total to that user's tier sketch (overall and per
+      time-of-day bucket), to size per-user limits by tier
+
+    Only windows that can still receive records are kept in memory: a
+    window closes once records lateness seconds past its end have been
+    seen, and records for a closed window are counted as late and skipped.
+    Memory therefore depends on window size and concurrent users, not on
+    how much history is scanned. Records without a valid timestamp are
+    counted as invalid and skipped. The whole state (sketches and the first
+    window still open) can be saved and restored to add new logs later.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 300.0,
+        tiers: Optional[Dict[str, str]] = None,
+        time_of_day_buckets: int = 24,
+        lateness: Optional[float] = None,
+        relative_accuracy: float = 0.01
+    ):
+        """
+        Args:
+            window_seconds: Monitor evaluation window (300 for "last_5m")
+            tiers: User ID -> tier (default: a record's "tier" field, else "default")
+            time_of_day_buckets: Buckets per day (24: hourly)
+            lateness: Seconds a window stays open after it ends (default: one window)
+            relative_accuracy: Sketch relative accuracy
+        """
+        self.window_seconds = window_seconds
+        self.tiers = tiers or {}
+        self.time_of_day_buckets = time_of_day_buckets
+        self.lateness = window_seconds if lateness is None else lateness
+        self.relative_accuracy = relative_accuracy
+        self.windows = [DDSketch(relative_accuracy) for _ in range(time_of_day_buckets)]
+        self.user_windows: Dict[str, List[DDSketch]] = {}
+        self.next_window: Optional[int] = None
+        self.late_records = 0
+        self.invalid_records = 0
+        # Records already in a restored baseline (see from_dict); not saved
+        self.repeated_records = 0
+        self.resumed_window: Optional[int] = None
+        self.records = 0
+        # Longest run of empty windows, and the run currently open
+        self.longest_gap = 0
+        self._empty_run = 0
+        # window -> [total tokens, {user: tokens}, {user: tier}]
+        self._open: Dict[int, list] = {}
+        self._watermark = -math.inf
+
+    def _bucket(self, window: int) -> int:
+        seconds_of_day = (window * self.window_seconds) % 86400
+        return int(seconds_of_day * self.time_of_day_buckets // 86400)
+
+    def _tier_sketches(self, tier: str) -> List[DDSketch]:
+        sketches = self.user_windows.get(tier)
+        if sketches is None:
+            # Index time_of_day_buckets holds the tier's all-day sketch
+            sketches = self.user_windows[tier] = [
+                DDSketch(self.relative_accuracy) for _ in range(self.time_of_day_buckets + 1)
+            ]
+        return sketches
+
+    def add(self, ts: float, tokens: int, user_id: Optional[str] = None, tier: Optional[str] = None) -> None:
+        """
+        Add one request's token usage.
+
+        Args:
+            ts: Request time (epoch seconds)
+            tokens: Tokens charged
+            user_id: User who made the request
+            tier: User's tier (default: from tiers, else "default")
+        """
+        window = int(ts // self.window_seconds)
+        if self.next_window is None:
+            self.next_window = window
+        elif window < self.next_window:
+            if self.resumed_window is not None and window < self.resumed_window:
+                self.repeated_records += 1
+            else:
+                self.late_records += 1
+            return
+        self.records += 1
+        entry = self._open.get(window)
+        if entry is None:
+            entry = self._open[window] = [0, {}, {}]
+        entry[0] += tokens
+        user = user_id or ""
+        entry[1][user] = entry[1].get(user, 0) + tokens
+        entry[2][user] = self.tiers.get(user) or tier or DEFAULT_TIER
+        if ts > self._watermark:
+            self._watermark = ts
+            closable = int((ts - self.lateness) // self.window_seconds)
+            if closable > self.next_window:
+                self._close_before(closable)
+
+    def add_records(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Add request_log.py records (chat and stream records only).
+
+        Args:
+            records: Parsed JSONL records
+        """
+        for record in records:
+            if record.get("type") in USAGE_KINDS:
+                ts = record_time(record)
+                if ts is None:
+                    self.invalid_records += 1
+                    continue
+                self.add(ts, int(record.get("tokens") or 0), record.get("user_id"), record.get("tier"))
+
+    def _close_before(self, end_window: int) -> None:
+        """Close every window before end_window, in order."""
+        while self.next_window < end_window:
+            window = self.next_window
+            entry = self._open.pop(window, None)
+            if entry is None:
+                # Empty windows up to the next one with traffic are counted in bulk
+                upcoming = min(min(self._open, default=end_window), end_window)
+                self._add_empty(window, upcoming)
+                self._empty_run += upcoming - window
+                self.longest_gap = max(self.longest_gap, self._empty_run)
+                window = upcoming - 1
+            else:
+                self._empty_run = 0
+                bucket = self._bucket(window)
+                total, users, tiers = entry
+                self.windows[bucket].add(total)
+                for user, tokens in users.items():
+                    sketches = self._tier_sketches(tiers[user])
+                    sketches[bucket].add(tokens)
+                    sketches[-1].add(tokens)
+            self.next_window = window + 1
+
+    def _add_empty(self, start: int, end: int) -> None:
+        """Count the empty windows in [start, end) per time-of-day bucket."""
+        if end <= start:
+            return
+        per_day = 86400 / self.window_seconds
+        if per_day.is_integer() and end - start > per_day:
+            # Whole days contribute the same count to every bucket
+            days = (end - start) // int(per_day)
+            counts = [0] * self.time_of_day_buckets
+            for window in range(start, start + int(per_day)):
+                counts[self._bucket(window)] += days
+            for window in range(start + days * int(per_day), end):
+                counts[self._bucket(window)] += 1
+            for bucket, count in enumerate(counts):
+                if count:
+                    self.windows[bucket].add(0, count)
+            return
+        for window in range(start, end):
+            self.windows[self._bucket(window)].add(0)
+
+    def finish(self) -> None:
+        """Close all open windows (call once the input is exhausted)."""
+        if self._open:
+            self._close_before(max(self._open) + 1)
+        self._watermark = -math.inf
+
+    def overall(self) -> DDSketch:
+        """Sketch of window totals across all times of day."""
+        sketch = DDSketch(self.relative_accuracy)
+        for bucket in self.windows:
+            sketch.merge(bucket)
+        return sketch
+
+    def propose(
+        self,
+        warning_quantile: float = 0.99,
+        critical_quantile: float = 0.999,
+        headroom: float = 1.5,
+        min_threshold: int = 1000,
+        max_skipped_fraction: float = MAX_SKIPPED_FRACTION,
+        max_gap_seconds: float = MAX_GAP_SECONDS
+    ) -> Dict[str, Any]:
+        """
+        Propose monitor thresholds from the baseline.
+
+        The monitor has a single threshold, so it is sized for the busiest
+        time of day: warning is the highest per-bucket warning_quantile
+        (usage above the normal peak) and critical headroom times the
+        highest per-bucket critical_quantile. The
+        per-bucket and per-tier figures show how far quieter hours and
+        individual users sit below that, e.g. for per-user token budgets
+        (token_budget.py) that catch slow attacks the global monitor cannot.
+
+        Logs with many invalid or late records, or a long gap without any
+        traffic (typically a stray timestamp far from the rest), would
+        yield meaningless thresholds, so they are refused.
+
+        Args:
+            warning_quantile: Window quantile the warning threshold is based on
+            critical_quantile: Window quantile the critical threshold is based on
+            headroom: Factor applied on top of the critical quantile
+            min_threshold: Lowest critical threshold proposed
+            max_skipped_fraction: Largest accepted fraction of invalid and
+                late records
+            max_gap_seconds: Longest accepted period without traffic
+
+        Raises:
+            ValueError: If the baseline fails the checks above
+
+        Returns:
+            Dictionary with critical, warning, window_seconds, windows,
+            records, late_records, invalid_records, repeated_records,
+            longest_gap_seconds,
+            peak_bucket, buckets (per time-of-day
+            quantiles) and tiers (per-user window quantiles and a proposed
+            per-user limit for each tier)
+        """
+        buckets = []
+        for bucket, sketch in enumerate(self.windows):
+            if sketch.count:
+                buckets.append({
+                    "bucket": bucket,
+                    "start_hour_utc": bucket * 24 / self.time_of_day_buckets,
+                    "windows": sketch.count,
+                    "p50": sketch.quantile(0.5),
+                    "warning_quantile": sketch.quantile(warning_quantile),
+                    "critical_quantile": sketch.quantile(critical_quantile),
+                    "max": sketch.max
+                })
+        if not buckets:
+            return {"window_seconds": self.window_seconds, "windows": 0, "records": self.records}
+        skipped = self.invalid_records + self.late_records
+        if skipped > max_skipped_fraction * (self.records + skipped):
+            raise ValueError(
+                f"{skipped:,} of {self.records + skipped:,} usage records have no valid timestamp "
+                f"({self.invalid_records:,}) or arrived late ({self.late_records:,}); check the logs"
+            )
+        if self.longest_gap * self.window_seconds > max_gap_seconds:
+            raise ValueError(
+                f"The logs contain {self.longest_gap * self.window_seconds / 86400:,.1f} days without "
+                f"any traffic; check for stray timestamps or pass logs covering one period"
+            )
+
+        peak = max(buckets, key=lambda entry: entry["critical_quantile"])
+        critical = max(min_threshold, math.ceil(peak["critical_quantile"] * headroom))
+        warning = math.ceil(max(entry["warning_quantile"] for entry in buckets))
+        # The monitor requires warning < critical
+        warning = min(max(warning, 1), critical - 1)
+
+        tiers = {}
+        for tier, sketches in sorted(self.user_windows.items()):
+            overall = sketches[-1]
+            tiers[tier] = {
+                "user_windows": overall.count,
+                "p50": overall.quantile(0.5),
+                "warning_quantile": overall.quantile(warning_quantile),
+                "critical_quantile": overall.quantile(critical_quantile),
+                "max": overall.max,
+                "per_user_limit": math.ceil(overall.quantile(critical_quantile) * headroom)
+            }
+        return {
+            "critical": critical,
+            "warning": warning,
+            "window_seconds": self.window_seconds,
+            "windows": sum(entry["windows"] for entry in buckets),
+            "records": self.records,
+            "late_records": self.late_records,
+            "invalid_records": self.invalid_records,
+            "repeated_records": self.repeated_records,
+            "longest_gap_seconds": self.longest_gap * self.window_seconds,
+            "peak_bucket": peak["bucket"],
+            "buckets": buckets,
+            "tiers": tiers
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the closed-window state as JSON-serializable data (see from_dict)."""
+        return {
+            "window_seconds": self.window_seconds,
+            "time_of_day_buckets": self.time_of_day_buckets,
+            "relative_accuracy": self.relative_accuracy,
+            "next_window": self.next_window,
+            "records": self.records,
+            "late_records": self.late_records,
+            "invalid_records": self.invalid_records,
+            "longest_gap": self.longest_gap,
+            "empty_run": self._empty_run,
+            "windows": [sketch.to_dict() for sketch in self.windows],
+            "user_windows": {tier: [sketch.to_dict() for sketch in sketches] for tier, sketches in self.user_windows.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], tiers: Optional[Dict[str, str]] = None) -> "DowBaseline":
+        """
+        Restore a baseline saved with to_dict(); records older than its
+        last closed window are then counted as repeated and skipped, so
+        re-reading old logs does not count them twice.
+        """
+        baseline = cls(
+            window_seconds=data["window_seconds"],
+            tiers=tiers,
+            time_of_day_buckets=data["time_of_day_buckets"],
+            relative_accuracy=data["relative_accuracy"]
+        )
+        baseline.next_window = data["next_window"]
+        baseline.records = data["records"]
+        baseline.late_records = data["late_records"]
+        baseline.invalid_records = data["invalid_records"]
+        baseline.longest_gap = data["longest_gap"]
+        baseline._empty_run = data["empty_run"]
+        baseline.resumed_window = baseline.next_window
+        baseline.windows = [DDSketch.from_dict(sketch) for sketch in data["windows"]]
+        baseline.user_windows = {
+            tier: [DDSketch.from_dict(sketch) for sketch in sketches]
+            for tier, sketches in data["user_windows"].items()
+        }
+        return baseline
+
+
+def merged_records(paths: Sequence[str]) -> Iterable[Dict[str, Any]]:
+    """
+    Read several request logs as one stream ordered by timestamp.
+
+    Each file (one per process, or one per rotation) is in time order on
+    its own, so a k-way merge restores the global order without loading
+    the files.
+    """
+    # Records without a valid timestamp sort first; add_records() skips them
+    return heapq.merge(
+        *(read_records(path) for path in paths),
+        key=lambda record: record_time(record) or -math.inf
+    )
+
+
+def compute_thresholds(
+    paths: Sequence[str],
+    evaluation_window: str = "last_5m",
+    tiers: Optional[Dict[str, str]] = None,
+    state_path: Optional[str] = None,
+    headroom: float = 1.5
+) -> Tuple[Dict[str, Any], DowBaseline]:
+    """
+    Build (or extend) a baseline from request logs and propose thresholds.
+
+    Args:
+        paths: JSONL request logs (plain or gzipped)
+        evaluation_window: Monitor evaluation window, e.g. "last_5m"
+        tiers: User ID -> tier
+        state_path: Saved baseline to extend, and where the result is saved
+        headroom: Factor applied on top of the observed quantiles
+
+    Returns:
+        (proposal from DowBaseline.propose(), the baseline)
+
+    Raises:
+        ValueError: If the logs fail DowBaseline.propose()'s checks (the
+            state file is then left unchanged)
+    """
+    window_seconds = parse_duration(evaluation_window)
+    if state_path and os.path.exists(state_path):
+        with open(state_path, encoding="utf-8") as handle:
+            baseline = DowBaseline.from_dict(json.load(handle), tiers)
+        if baseline.window_seconds != window_seconds:
+            raise ValueError(f"{state_path} was built for {baseline.window_seconds:g}s windows")
+    else:
+        baseline = DowBaseline(window_seconds, tiers)
+    baseline.add_records(merged_records(paths))
+    baseline.finish()
+    proposal = baseline.propose(headroom=headroom)
+    if state_path:
+        temporary = f"{state_path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(baseline.to_dict(), handle)
+        os.replace(temporary, state_path)
+    return proposal, baseline
+
+
+def format_proposal(proposal: Dict[str, Any]) -> str:
+    """
+    Format a threshold proposal as a text report.
+
+    Args:
+        proposal: Result of DowBaseline.propose()
+
+    Returns:
+        Multi-line report
+    """
+    if not proposal.get("windows"):
+        return "No token usage records found"
+    lines = [
+        f"{proposal['records']:,} requests over {proposal['windows']:,} windows of "
+        f"{proposal['window_seconds']:g}s ({proposal['late_records']:,} late, "
+        f"{proposal['invalid_records']:,} invalid and {proposal['repeated_records']:,} repeated records skipped)",
+        f"Proposed thresholds: warning {proposal['warning']:,}  critical {proposal['critical']:,} tokens",
+        "",
+        f"{'UTC hour':>9}{'windows':>10}{'p50':>12}{'warn q':>12}{'crit q':>12}{'max':>12}"
+    ]
+    for entry in proposal["buckets"]:
+        marker = "  <- peak" if entry["bucket"] == proposal["peak_bucket"] else ""
+        lines.append(
+            f"{entry['start_hour_utc']:>9g}{entry['windows']:>10,}{entry['p50']:>12,.0f}"
+            f"{entry['warning_quantile']:>12,.0f}{entry['critical_quantile']:>12,.0f}{entry['max']:>12,.0f}{marker}"
+        )
+    if proposal["tiers"]:
+        lines.append("")
+        lines.append(f"{'tier':<12}{'user windows':>14}{'p50':>10}{'crit q':>10}{'max':>10}{'per-user limit':>16}")
+        for tier, entry in proposal["tiers"].items():
+            lines.append(
+                f"{tier:<12}{entry['user_windows']:>14,}{entry['p50']:>10,.0f}{entry['critical_quantile']:>10,.0f}"
+                f"{entry['max']:>10,.0f}{entry['per_user_limit']:>16,}"
+            )
+    return "\n".join(lines)
+
+
+def load_tiers(path: Optional[str]) -> Dict[str, str]:
+    """Load a {user_id: tier} JSON file (empty if no path)."""
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def main():
+    """
+    Command-line entry point: print proposed DoW thresholds.
+    """
+    parser = argparse.ArgumentParser(description="Propose DoW monitor thresholds from request logs")
+    parser.add_argument("inputs", nargs="*", help="JSONL request logs written by request_log.py")
+    parser.add_argument("--window", default=os.getenv("DOW_EVALUATION_WINDOW", "last_5m"),
+                        help="Monitor evaluation window, e.g. last_5m")
+    parser.add_argument("--tiers", help="JSON file mapping user IDs to tiers")
+    parser.add_argument("--state", help="Baseline file to extend and save (for incremental runs)")
+    parser.add_argument("--headroom", type=float, default=1.5, help="Factor above observed quantiles")
+    parser.add_argument("--json", action="store_true", help="Print the proposal as JSON")
+    args = parser.parse_args()
+
+    try:
+        proposal, _ = compute_thresholds(args.inputs, args.window, load_tiers(args.tiers), args.state, args.headroom)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(json.dumps(proposal, indent=2) if args.json else format_proposal(proposal))
+
+
+if __name__ == "__main__":
+    main()
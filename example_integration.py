@@ -12,8 +12,47 @@ except ImportError:
     # python-dotenv not installed, environment variables must be set manually
     pass
 
-from app import initialize_gemini, chat
+from app import initialize_gemini, chat_stream
 from prompt_injection_detector import handle_prompt_injection
+from speculative_pipeline import speculative_chat
+
+
+def report_blocked(injection_result):
+    """
+    Print why a request was blocked.
+    
+    Args:
+        injection_result: Result of handle_prompt_injection
+    """
+    if injection_result["injection_detected"]:
+        print(f"\n[SECURITY ALERT] Potential prompt injection detected!")
+        print(f"   Pattern matched: {injection_result.get('matched_pattern', 'N/A')}")
+        
+        if injection_result.get("case_coalesced") or injection_result.get("case_pending"):
+            print(f"   [INFO] {injection_result.get('case_message')}")
+        elif injection_result.get("case_created"):
+            print(f"   [SUCCESS] Datadog case created: {injection_result.get('case_id')}")
+        else:
+            print(f"   [WARNING] Failed to create case: {injection_result.get('case_error', 'Unknown error')}")
+        
+        # Optionally block the request or allow with warning
+        response = "I cannot process this request due to security concerns."
+        print(f"\nGemini: {response}\n")
+    elif injection_result["token_limit_exceeded"]:
+        print(f"\n[BLOCKED] Prompt is too long (about {injection_result['estimated_tokens']:,} tokens)\n")
+
+
+def print_stream_metrics(metrics):
+    """
+    Print time to first token and throughput of a streamed response.
+    
+    Args:
+        metrics: Metrics filled in by chat_stream
+    """
+    if metrics.get("tokens_per_second"):
+        print(f"   [first token {metrics['ttft_seconds'] * 1000:.0f} ms, "
+              f"{metrics['tokens_per_second']:.0f} tokens/s]")
+    print()
 
 
 def main():
@@ -26,6 +65,9 @@ def main():
     # Get user ID (in production, this would come from authentication)
     user_id = os.getenv("USER_ID", "anonymous")
     
+    # Run detection and the model call concurrently instead of one after the other
+    speculative = os.getenv("SPECULATIVE_PIPELINE", "").lower() in ("1", "true", "yes")
+    
     print("\nGemini Chat Application with Security Monitoring")
     print("Type 'exit' or 'quit' to end the conversation\n")
     
@@ -40,36 +82,45 @@ def main():
             if not user_input:
                 continue
             
+            context = {
+                "source": "chat_application",
+                "session_type": "interactive"
+            }
+            
+            if speculative:
+                # Detection and the model call run concurrently
+                print("Gemini: ", end="", flush=True)
+                run = speculative_chat(client, user_input, user_id, additional_context=context)
+                for chunk in run:
+                    print(chunk, end="", flush=True)
+                print()
+                if run.blocked:
+                    if run.retracted:
+                        print("   [RETRACTED] Discard the partial response above")
+                    report_blocked(run.detection)
+                else:
+                    print_stream_metrics(run.metrics)
+                continue
+            
             # Check for prompt injection before processing
             injection_result = handle_prompt_injection(
                 prompt=user_input,
                 user_id=user_id,
                 create_case=True,
-                additional_context={
-                    "source": "chat_application",
-                    "session_type": "interactive"
-                }
+                additional_context=context
             )
             
-            if injection_result["injection_detected"]:
-                print(f"\n[SECURITY ALERT] Potential prompt injection detected!")
-                print(f"   Pattern matched: {injection_result.get('matched_pattern', 'N/A')}")
-                
-                if injection_result.get("case_created"):
-                    print(f"   [SUCCESS] Datadog case created: {injection_result.get('case_id')}")
-                else:
-                    print(f"   [WARNING] Failed to create case: {injection_result.get('case_error', 'Unknown error')}")
-                
-                # Optionally block the request or allow with warning
-                response = "I cannot process this request due to security concerns."
-                print(f"\nGemini: {response}\n")
+            if injection_result["injection_detected"] or injection_result["token_limit_exceeded"]:
+                report_blocked(injection_result)
                 continue
             
             # Process normal request
             print("Gemini: ", end="", flush=True)
-            response = chat(client, user_input)
-            print(response)
+            metrics = {}
+            for chunk in chat_stream(client, user_input, user_id=user_id, metrics=metrics):
+                print(chunk, end="", flush=True)
             print()
+            print_stream_metrics(metrics)
             
         except KeyboardInterrupt:
             print("\n\nGoodbye!")
@@ -0,0 +1,243 @@
+"""
+Token Flooding Detection
+Constant-memory repetition estimates for Denial of Wallet (DoW) flooding
+"""
+
+import math
+from typing import Optional, Dict, Any, Iterable
+
+
+_HASH_MASK = (1 << 64) - 1
+
+# 2 ** -rank for every possible register value
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(66)]
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct-count estimator over 64-bit hashes.
+
+    Uses 2**precision one-byte registers (1 KB at the default precision) and
+    falls back to linear counting for small cardinalities, so short prompts
+    get near-exact counts.
+    """
+
+    __slots__ = ("precision", "registers", "_mask")
+
+    def __init__(self, precision: int = 10):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._mask = (1 << precision) - 1
+
+    def add(self, value: Any) -> None:
+        """Add a hashable value."""
+        self.add_hash(hash(value))
+
+    def add_hash(self, hashed: int) -> None:
+        """Add a precomputed hash."""
+        hashed &= _HASH_MASK
+        index = hashed & self._mask
+        rest = hashed >> self.precision
+        rank = (rest & -rest).bit_length() if rest else 65 - self.precision
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add_hashes(self, hashes: Iterable[int]) -> None:
+        """Add many precomputed hashes (same as add_hash, without per-call overhead)."""
+        registers = self.registers
+        mask = self._mask
+        precision = self.precision
+        overflow_rank = 65 - precision
+        for hashed in hashes:
+            hashed &= _HASH_MASK
+            rest = hashed >> precision
+            rank = (rest & -rest).bit_length() if rest else overflow_rank
+            index = hashed & mask
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def estimate(self) -> float:
+        """Return the estimated number of distinct values added."""
+        registers = self.registers
+        count = len(registers)
+        alpha = 0.7213 / (1 + 1.079 / count)
+        raw = alpha * count * count / sum(map(_INVERSE_POWERS.__getitem__, registers))
+        zeros = registers.count(0)
+        if raw <= 2.5 * count and zeros:
+            return count * math.log(count / zeros)
+        return raw
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Fold another estimator with the same precision into this one."""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+class FloodDetector:
+    """
+    Streaming detector for repetition-based token flooding.
+
+    Tracks two repetition ratios (total / estimated distinct):
+    - word: whitespace-separated words, catching "repeat this word" floods
+    - character: fixed CHAR_BLOCK-character n-grams, catching repeated
+      phrases and characters even without whitespace (e.g. "abcabcabc..."
+      or CJK text)
+
+    Memory is constant: two HyperLogLog sketches, a partial word capped at
+    MAX_PARTIAL_WORD characters and fewer than CHAR_BLOCK carried characters.
+    Text is fed in chunks of any size; words are counted in pieces of at
+    most EXACT_MAX_CHARS characters, so no per-prompt word list is built.
+    """
+
+    # Characters per character n-gram
+    CHAR_BLOCK = 16
+    # Longest word prefix kept while a word spans chunks
+    MAX_PARTIAL_WORD = 256
+    # Largest piece of text split into words at once
+    EXACT_MAX_CHARS = 4096
+
+    def __init__(self, precision: int = 10, track_characters: bool = True):
+        """
+        Args:
+            precision: HyperLogLog precision (2**precision registers per sketch)
+            track_characters: Also track character n-grams. Callers that know
+                the text is too short for a character verdict can skip it.
+        """
+        self.track_characters = track_characters
+        self.word_count = 0
+        self.block_count = 0
+        self._words = HyperLogLog(precision)
+        self._blocks = HyperLogLog(precision)
+        self._partial_word = ""
+        self._partial_word_length = 0
+        self._block_carry = ""
+
+    def feed(self, chunk: str) -> None:
+        """
+        Consume the next piece of text.
+
+        Args:
+            chunk: Next piece of the prompt
+        """
+        if not chunk:
+            return
+        self._feed_words(chunk)
+        if self.track_characters:
+            self._feed_blocks(chunk)
+
+    def _add_word(self, word: str, length: int) -> None:
+        # Long words are identified by their prefix and full length
+        if length > self.MAX_PARTIAL_WORD:
+            word = f"{word[:self.MAX_PARTIAL_WORD]}#{length}"
+        self._words.add_hash(hash(word))
+        self.word_count += 1
+
+    def _feed_words(self, chunk: str) -> None:
+        # Large chunks are split in EXACT_MAX_CHARS pieces so the temporary
+        # word list stays bounded while splitting still runs in C
+        step = self.EXACT_MAX_CHARS
+        if len(chunk) <= step:
+            self._feed_word_piece(chunk)
+            return
+        for offset in range(0, len(chunk), step):
+            self._feed_word_piece(chunk[offset:offset + step])
+
+    def _feed_word_piece(self, piece: str) -> None:
+        words = piece.split()
+        max_length = self.MAX_PARTIAL_WORD
+        if self._partial_word_length:
+            if words and not piece[0].isspace():
+                first = words[0]
+                prefix = (self._partial_word + first)[:max_length]
+                length = self._partial_word_length + len(first)
+                if len(words) == 1 and not piece[-1].isspace():
+                    # The split word continues past this piece as well
+                    self._partial_word = prefix
+                    self._partial_word_length = length
+                    return
+                del words[0]
+                self._add_word(prefix, length)
+            else:
+                self._add_word(self._partial_word, self._partial_word_length)
+            self._partial_word = ""
+            self._partial_word_length = 0
+
+        if words and not piece[-1].isspace():
+            last = words.pop()
+            self._partial_word = last[:max_length]
+            self._partial_word_length = len(last)
+
+        self.word_count += len(words)
+        # HyperLogLog ignores duplicates, so each distinct word is hashed once
+        self._words.add_hashes(
+            hash(word) if len(word) <= max_length else hash(f"{word[:max_length]}#{len(word)}")
+            for word in set(words)
+        )
+
+    def _feed_blocks(self, chunk: str) -> None:
+        block = self.CHAR_BLOCK
+        if self._block_carry:
+            needed = block - len(self._block_carry)
+            if len(chunk) < needed:
+                self._block_carry += chunk
+                return
+            self._blocks.add_hash(hash(self._block_carry + chunk[:needed]))
+            self.block_count += 1
+            chunk = chunk[needed:]
+            self._block_carry = ""
+        full = len(chunk) - len(chunk) % block
+        self._blocks.add_hashes(hash(chunk[start:start + block]) for start in range(0, full, block))
+        self.block_count += full // block
+        self._block_carry = chunk[full:]
+
+    def finish(self) -> None:
+        """Count a trailing word that was still open at the end of the input."""
+        if self._partial_word_length:
+            self._add_word(self._partial_word, self._partial_word_length)
+            self._partial_word = ""
+            self._partial_word_length = 0
+
+    def word_ratio(self) -> float:
+        """Estimated words / distinct words."""
+        if not self.word_count:
+            return 0.0
+        return self.word_count / max(self._words.estimate(), 1.0)
+
+    def char_ratio(self) -> float:
+        """Estimated character n-grams / distinct character n-grams."""
+        if not self.block_count:
+            return 0.0
+        return self.block_count / max(self._blocks.estimate(), 1.0)
+
+    def verdict(
+        self,
+        ratio_threshold: float = 5,
+        min_words: int = 50,
+        min_blocks: int = 64
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Decide whether the text seen so far is flooding.
+
+        Args:
+            ratio_threshold: Repetition ratio above which text is flooding
+            min_words: Words required before the word ratio is trusted
+            min_blocks: Character n-grams required before the character
+                ratio is trusted
+
+        Returns:
+            {"kind": "word" | "character", "ratio": float} for the strongest
+            signal above the threshold, or None
+        """
+        candidates = []
+        if self.word_count > min_words:
+            candidates.append(("word", self.word_ratio()))
+        if self.block_count > min_blocks:
+            candidates.append(("character", self.char_ratio()))
+        flooding = [(ratio, kind) for kind, ratio in candidates if ratio > ratio_threshold]
+        if not flooding:
+            return None
+        ratio, kind = max(flooding)
+        return {"kind": kind, "ratio": ratio}
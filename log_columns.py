@@ -0,0 +1,613 @@
+"""
+Columnar Request Log Store
+Compacts request_log.py JSONL files into memory-mapped, array-backed
+columns and answers aggregate queries (tokens per user, pattern hits, time
+buckets, DoW threshold baselines) without rescanning JSON
+
+Usage:
+    python log_columns.py compact logs/requests*.jsonl* -o logs/store
+    python log_columns.py users logs/store --last 7d
+    python log_columns.py patterns logs/store
+    python log_columns.py buckets logs/store --bucket 1h --value tokens
+    python log_columns.py dow logs/store --window 5m
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import shutil
+import sys
+import time
+from array import array
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Sequence, Tuple
+
+# NumPy is optional: queries are vectorized when it is installed and fall
+# back to plain Python loops over the same memory-mapped columns otherwise
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+STORE_VERSION = 1
+
+# Column name -> array typecode (native byte order). kind/user/outcome/model
+# and rule_ids are codes into the dictionaries in meta.json; rule_offsets
+# delimits each row's slice of rule_ids (rows + 1 entries)
+COLUMNS = {
+    "ts": "d",
+    "kind": "B",
+    "user": "I",
+    "outcome": "B",
+    "model": "H",
+    "tokens": "q",
+    "estimated_tokens": "q",
+    "latency_ms": "f",
+    "injection": "b",
+    "rule_offsets": "Q",
+    "rule_ids": "H",
+}
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+# Record timestamps before 2000-01-01 are treated as missing (e.g. a 0 default)
+EARLIEST_TS = 946684800.0
+
+
+def parse_duration(text: str) -> float:
+    """
+    Parse a duration such as "300", "5m", "1h", "7d" or a monitor
+    evaluation window such as "last_5m" into seconds.
+
+    Args:
+        text: Number of seconds, optionally suffixed with s/m/h/d/w
+
+    Returns:
+        Seconds
+    """
+    text = text.strip().lower()
+    if text.startswith("last_"):
+        text = text[len("last_"):]
+    if text and text[-1] in _DURATION_UNITS:
+        return float(text[:-1]) * _DURATION_UNITS[text[-1]]
+    return float(text)
+
+
+class _Dictionary:
+    """Assigns dense integer codes to strings in order of first appearance."""
+
+    def __init__(self, values: Sequence[str] = ()):
+        self.values: List[str] = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def encode(self, value: Any) -> int:
+        value = "" if value is None else str(value)
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the JSON object records of a (possibly gzipped) JSONL file."""
+    if path.endswith(".gz"):
+        import gzip
+        handle = gzip.open(path, "rb")
+    else:
+        handle = open(path, "rb")
+    with handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                yield record
+
+
+def record_time(record: Dict[str, Any]) -> Optional[float]:
+    """
+    Return a record's "ts" as epoch seconds.
+
+    Args:
+        record: Parsed request log record
+
+    Returns:
+        Timestamp, or None if it is missing, not a finite number or before
+        EARLIEST_TS
+    """
+    ts = record.get("ts")
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)):
+        return None
+    ts = float(ts)
+    if not EARLIEST_TS <= ts < math.inf:
+        return None
+    return ts
+
+
+def compact(paths: Iterable[str], output_dir: str, patterns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Compact request log JSONL files into a column store.
+
+    Rows are written in input order. Detection rows carry the verdict
+    (injection, outcome = "clean" or the reason, matched rule IDs,
+    estimated_tokens, latency_ms = detector time); chat and stream rows the
+    outcome, model, tokens charged and latency. The store is written to a
+    temporary directory and renamed into place, so readers never see a
+    partial store. Records without a usable timestamp (see record_time())
+    are skipped and counted in the metadata as skipped_records.
+
+    Args:
+        paths: JSONL files written by request_log.py (".gz" files are read too)
+        output_dir: Store directory (replaced if it exists)
+        patterns: Rule set the logged rule indexes refer to (default:
+            the current INJECTION_PATTERNS)
+
+    Returns:
+        The store's metadata
+    """
+    if patterns is None:
+        from prompt_injection_detector import INJECTION_PATTERNS
+        patterns = INJECTION_PATTERNS
+    patterns = list(patterns)
+
+    columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+    dictionaries = {name: _Dictionary() for name in ("kind", "user", "outcome", "model")}
+    pattern_dictionary = _Dictionary()
+    rule_offsets = columns["rule_offsets"]
+    rule_offsets.append(0)
+    sources = []
+    skipped = 0
+
+    for path in paths:
+        sources.append(os.path.abspath(path))
+        try:
+            for record in read_records(path):
+                ts = record_time(record)
+                if ts is None:
+                    skipped += 1
+                    continue
+                kind = record.get("type") or "unknown"
+                detection = kind == "detection"
+                columns["ts"].append(ts)
+                columns["kind"].append(dictionaries["kind"].encode(kind))
+                columns["user"].append(dictionaries["user"].encode(record.get("user_id")))
+                if detection:
+                    outcome = (record.get("reason") or "rule") if record.get("injection") else "clean"
+                else:
+                    outcome = record.get("outcome")
+                columns["outcome"].append(dictionaries["outcome"].encode(outcome))
+                columns["model"].append(dictionaries["model"].encode(record.get("model")))
+                columns["tokens"].append(int(record.get("tokens") or 0))
+                columns["estimated_tokens"].append(int(record.get("estimated_tokens") or 0))
+                columns["latency_ms"].append(float(record.get("detector_ms" if detection else "latency_ms") or 0.0))
+                columns["injection"].append(int(bool(record.get("injection"))) if detection else -1)
+                for index in record.get("rules") or ():
+                    pattern = patterns[index] if isinstance(index, int) and 0 <= index < len(patterns) else "unknown"
+                    columns["rule_ids"].append(pattern_dictionary.encode(pattern))
+                rule_offsets.append(len(columns["rule_ids"]))
+        except OverflowError:
+            # A dictionary outgrew its column's typecode (e.g. over 256 outcomes)
+            raise ValueError(f"Too many distinct values for a dictionary column in {path}")
+
+    meta = {
+        "version": STORE_VERSION,
+        "rows": len(columns["ts"]),
+        "skipped_records": skipped,
+        "byteorder": sys.byteorder,
+        "columns": dict(COLUMNS),
+        "dictionaries": {**{name: d.values for name, d in dictionaries.items()}, "pattern": pattern_dictionary.values},
+        "time_range": [min(columns["ts"]), max(columns["ts"])] if columns["ts"] else None,
+        "sources": sources,
+        "created": time.time()
+    }
+    temporary = f"{output_dir.rstrip(os.sep)}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for name, column in columns.items():
+        with open(os.path.join(temporary, f"{name}.bin"), "wb") as handle:
+            column.tofile(handle)
+    with open(os.path.join(temporary, "meta.json"), "w", encoding="utf-8") as handle:
+        json.dump(meta, handle)
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(temporary, output_dir)
+    return meta
+
+
+def _quantile(sorted_values: Sequence[float], q: float) -> float:
+    """Linearly interpolated quantile of sorted values (NumPy's default method)."""
+    if not sorted_values:
+        return 0.0
+    position = q * (len(sorted_values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class RequestColumns:
+    """
+    Read-only view of a column store written by compact().
+
+    Columns are memory-mapped, so opening a store costs nothing and
+    queries only touch the columns they use. With NumPy installed columns
+    are numpy arrays and queries are vectorized; otherwise they are
+    memoryviews scanned in Python.
+
+    Every query accepts start/end (epoch seconds, end exclusive) and
+    optionally a user to restrict the rows considered.
+    """
+
+    def __init__(self, path: str, use_numpy: Optional[bool] = None):
+        """
+        Args:
+            path: Store directory
+            use_numpy: Use NumPy (default: when installed)
+        """
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as handle:
+            self.meta = json.load(handle)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported store version {self.meta.get('version')}")
+        if self.meta["byteorder"] != sys.byteorder:
+            raise ValueError("Store was written on a machine with a different byte order")
+        self.path = path
+        self.rows = self.meta["rows"]
+        self.dictionaries: Dict[str, List[str]] = self.meta["dictionaries"]
+        self.np = np if use_numpy is not False else None
+        if use_numpy and np is None:
+            raise ImportError("numpy is not installed")
+        self._columns: Dict[str, Any] = {}
+        self._maps: List[mmap.mmap] = []
+
+    def column(self, name: str) -> Any:
+        """
+        Return a column (numpy array or memoryview), mapping it on first use.
+
+        Args:
+            name: Column name (see COLUMNS)
+        """
+        column = self._columns.get(name)
+        if column is None:
+            typecode = self.meta["columns"][name]
+            file_path = os.path.join(self.path, f"{name}.bin")
+            if os.path.getsize(file_path) == 0:
+                column = self.np.zeros(0, dtype=typecode) if self.np is not None else memoryview(array(typecode))
+            elif self.np is not None:
+                column = self.np.memmap(file_path, dtype=typecode, mode="r")
+            else:
+                with open(file_path, "rb") as handle:
+                    mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(mapped)
+                column = memoryview(mapped).cast(typecode)
+            self._columns[name] = column
+        return column
+
+    def close(self) -> None:
+        """Release the memory maps."""
+        columns, self._columns = self._columns, {}
+        for column in columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+    def _code(self, dictionary: str, value: str) -> int:
+        try:
+            return self.dictionaries[dictionary].index(value)
+        except ValueError:
+            return -1
+
+    def _selection(
+        self,
+        start: Optional[float],
+        end: Optional[float],
+        user: Optional[str],
+        kinds: Sequence[str]
+    ) -> Any:
+        """Rows matching the filters: a boolean numpy mask, or a list of row indexes."""
+        kind_codes = [self._code("kind", kind) for kind in kinds]
+        user_code = self._code("user", user) if user is not None else None
+        ts = self.column("ts")
+        kind = self.column("kind")
+        user_column = self.column("user")
+        if self.np is not None:
+            mask = self.np.isin(kind, kind_codes)
+            if start is not None:
+                mask &= ts >= start
+            if end is not None:
+                mask &= ts < end
+            if user_code is not None:
+                mask &= user_column == user_code
+            return mask
+        kind_codes = set(kind_codes)
+        return [
+            row for row in range(self.rows)
+            if kind[row] in kind_codes
+            and (start is None or ts[row] >= start)
+            and (end is None or ts[row] < end)
+            and (user_code is None or user_column[row] == user_code)
+        ]
+
+    def tokens_by_user(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        top: Optional[int] = 10
+    ) -> List[Dict[str, Any]]:
+        """
+        Sum charged tokens and count chat requests per user.
+
+        Args:
+            start: Earliest timestamp included
+            end: Timestamp after the last one included
+            top: Number of users returned, by tokens (None: all)
+
+        Returns:
+            List of {"user", "tokens", "requests"}, most tokens first
+        """
+        users = self.dictionaries["user"]
+        selection = self._selection(start, end, None, ("chat", "stream"))
+        user_column = self.column("user")
+        tokens = self.column("tokens")
+        if self.np is not None:
+            selected_users = user_column[selection]
+            totals = self.np.bincount(selected_users, weights=tokens[selection], minlength=len(users))
+            requests = self.np.bincount(selected_users, minlength=len(users))
+            order = self.np.lexsort((-requests, -totals))
+            rows = [(int(code), int(totals[code]), int(requests[code])) for code in order if requests[code]]
+        else:
+            totals = [0] * len(users)
+            requests = [0] * len(users)
+            for row in selection:
+                totals[user_column[row]] += tokens[row]
+                requests[user_column[row]] += 1
+            rows = sorted(
+                ((code, totals[code], requests[code]) for code in range(len(users)) if requests[code]),
+                key=lambda item: (-item[1], -item[2], item[0])
+            )
+        return [{"user": users[code], "tokens": total, "requests": count} for code, total, count in rows[:top]]
+
+    def pattern_hits(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        user: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Count detections per matched rule.
+
+        Args:
+            start: Earliest timestamp included
+            end: Timestamp after the last one included
+            user: Only this user's detections
+
+        Returns:
+            List of {"pattern", "hits", "rate"} (rate over all detections
+            in the selection), most hits first
+        """
+        patterns = self.dictionaries["pattern"]
+        selection = self._selection(start, end, user, ("detection",))
+        offsets = self.column("rule_offsets")
+        rule_ids = self.column("rule_ids")
+        if self.np is not None:
+            detections = int(selection.sum())
+            # Row of every rule_ids entry, to apply the row selection
+            rule_rows = self.np.repeat(self.np.arange(self.rows), self.np.diff(offsets).astype(self.np.int64))
+            hits = self.np.bincount(rule_ids[selection[rule_rows]], minlength=len(patterns)).tolist()
+        else:
+            detections = len(selection)
+            hits = [0] * len(patterns)
+            for row in selection:
+                for position in range(offsets[row], offsets[row + 1]):
+                    hits[rule_ids[position]] += 1
+        ranked = sorted(range(len(patterns)), key=lambda code: (-hits[code], code))
+        return [
+            {"pattern": patterns[code], "hits": hits[code], "rate": hits[code] / detections if detections else 0.0}
+            for code in ranked if hits[code]
+        ]
+
+    def time_buckets(
+        self,
+        bucket_seconds: float = 3600.0,
+        value: str = "tokens",
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        user: Optional[str] = None
+    ) -> List[Tuple[float, float]]:
+        """
+        Aggregate a value per time bucket.
+
+        Args:
+            bucket_seconds: Bucket width (buckets are aligned to the epoch)
+            value: "tokens" (charged chat tokens), "requests" (chat
+                requests), "detections" or "injections"
+            start: Earliest timestamp included
+            end: Timestamp after the last one included
+            user: Only this user's rows
+
+        Returns:
+            List of (bucket start, value) covering the selected time range,
+            empty buckets included
+        """
+        if value in ("tokens", "requests"):
+            kinds: Tuple[str, ...] = ("chat", "stream")
+        elif value in ("detections", "injections"):
+            kinds = ("detection",)
+        else:
+            raise ValueError("value must be tokens, requests, detections or injections")
+        selection = self._selection(start, end, user, kinds)
+        ts = self.column("ts")
+        if self.np is not None:
+            times = ts[selection]
+            if not len(times):
+                return []
+            weights = None
+            if value == "tokens":
+                weights = self.column("tokens")[selection]
+            elif value == "injections":
+                weights = self.column("injection")[selection] == 1
+            first = self.np.floor(times.min() / bucket_seconds)
+            indexes = (self.np.floor(times / bucket_seconds) - first).astype(self.np.int64)
+            totals = self.np.bincount(indexes, weights=weights).tolist()
+            return [((first + offset) * bucket_seconds, total) for offset, total in enumerate(totals)]
+
+        if not selection:
+            return []
+        weight_column = {"tokens": self.column("tokens"), "injections": self.column("injection")}.get(value)
+        first = min(ts[row] for row in selection) // bucket_seconds
+        totals: List[float] = []
+        for row in selection:
+            index = int(ts[row] // bucket_seconds - first)
+            if index >= len(totals):
+                totals.extend([0.0] * (index + 1 - len(totals)))
+            if weight_column is None:
+                totals[index] += 1
+            elif value == "injections":
+                totals[index] += weight_column[row] == 1
+            else:
+                totals[index] += weight_column[row]
+        return [((first + offset) * bucket_seconds, total) for offset, total in enumerate(totals)]
+
+    def dow_baseline(
+        self,
+        window_seconds: float = 300.0,
+        quantiles: Sequence[float] = (0.5, 0.9, 0.99, 0.999),
+        headroom: float = 2.0,
+        start: Optional[float] = None,
+        end: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Distribution of tokens per evaluation window, for DoW thresholds.
+
+        create_dow_monitor alerts when the sum of llm.usage.total_tokens
+        over its evaluation window exceeds a threshold. This sums charged
+        tokens over the same fixed windows (empty windows count as 0) and
+        reports their quantiles, overall and per active user.
+
+        Args:
+            window_seconds: Monitor evaluation window (300 for "last_5m")
+            quantiles: Quantiles reported
+            headroom: Factor applied to the largest reported quantile for
+                suggested_threshold
+            start: Earliest timestamp included
+            end: Timestamp after the last one included
+
+        Returns:
+            Dictionary with window_seconds, windows, quantiles, max,
+            user_quantiles (over windows in which a user was active),
+            max_user and suggested_threshold
+        """
+        selection = self._selection(start, end, None, ("chat", "stream"))
+        ts = self.column("ts")
+        tokens = self.column("tokens")
+        user_column = self.column("user")
+        if self.np is not None:
+            times = ts[selection]
+            if not len(times):
+                return {"window_seconds": window_seconds, "windows": 0}
+            first = self.np.floor(times.min() / window_seconds)
+            windows = (self.np.floor(times / window_seconds) - first).astype(self.np.int64)
+            selected_tokens = tokens[selection]
+            per_window = self.np.sort(self.np.bincount(windows, weights=selected_tokens))
+            # One entry per (user, window) with activity
+            keys = user_column[selection].astype(self.np.int64) * (int(windows.max()) + 1) + windows
+            _, inverse = self.np.unique(keys, return_inverse=True)
+            per_user_window = self.np.sort(self.np.bincount(inverse.ravel(), weights=selected_tokens))
+            window_quantiles = self.np.quantile(per_window, quantiles).tolist()
+            user_quantiles = self.np.quantile(per_user_window, quantiles).tolist()
+            window_count = len(per_window)
+            window_max, user_max = float(per_window[-1]), float(per_user_window[-1])
+        else:
+            if not selection:
+                return {"window_seconds": window_seconds, "windows": 0}
+            first = min(ts[row] for row in selection) // window_seconds
+            totals: Dict[int, float] = {}
+            user_totals: Dict[Tuple[int, int], float] = {}
+            for row in selection:
+                window = int(ts[row] // window_seconds - first)
+                totals[window] = totals.get(window, 0) + tokens[row]
+                key = (user_column[row], window)
+                user_totals[key] = user_totals.get(key, 0) + tokens[row]
+            window_count = max(totals) + 1
+            per_window = sorted([0.0] * (window_count - len(totals)) + list(totals.values()))
+            per_user_window = sorted(user_totals.values())
+            window_quantiles = [_quantile(per_window, q) for q in quantiles]
+            user_quantiles = [_quantile(per_user_window, q) for q in quantiles]
+            window_max, user_max = float(per_window[-1]), float(per_user_window[-1])
+        return {
+            "window_seconds": window_seconds,
+            "windows": window_count,
+            "quantiles": {str(q): value for q, value in zip(quantiles, window_quantiles)},
+            "max": window_max,
+            "user_quantiles": {str(q): value for q, value in zip(quantiles, user_quantiles)},
+            "max_user": user_max,
+            "suggested_threshold": int(max(window_quantiles) * headroom + 0.5)
+        }
+
+
+def main():
+    """
+    Command-line entry point for compaction and queries.
+    """
+    parser = argparse.ArgumentParser(description="Columnar store for Sentinel request logs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = commands.add_parser("compact", help="Compact JSONL request logs into a store")
+    compact_parser.add_argument("inputs", nargs="+", help="JSONL files written by request_log.py")
+    compact_parser.add_argument("-o", "--output", required=True, help="Store directory")
+
+    for name, help_text in (
+        ("users", "Tokens and requests per user"),
+        ("patterns", "Detections per matched rule"),
+        ("buckets", "Values per time bucket"),
+        ("dow", "Tokens per evaluation window, for DoW thresholds"),
+    ):
+        query_parser = commands.add_parser(name, help=help_text)
+        query_parser.add_argument("store", help="Store directory")
+        query_parser.add_argument("--last", help="Only the last duration before now, e.g. 7d or 12h")
+        if name == "users":
+            query_parser.add_argument("--top", type=int, default=10)
+        if name in ("patterns", "buckets"):
+            query_parser.add_argument("--user", help="Only this user")
+        if name == "buckets":
+            query_parser.add_argument("--bucket", default="1h", help="Bucket width, e.g. 5m or 1d")
+            query_parser.add_argument("--value", default="tokens", choices=("tokens", "requests", "detections", "injections"))
+        if name == "dow":
+            query_parser.add_argument("--window", default="last_5m", help="Monitor evaluation window, e.g. last_5m")
+            query_parser.add_argument("--headroom", type=float, default=2.0)
+
+    args = parser.parse_args()
+    if args.command == "compact":
+        started = time.perf_counter()
+        meta = compact(args.inputs, args.output)
+        print(f"Compacted {meta['rows']:,} rows from {len(meta['sources'])} file(s) "
+              f"into {args.output} in {time.perf_counter() - started:.1f}s")
+        if meta["skipped_records"]:
+            print(f"Skipped {meta['skipped_records']:,} records without a valid timestamp")
+        return
+
+    store = RequestColumns(args.store)
+    start = time.time() - parse_duration(args.last) if args.last else None
+    if args.command == "users":
+        for entry in store.tokens_by_user(start=start, top=args.top):
+            print(f"{entry['tokens']:>14,}{entry['requests']:>10,}  {entry['user']}")
+    elif args.command == "patterns":
+        for entry in store.pattern_hits(start=start, user=args.user):
+            print(f"{entry['hits']:>10,}{entry['rate']:>9.2%}  {entry['pattern']}")
+    elif args.command == "buckets":
+        for bucket_start, total in store.time_buckets(parse_duration(args.bucket), args.value, start=start, user=args.user):
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(bucket_start))}{total:>14,.0f}")
+    else:
+        print(json.dumps(store.dow_baseline(parse_duration(args.window), headroom=args.headroom, start=start), indent=2))
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
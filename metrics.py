@@ -0,0 +1,296 @@
+"""
+Buffered DogStatsD Metrics
+In-process aggregation of counters, gauges and histograms, flushed to the
+Datadog Agent as batched UDP DogStatsD packets from a background thread
+"""
+
+import atexit
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, List, Sequence, Tuple, TYPE_CHECKING
+
+# socket and random are imported on first use to keep detector startup fast
+if TYPE_CHECKING:
+    import socket
+
+
+# Largest payload per datagram; fits an Ethernet MTU without fragmentation
+DEFAULT_MAX_PACKET_SIZE = 1432
+
+# Histogram samples kept per metric and tag set between flushes
+DEFAULT_MAX_SAMPLES = 1000
+
+# Characters with a meaning in the DogStatsD line format
+_TAG_TRANSLATION = str.maketrans({"|": "_", ",": "_", "#": "_", "\n": " "})
+
+
+def _format_tags(tags: Sequence[str]) -> str:
+    if not tags:
+        return ""
+    return "|#" + ",".join(tag.translate(_TAG_TRANSLATION) for tag in tags)
+
+
+class MetricsClient:
+    """
+    DogStatsD client that aggregates in memory and sends in batches.
+
+    Recording a metric is a dictionary update under a lock; no I/O happens
+    on the caller's thread. Every flush_interval seconds a daemon thread
+    turns the aggregates into DogStatsD lines:
+    - counters are summed per metric and tag set (one "c" line)
+    - gauges keep their last value (one "g" line)
+    - histograms keep up to max_samples values, sent as multi-value "h"
+      lines; beyond that reservoir sampling applies and the line carries
+      the sample rate, so the Agent still counts every value
+    and packs them into datagrams of at most max_packet_size bytes. Send
+    errors (e.g. no Agent listening) drop the batch and are counted.
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        constant_tags: Sequence[str] = (),
+        flush_interval: float = 10.0,
+        max_packet_size: int = DEFAULT_MAX_PACKET_SIZE,
+        max_samples: int = DEFAULT_MAX_SAMPLES
+    ):
+        """
+        Args:
+            host: Agent host (default: DD_AGENT_HOST env var or localhost)
+            port: DogStatsD port (default: DD_DOGSTATSD_PORT env var or 8125)
+            constant_tags: Tags added to every metric
+            flush_interval: Seconds between flushes
+            max_packet_size: Largest datagram payload in bytes
+            max_samples: Histogram values kept per metric between flushes
+        """
+        self.host = host or os.getenv("DD_AGENT_HOST", "localhost")
+        self.port = port or int(os.getenv("DD_DOGSTATSD_PORT", "8125"))
+        self.constant_tags = tuple(constant_tags)
+        self.flush_interval = flush_interval
+        self.max_packet_size = max_packet_size
+        self.max_samples = max_samples
+        self._counters: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        self._gauges: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        # [values, total seen]
+        self._histograms: Dict[Tuple[str, Tuple[str, ...]], list] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._socket: Optional["socket.socket"] = None
+        self._address: Optional[tuple] = None
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._stop = threading.Event()
+        self.packets_sent = 0
+        self.lines_sent = 0
+        self.send_errors = 0
+
+    def increment(self, name: str, value: float = 1, tags: Tuple[str, ...] = ()) -> None:
+        """
+        Add to a counter.
+
+        Args:
+            name: Metric name
+            value: Amount to add
+            tags: Tags ("key:value")
+        """
+        key = (name, tags)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._ensure_started()
+
+    def gauge(self, name: str, value: float, tags: Tuple[str, ...] = ()) -> None:
+        """
+        Set a gauge (the last value before a flush is sent).
+
+        Args:
+            name: Metric name
+            value: Current value
+            tags: Tags ("key:value")
+        """
+        with self._lock:
+            self._gauges[(name, tags)] = value
+        self._ensure_started()
+
+    def histogram(self, name: str, value: float, tags: Tuple[str, ...] = ()) -> None:
+        """
+        Record a histogram sample.
+
+        Args:
+            name: Metric name
+            value: Sample value
+            tags: Tags ("key:value")
+        """
+        key = (name, tags)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                self._histograms[key] = [[value], 1]
+            else:
+                entry[1] += 1
+                if len(entry[0]) < self.max_samples:
+                    entry[0].append(value)
+                else:
+                    import random
+                    slot = random.randrange(entry[1])
+                    if slot < self.max_samples:
+                        entry[0][slot] = value
+        self._ensure_started()
+
+    def timing(self, name: str, started: float, tags: Tuple[str, ...] = ()) -> None:
+        """
+        Record the milliseconds since a time.perf_counter() value as a histogram sample.
+
+        Args:
+            name: Metric name
+            started: time.perf_counter() at the start of the timed operation
+            tags: Tags ("key:value")
+        """
+        self.histogram(name, (time.perf_counter() - started) * 1000.0, tags)
+
+    def _ensure_started(self) -> None:
+        # Threads do not survive fork; worker processes start their own
+        if self._thread_pid != os.getpid():
+            with self._flush_lock:
+                if self._thread_pid != os.getpid():
+                    self._stop.clear()
+                    self._socket = None
+                    self._thread = threading.Thread(target=self._run, name="sentinel-metrics", daemon=True)
+                    self._thread_pid = os.getpid()
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _lines(self) -> List[str]:
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            gauges, self._gauges = self._gauges, {}
+            histograms, self._histograms = self._histograms, {}
+        constant = self.constant_tags
+        lines = []
+        for (name, tags), value in counters.items():
+            lines.append(f"{name}:{value:.15g}|c{_format_tags(constant + tags)}")
+        for (name, tags), value in gauges.items():
+            lines.append(f"{name}:{value:.15g}|g{_format_tags(constant + tags)}")
+        for (name, tags), (values, seen) in histograms.items():
+            rate = f"|@{len(values) / seen:.6g}" if seen > len(values) else ""
+            suffix = f"|h{rate}{_format_tags(constant + tags)}"
+            # Split multi-value lines so each fits in a packet
+            batch: List[str] = []
+            size = len(name) + len(suffix)
+            for value in values:
+                text = f"{value:.6g}"
+                if batch and size + len(text) + 1 > self.max_packet_size:
+                    lines.append(f"{name}:{':'.join(batch)}{suffix}")
+                    batch, size = [], len(name) + len(suffix)
+                batch.append(text)
+                size += len(text) + 1
+            lines.append(f"{name}:{':'.join(batch)}{suffix}")
+        return lines
+
+    def _packets(self, lines: List[str]) -> List[bytes]:
+        packets = []
+        current: List[bytes] = []
+        size = 0
+        for line in lines:
+            encoded = line.encode("utf-8")
+            if current and size + len(encoded) + 1 > self.max_packet_size:
+                packets.append(b"\n".join(current))
+                current, size = [], 0
+            current.append(encoded)
+            size += len(encoded) + 1
+        if current:
+            packets.append(b"\n".join(current))
+        return packets
+
+    def flush(self) -> int:
+        """
+        Send everything aggregated so far.
+
+        Returns:
+            Number of datagrams sent
+        """
+        import socket
+
+        with self._flush_lock:
+            lines = self._lines()
+            if not lines:
+                return 0
+            sent = 0
+            try:
+                if self._socket is None:
+                    family, _, _, _, address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_DGRAM)[0]
+                    self._socket = socket.socket(family, socket.SOCK_DGRAM)
+                    self._socket.setblocking(False)
+                    self._address = address
+                for packet in self._packets(lines):
+                    self._socket.sendto(packet, self._address)
+                    sent += 1
+            except OSError:
+                self.send_errors += 1
+            self.packets_sent += sent
+            self.lines_sent += len(lines)
+            return sent
+
+    def close(self) -> None:
+        """Flush and stop the background thread."""
+        self._stop.set()
+        self.flush()
+        with self._flush_lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return emitter counters.
+
+        Returns:
+            Dictionary with packets_sent, lines_sent, send_errors and the
+            number of metrics waiting for the next flush
+        """
+        with self._lock:
+            pending = len(self._counters) + len(self._gauges) + len(self._histograms)
+        return {
+            "packets_sent": self.packets_sent,
+            "lines_sent": self.lines_sent,
+            "send_errors": self.send_errors,
+            "pending": pending
+        }
+
+
+_default_metrics: Optional[MetricsClient] = None
+_default_metrics_loaded = False
+_default_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Optional[MetricsClient]:
+    """
+    Return the process-wide metrics client.
+
+    Enabled by SENTINEL_METRICS=1 (default: disabled). DD_AGENT_HOST and
+    DD_DOGSTATSD_PORT select the Agent, SENTINEL_METRICS_INTERVAL the flush
+    interval in seconds (default 10), and DD_ENV / DD_SERVICE become
+    constant env/service tags.
+
+    Returns:
+        Shared MetricsClient, or None if disabled
+    """
+    global _default_metrics, _default_metrics_loaded
+    with _default_metrics_lock:
+        if not _default_metrics_loaded:
+            if os.getenv("SENTINEL_METRICS", "0").lower() in ("1", "true", "yes"):
+                tags = []
+                for tag, variable in (("env", "DD_ENV"), ("service", "DD_SERVICE")):
+                    if os.getenv(variable):
+                        tags.append(f"{tag}:{os.environ[variable]}")
+                _default_metrics = MetricsClient(
+                    constant_tags=tags,
+                    flush_interval=float(os.getenv("SENTINEL_METRICS_INTERVAL", "10"))
+                )
+                atexit.register(_default_metrics.close)
+            _default_metrics_loaded = True
+        return _default_metrics
@@ -0,0 +1,789 @@
+"""
+Compiled Pattern Engine
+Single-pass keyword prefilter for the prompt injection rule set
+"""
+
+import re
+import time
+from typing import Optional, Dict, Any, List, Tuple, Sequence, Pattern, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from detector_profiler import DetectorProfiler
+
+
+# Characters that make an alternative something other than a plain literal
+_REGEX_METACHARS = set(".^$*+?{}[]()|\\")
+
+# Prompts longer than this are evaluated in linear-time mode by default
+# (set to 0 to always use it)
+LINEAR_MODE_MIN_LENGTH = 1024
+
+# In linear-time mode, rules that cannot be evaluated from keyword positions
+# only see this many leading characters, which bounds their backtracking
+LINEAR_FALLBACK_CHARS = 4096
+
+
+def _split_top_level(group: str) -> List[str]:
+    """Split a regex group body on '|' characters that are not nested or escaped."""
+    parts = []
+    depth = 0
+    current = []
+    i = 0
+    while i < len(group):
+        char = group[i]
+        if char == "\\" and i + 1 < len(group):
+            current.append(group[i:i + 2])
+            i += 2
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            parts.append("".join(current))
+            current = []
+            i += 1
+            continue
+        current.append(char)
+        i += 1
+    parts.append("".join(current))
+    return parts
+
+
+def _unescape_literal(alternative: str) -> Optional[str]:
+    """Return the literal text of a regex alternative, or None if it is not a plain literal."""
+    literal = []
+    i = 0
+    while i < len(alternative):
+        char = alternative[i]
+        if char == "\\":
+            if i + 1 >= len(alternative) or alternative[i + 1].isalnum():
+                # \d, \w, \b etc. are character classes, not literals
+                return None
+            literal.append(alternative[i + 1])
+            i += 2
+            continue
+        if char in _REGEX_METACHARS:
+            return None
+        literal.append(char)
+        i += 1
+    return "".join(literal) or None
+
+
+def _literal_group(body: str, start: int) -> Optional[Tuple[List[str], int]]:
+    """
+    Parse a capturing group of plain literal alternatives starting at body[start].
+
+    Returns:
+        Tuple of (lowercase alternatives, index just past the closing paren),
+        or None if the group is not a plain literal alternation
+    """
+    if not body.startswith("(", start) or body.startswith("(?", start):
+        return None
+
+    # Find the parenthesis closing the group
+    depth = 0
+    end = None
+    i = start
+    while i < len(body):
+        char = body[i]
+        if char == "\\":
+            i += 2
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                end = i
+                break
+        i += 1
+    if end is None:
+        return None
+
+    alternatives = []
+    for alternative in _split_top_level(body[start + 1:end]):
+        literal = _unescape_literal(alternative)
+        if literal is None:
+            return None
+        alternatives.append(literal.lower())
+    return alternatives, end + 1
+
+
+def extract_anchors(pattern: str) -> Optional[List[str]]:
+    """
+    Derive the literal keywords that every match of a rule must start with.
+
+    Rules in INJECTION_PATTERNS are written as `(?i)(kw1|kw2|...)...`, so any
+    match begins with one of the keywords in the leading group.
+
+    Args:
+        pattern: Regex rule source
+
+    Returns:
+        List of lowercase anchor literals, or None if the rule has no usable
+        leading literal group (the rule is then always evaluated)
+    """
+    body = pattern
+    if body.startswith("(?i)"):
+        body = body[len("(?i)"):]
+    group = _literal_group(body, 0)
+    if group is None:
+        return None
+    return group[0]
+
+
+def parse_keyword_sequence(pattern: str) -> Optional[List[List[str]]]:
+    """
+    Parse a rule of the form `(?i)(a|b).*(c|d).*(e|f)` into its keyword groups.
+
+    Args:
+        pattern: Regex rule source
+
+    Returns:
+        List of keyword groups (each a list of lowercase alternatives in
+        alternation order), or None if the rule has any other shape
+    """
+    if not pattern.startswith("(?i)"):
+        return None
+    body = pattern[len("(?i)"):]
+    groups = []
+    i = 0
+    while True:
+        group = _literal_group(body, i)
+        if group is None:
+            return None
+        alternatives, i = group
+        groups.append(alternatives)
+        if i == len(body):
+            return groups
+        if not body.startswith(".*", i):
+            return None
+        i += 2
+
+
+def _trie_regex(words) -> str:
+    """Build a regex alternation shaped like a trie over the given literals."""
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy optional continuation prefers the longest keyword
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+def _match_keyword_sequence(per_group: List[List[Tuple[int, int, int]]]) -> Optional[List[Tuple[int, int]]]:
+    """
+    Resolve one line's match of a `(a|b).*(c|d)...` rule from keyword occurrences.
+
+    Args:
+        per_group: For each keyword group, its (start, alternative index, end)
+            occurrences on the line
+
+    Returns:
+        (start, end) span of each captured group, or None if the rule does not
+        match on this line. A greedy trailing group always ends at its last
+        occurrence, so a line holds at most one match.
+    """
+    if not all(per_group):
+        return None
+
+    # thresholds[i]: latest start of group i from which groups i.. can match
+    count = len(per_group)
+    thresholds = [0] * count
+    limit = None
+    for i in range(count - 1, -1, -1):
+        latest = -1
+        for start, _, end in per_group[i]:
+            if start > latest and (limit is None or end <= limit):
+                latest = start
+        if latest < 0:
+            return None
+        thresholds[i] = latest
+        limit = latest
+
+    spans = []
+    low = 0
+    for i in range(count):
+        limit = thresholds[i + 1] if i + 1 < count else None
+        best = None
+        for occurrence in per_group[i]:
+            start, alternative, end = occurrence
+            if start < low or (limit is not None and end > limit):
+                continue
+            if best is None:
+                best = occurrence
+            elif i == 0:
+                # Leftmost start wins, then alternation order
+                if (start, alternative) < best[:2]:
+                    best = occurrence
+            elif start > best[0] or (start == best[0] and alternative < best[1]):
+                # Greedy `.*` backtracks from the end: latest start wins
+                best = occurrence
+        spans.append((best[0], best[2]))
+        low = best[2]
+    return spans
+
+
+class RuleMatch:
+    """
+    Matches of one rule, stored as offsets into the prompt.
+
+    Only the first max_spans matches are kept; count is the total number of
+    matches. Each span entry holds one (start, end) pair per capturing group
+    (or the whole match for rules without groups), so no substrings are
+    copied until matches() is called.
+    """
+
+    __slots__ = ("pattern", "group_count", "count", "spans", "values")
+
+    def __init__(self, pattern: str, group_count: int, count: int, spans: Tuple[Tuple[Tuple[int, int], ...], ...],
+                 values: Optional[Tuple[Any, ...]] = None):
+        self.pattern = pattern
+        self.group_count = group_count
+        self.count = count
+        self.spans = spans
+        # Pre-materialized matches, used when the prompt is not retained
+        self.values = values
+
+    def matches(self, prompt: Optional[str]) -> List[Any]:
+        """
+        Return the stored matches shaped like re.findall output.
+
+        Args:
+            prompt: The prompt the spans refer to
+
+        Returns:
+            List of strings (zero or one group) or tuples (several groups)
+        """
+        if self.values is not None:
+            return list(self.values)
+        if prompt is None:
+            return []
+        if self.group_count > 1:
+            return [tuple(prompt[start:end] for start, end in span) for span in self.spans]
+        return [prompt[span[0][0]:span[0][1]] for span in self.spans]
+
+    def as_dict(self, prompt: Optional[str]) -> Dict[str, Any]:
+        """
+        Return the legacy {"pattern": ..., "matches": ...} entry.
+
+        A "match_count" key is added when matches were capped.
+        """
+        entry = {"pattern": self.pattern, "matches": self.matches(prompt)}
+        stored = len(self.values) if self.values is not None else len(self.spans)
+        if self.count > stored:
+            entry["match_count"] = self.count
+        return entry
+
+    def __repr__(self) -> str:
+        return f"RuleMatch(pattern={self.pattern!r}, count={self.count})"
+
+
+def _collect_matches(compiled: Pattern, text: str, max_spans: Optional[int]) -> Tuple[int, List[Tuple[Tuple[int, int], ...]]]:
+    """Count a regex's matches in text and record the spans of the first max_spans."""
+    group_count = compiled.groups
+    count = 0
+    spans = []
+    for found in compiled.finditer(text):
+        count += 1
+        if max_spans is None or len(spans) < max_spans:
+            if group_count:
+                spans.append(tuple(found.span(group) for group in range(1, group_count + 1)))
+            else:
+                spans.append((found.span(),))
+    return count, spans
+
+
+class CompiledRuleSet:
+    """
+    Compiled form of a list of injection rules.
+
+    A single trie-shaped alternation over every rule's anchor keywords is
+    searched once per prompt; only rules whose anchors appeared have their full
+    regex evaluated. Rules without derivable anchors are always evaluated.
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = tuple(patterns)
+        self.compiled = [re.compile(pattern) for pattern in self.patterns]
+        self.always_run: List[int] = []
+
+        anchor_rules: Dict[str, set] = {}
+        for index, pattern in enumerate(self.patterns):
+            anchors = extract_anchors(pattern)
+            if anchors is None:
+                self.always_run.append(index)
+                continue
+            for anchor in anchors:
+                anchor_rules.setdefault(anchor, set()).add(index)
+
+        # A match of a longer keyword hides any shorter keyword that is its
+        # prefix at the same position, so credit those rules as well.
+        self.anchor_rules: Dict[str, frozenset] = {}
+        for anchor in anchor_rules:
+            rules = set()
+            for other, other_rules in anchor_rules.items():
+                if anchor.startswith(other):
+                    rules |= other_rules
+            self.anchor_rules[anchor] = frozenset(rules)
+
+        # The prefilter is a trie-shaped alternation so the regex engine
+        # branches on each character instead of retrying every keyword at
+        # every offset. ASCII prompts (the common case) are lowercased and
+        # scanned case-sensitively; anything else uses IGNORECASE so Unicode
+        # case folding stays identical to the rules' own (?i) semantics.
+        self.prefilter = None
+        self.prefilter_ignorecase = None
+        if self.anchor_rules:
+            trie_source = _trie_regex(self.anchor_rules)
+            self.prefilter = re.compile(trie_source)
+            self.prefilter_ignorecase = re.compile(trie_source, re.IGNORECASE)
+
+        # Linear-time mode. Rules shaped `(?i)(a|b).*(c|d)...` backtrack
+        # quadratically on long lines, so they are evaluated from keyword
+        # positions instead. Single literal groups are already linear as
+        # regexes; any other rule is bounded by LINEAR_FALLBACK_CHARS.
+        self.sequences: Dict[int, List[List[str]]] = {}
+        self.literal_rules: set = set()
+        keyword_slots: Dict[str, List[Tuple[int, int, int]]] = {
+            anchor: [] for anchor in self.anchor_rules
+        }
+        for index, pattern in enumerate(self.patterns):
+            groups = parse_keyword_sequence(pattern)
+            if groups is None:
+                continue
+            if len(groups) == 1:
+                self.literal_rules.add(index)
+                continue
+            self.sequences[index] = groups
+            for group_index, alternatives in enumerate(groups):
+                for alternative_index, keyword in enumerate(alternatives):
+                    keyword_slots.setdefault(keyword, []).append(
+                        (index, group_index, alternative_index)
+                    )
+
+        # Every keyword that is a prefix of a hit also occurs at the hit start
+        self.keyword_hits: Dict[str, List[Tuple[int, List[Tuple[int, int, int]], frozenset]]] = {}
+        for keyword in keyword_slots:
+            self.keyword_hits[keyword] = [
+                (len(other), slots, frozenset(anchor_rules.get(other, ())))
+                for other, slots in keyword_slots.items()
+                if keyword.startswith(other)
+            ]
+
+        self.scanner = None
+        self.scanner_ignorecase = None
+        if self.keyword_hits:
+            trie_source = _trie_regex(self.keyword_hits)
+            self.scanner = re.compile(trie_source)
+            self.scanner_ignorecase = re.compile(trie_source, re.IGNORECASE)
+
+    def _rules_for_hit(self, text: str) -> frozenset:
+        """Return the rules credited by a prefilter hit."""
+        rules = self.anchor_rules.get(text.lower())
+        if rules is None:
+            # Case-folded non-ASCII hit (e.g. KELVIN SIGN for 'k')
+            rules = frozenset()
+            for anchor, anchor_rules in self.anchor_rules.items():
+                if re.fullmatch(re.escape(anchor), text, re.IGNORECASE):
+                    rules |= anchor_rules
+        return rules
+
+    def candidate_rules(self, prompt: str) -> List[int]:
+        """
+        Return the indices of rules whose anchors occur in the prompt.
+
+        Args:
+            prompt: Text to scan
+
+        Returns:
+            Sorted list of rule indices to evaluate with the full regex
+        """
+        candidates = set(self.always_run)
+        if self.prefilter is not None:
+            if prompt.isascii():
+                text = prompt.lower()
+                search = self.prefilter.search
+            else:
+                text = prompt
+                search = self.prefilter_ignorecase.search
+            remaining = len(self.patterns) - len(candidates)
+            match = search(text)
+            # Overlapping scan: resume one character after each hit so that a
+            # keyword starting inside another keyword is still seen
+            while match is not None and remaining > 0:
+                for index in self._rules_for_hit(match.group()):
+                    if index not in candidates:
+                        candidates.add(index)
+                        remaining -= 1
+                match = search(text, match.start() + 1)
+        return sorted(candidates)
+
+    def _hits_for_keyword(self, text: str) -> List[Tuple[int, List[Tuple[int, int, int]], frozenset]]:
+        """Return (length, sequence slots, anchored rules) for each keyword a scanner hit implies."""
+        hits = self.keyword_hits.get(text.lower())
+        if hits is None:
+            # Case-folded non-ASCII hit (e.g. KELVIN SIGN for 'k')
+            hits = []
+            for keyword, keyword_hits in self.keyword_hits.items():
+                if re.fullmatch(re.escape(keyword), text, re.IGNORECASE):
+                    hits.extend(keyword_hits)
+        return hits
+
+    def evaluate_linear(
+        self,
+        prompt: str,
+        max_spans: Optional[int] = None,
+        profiler: Optional["DetectorProfiler"] = None
+    ) -> List[RuleMatch]:
+        """
+        Evaluate the rule set in time linear in the prompt length.
+
+        Keyword-sequence rules are emulated from the positions of their
+        keywords, found in one overlapping scan: per line, the leftmost
+        feasible first keyword and then the latest feasible keyword for each
+        greedy `.*`, exactly as the backtracking engine would choose them.
+
+        Args:
+            prompt: Text to scan
+            max_spans: Maximum number of match spans kept per rule (None: all)
+            profiler: Records the keyword scan and each rule's evaluation
+
+        Returns:
+            RuleMatch for each matching rule, in rule order
+        """
+        if profiler is not None:
+            scan_started = time.perf_counter_ns()
+        candidates = set(self.always_run)
+        # rule index -> {line start offset: [occurrences per keyword group]}
+        occurrences: Dict[int, Dict[int, List[List[Tuple[int, int, int]]]]] = {
+            index: {} for index in self.sequences
+        }
+
+        if self.scanner is not None:
+            if prompt.isascii():
+                text = prompt.lower()
+                search = self.scanner.search
+            else:
+                text = prompt
+                search = self.scanner_ignorecase.search
+
+            line_start = 0
+            line_end = text.find("\n")
+            match = search(text)
+            while match is not None:
+                start = match.start()
+                if line_end != -1 and start > line_end:
+                    line_start = text.rfind("\n", 0, start) + 1
+                    line_end = text.find("\n", start)
+                for length, slots, rules in self._hits_for_keyword(match.group()):
+                    candidates |= rules
+                    for index, group_index, alternative_index in slots:
+                        lines = occurrences[index]
+                        per_group = lines.get(line_start)
+                        if per_group is None:
+                            per_group = lines[line_start] = [[] for _ in self.sequences[index]]
+                        per_group[group_index].append((start, alternative_index, start + length))
+                match = search(text, start + 1)
+
+        if profiler is not None:
+            profiler.record_phase("prefilter", time.perf_counter_ns() - scan_started)
+        rule_matches = []
+        for index, pattern in enumerate(self.patterns):
+            if profiler is not None:
+                rule_started = time.perf_counter_ns()
+            if index in self.sequences:
+                count = 0
+                spans = []
+                for per_group in occurrences[index].values():
+                    groups = _match_keyword_sequence(per_group)
+                    if groups is not None:
+                        count += 1
+                        if max_spans is None or len(spans) < max_spans:
+                            spans.append(tuple(groups))
+            elif index in candidates:
+                if index in self.literal_rules:
+                    count, spans = _collect_matches(self.compiled[index], prompt, max_spans)
+                else:
+                    count, spans = _collect_matches(
+                        self.compiled[index], prompt[:LINEAR_FALLBACK_CHARS], max_spans
+                    )
+            else:
+                continue
+            if profiler is not None:
+                profiler.record_rule(index, time.perf_counter_ns() - rule_started, count > 0)
+            if count:
+                rule_matches.append(RuleMatch(pattern, self.compiled[index].groups, count, tuple(spans)))
+        return rule_matches
+
+    def match_linear(self, prompt: str) -> List[Dict[str, Any]]:
+        """
+        Evaluate the rule set in linear time (see evaluate_linear).
+
+        Returns:
+            List of {"pattern": ..., "matches": ...} entries in rule order
+        """
+        return [rule_match.as_dict(prompt) for rule_match in self.evaluate_linear(prompt)]
+
+    def stream(self) -> "RuleStream":
+        """Return a RuleStream for evaluating this rule set over chunked input."""
+        return RuleStream(self)
+
+    def match(self, prompt: str, linear: Optional[bool] = None) -> List[Dict[str, Any]]:
+        """
+        Evaluate the rule set against a prompt.
+
+        Args:
+            prompt: Text to scan
+            linear: Use linear-time evaluation. Defaults to linear mode only for
+                prompts longer than LINEAR_MODE_MIN_LENGTH.
+
+        Returns:
+            List of {"pattern": ..., "matches": ...} entries in rule order,
+            identical to running re.findall for every rule
+        """
+        if linear is None:
+            linear = len(prompt) > LINEAR_MODE_MIN_LENGTH
+        if linear:
+            return self.match_linear(prompt)
+
+        matched_patterns = []
+        for index in self.candidate_rules(prompt):
+            matches = self.compiled[index].findall(prompt)
+            if matches:
+                matched_patterns.append({
+                    "pattern": self.patterns[index],
+                    "matches": matches
+                })
+        return matched_patterns
+
+    def evaluate(
+        self,
+        prompt: str,
+        linear: Optional[bool] = None,
+        max_spans: Optional[int] = None,
+        profiler: Optional["DetectorProfiler"] = None
+    ) -> List[RuleMatch]:
+        """
+        Evaluate the rule set against a prompt, recording match offsets.
+
+        Args:
+            prompt: Text to scan
+            linear: Use linear-time evaluation. Defaults to linear mode only for
+                prompts longer than LINEAR_MODE_MIN_LENGTH.
+            max_spans: Maximum number of match spans kept per rule (None: all)
+            profiler: Records the prefilter and each rule's evaluation
+                (see detector_profiler.py)
+
+        Returns:
+            RuleMatch for each matching rule, in rule order
+        """
+        if linear is None:
+            linear = len(prompt) > LINEAR_MODE_MIN_LENGTH
+        if linear:
+            return self.evaluate_linear(prompt, max_spans, profiler)
+        if profiler is not None:
+            return self._evaluate_profiled(prompt, max_spans, profiler)
+
+        rule_matches = []
+        for index in self.candidate_rules(prompt):
+            count, spans = _collect_matches(self.compiled[index], prompt, max_spans)
+            if count:
+                rule_matches.append(RuleMatch(self.patterns[index], self.compiled[index].groups, count, tuple(spans)))
+        return rule_matches
+
+    def _evaluate_profiled(self, prompt: str, max_spans: Optional[int], profiler: "DetectorProfiler") -> List[RuleMatch]:
+        """evaluate() in backtracking mode, timing the prefilter and every rule."""
+        started = time.perf_counter_ns()
+        candidates = self.candidate_rules(prompt)
+        profiler.record_phase("prefilter", time.perf_counter_ns() - started)
+        rule_matches = []
+        for index in candidates:
+            started = time.perf_counter_ns()
+            count, spans = _collect_matches(self.compiled[index], prompt, max_spans)
+            profiler.record_rule(index, time.perf_counter_ns() - started, count > 0)
+            if count:
+                rule_matches.append(RuleMatch(self.patterns[index], self.compiled[index].groups, count, tuple(spans)))
+        return rule_matches
+
+
+class RuleStream:
+    """
+    Incremental evaluation of a CompiledRuleSet over chunked input.
+
+    Memory is bounded by the chunk size plus a short carry-over tail: keyword
+    hits are found on the previous chunk's last few characters plus the new
+    chunk, so keywords split across chunks are still seen. Keyword-sequence
+    rules advance a per-line stage counter; literal rules fire on any keyword
+    hit; other rules are evaluated on a sliding window of
+    LINEAR_FALLBACK_CHARS characters. One witness match is recorded per
+    rule; its groups may differ from the ones re.findall would capture.
+    """
+
+    def __init__(self, ruleset: CompiledRuleSet):
+        self.ruleset = ruleset
+        self.consumed = 0
+        self.matches: Dict[int, Any] = {}
+        self._tail = ""
+        self._tail_size = max((len(keyword) for keyword in ruleset.keyword_hits), default=1) - 1
+        self._line_start = 0
+        # rule index -> [line start, stage, group ends, group texts]
+        self._states: Dict[int, List[Any]] = {
+            index: [0, 0, [0] * len(groups), [""] * len(groups)]
+            for index, groups in ruleset.sequences.items()
+        }
+        self._windowed = [
+            index for index in range(len(ruleset.patterns))
+            if index not in ruleset.sequences and index not in ruleset.literal_rules
+        ]
+        self._window = ""
+
+    def feed(self, chunk: str) -> List[int]:
+        """
+        Consume the next chunk of input.
+
+        Args:
+            chunk: Next piece of the prompt
+
+        Returns:
+            Indices of rules that matched for the first time in this chunk
+        """
+        fired = []
+        ruleset = self.ruleset
+        text = self._tail + chunk
+        offset = self.consumed - len(self._tail)
+        tail_length = len(self._tail)
+
+        if ruleset.scanner is not None:
+            if text.isascii():
+                scan_text = text.lower()
+                search = ruleset.scanner.search
+            else:
+                scan_text = text
+                search = ruleset.scanner_ignorecase.search
+
+            line_end = scan_text.find("\n")
+            match = search(scan_text)
+            while match is not None:
+                start = match.start()
+                if line_end != -1 and start > line_end:
+                    # max(): hits inside the carried tail may precede a
+                    # newline that was already applied
+                    self._line_start = max(self._line_start, offset + scan_text.rfind("\n", 0, start) + 1)
+                    line_end = scan_text.find("\n", start)
+                for length, slots, rules in ruleset._hits_for_keyword(match.group()):
+                    end = start + length
+                    if end <= tail_length:
+                        # Already seen while scanning the previous chunk
+                        continue
+                    for index in rules:
+                        if index in ruleset.literal_rules and index not in self.matches:
+                            self.matches[index] = text[start:end]
+                            fired.append(index)
+                    for index, group_index, _ in slots:
+                        if self._advance(index, group_index, offset + start, offset + end, text[start:end]):
+                            fired.append(index)
+                match = search(scan_text, start + 1)
+
+        # Newlines after the last keyword still end the current line
+        newline = chunk.rfind("\n")
+        if newline != -1:
+            self._line_start = max(self._line_start, self.consumed + newline + 1)
+
+        if self._windowed:
+            window = self._window + chunk
+            for index in self._windowed:
+                if index in self.matches:
+                    continue
+                found = ruleset.compiled[index].search(window)
+                if found is not None:
+                    groups = found.groups()
+                    self.matches[index] = groups[0] if len(groups) == 1 else (groups or found.group())
+                    fired.append(index)
+            self._window = window[-LINEAR_FALLBACK_CHARS:]
+
+        self.consumed += len(chunk)
+        self._tail = text[-self._tail_size:] if self._tail_size else ""
+        return sorted(fired)
+
+    def _advance(self, index: int, group_index: int, start: int, end: int, text: str) -> bool:
+        """Apply one keyword occurrence to a sequence rule; return True if the rule just matched."""
+        if index in self.matches:
+            return False
+        state = self._states[index]
+        line, stage, ends, texts = state
+        if line != self._line_start:
+            state[0] = self._line_start
+            state[1] = stage = 0
+        if group_index > stage or (group_index > 0 and start < ends[group_index - 1]):
+            return False
+        if group_index < stage and end >= ends[group_index]:
+            return False
+        # Either the next group in order, or an earlier-ending occurrence of a
+        # group already matched (which leaves more room for the rest)
+        ends[group_index] = end
+        texts[group_index] = text
+        if group_index == stage:
+            state[1] = stage = stage + 1
+            if stage == len(ends):
+                self.matches[index] = tuple(texts)
+                return True
+        return False
+
+    def rule_matches(self) -> List[RuleMatch]:
+        """
+        Return the rules matched so far.
+
+        Returns:
+            RuleMatch holding the witness match of each matched rule, in rule order
+        """
+        ruleset = self.ruleset
+        return [
+            RuleMatch(ruleset.patterns[index], ruleset.compiled[index].groups, 1, (), (self.matches[index],))
+            for index in sorted(self.matches)
+        ]
+
+    def matched_patterns(self) -> List[Dict[str, Any]]:
+        """
+        Return the rules matched so far.
+
+        Returns:
+            List of {"pattern": ..., "matches": [witness match]} entries in rule order
+        """
+        return [rule_match.as_dict(None) for rule_match in self.rule_matches()]
+
+
+_RULESET_CACHE: Dict[Tuple[str, ...], CompiledRuleSet] = {}
+
+
+def get_compiled_ruleset(patterns: Sequence[str]) -> CompiledRuleSet:
+    """
+    Return the compiled rule set for a list of patterns, compiling it on first use.
+
+    The cache is keyed by the pattern tuple, so editing INJECTION_PATTERNS at
+    runtime transparently yields a freshly compiled rule set.
+
+    Args:
+        patterns: Regex rule sources
+
+    Returns:
+        CompiledRuleSet for the given patterns
+    """
+    key = tuple(patterns)
+    ruleset = _RULESET_CACHE.get(key)
+    if ruleset is None:
+        ruleset = CompiledRuleSet(key)
+        _RULESET_CACHE.clear()
+        _RULESET_CACHE[key] = ruleset
+    return ruleset
@@ -3,9 +3,31 @@ Prompt Injection Detection Module
 Detects potential prompt injection attacks and creates Datadog cases
 """
 
+import os
 import re
-from typing import Optional, Dict, Any, Tuple
-from datadog_monitoring import create_prompt_injection_case
+import threading
+import time
+from collections.abc import Mapping
+from itertools import islice
+from typing import Optional, Dict, Any, Tuple, List, Iterable, Iterator, Sequence, TYPE_CHECKING
+try:
+    from dotenv import load_dotenv
+    # Load .env before the settings read at import or first use
+    # (CASE_SPOOL_DIR, CASE_COALESCE_WINDOW, SENTINEL_METRICS, ...)
+    load_dotenv()
+except ImportError:
+    # python-dotenv not installed, environment variables must be set manually
+    pass
+
+from flood_detector import FloodDetector
+from pattern_engine import RuleMatch, get_compiled_ruleset
+from ttl_cache import TTLCache
+from token_estimator import get_token_estimator, token_caps
+from metrics import get_metrics
+from request_log import get_request_log
+
+if TYPE_CHECKING:
+    from detector_profiler import DetectorProfiler
 
 
 # Common prompt injection patterns
@@ -22,89 +44,653 @@ INJECTION_PATTERNS = [
     r"(?i)(translate|convert).*(to|into).*(base64|hex|binary)",
 ]
 
+# Long runs of base64 alphabet characters
+BASE64_PATTERN = re.compile(r'[A-Za-z0-9+/]{20,}={0,2}')
+BASE64_MIN_RUN = 20
+_BASE64_LEADING_RUN = re.compile(r'[A-Za-z0-9+/]*')
+_BASE64_TRAILING_RUN = re.compile(r'[A-Za-z0-9+/]*\Z')
+
+# Heuristic thresholds
+EXTREMELY_LONG_PROMPT_CHARS = 10000
+REPETITION_MIN_WORDS = 50
+REPETITION_MIN_CHAR_BLOCKS = 64
+REPETITION_RATIO_THRESHOLD = 5
+
+# Match spans kept per rule in a DetectionResult
+MAX_MATCH_SPANS = 10
+
+# Compile the default rule set once at import rather than on the first request
+get_compiled_ruleset(INJECTION_PATTERNS)
 
-def detect_prompt_injection(prompt: str, user_id: Optional[str] = None) -> Tuple[bool, Optional[str], Dict[str, Any]]:
+
+class DetectionResult(Mapping):
+    """
+    Compact detection metadata for one prompt.
+    
+    Rule matches are kept as at most MAX_MATCH_SPANS offset spans per rule
+    (RuleMatch) and the prompt is referenced rather than copied, so the size
+    of a result does not grow with the number of matches. The object reads
+    like the legacy metadata dict (result["matched_patterns"], result.get(),
+    {**result}); that dict view is built on first access.
+    """
+    
+    __slots__ = (
+        "prompt", "prompt_length", "user_id", "rule_matches", "repetition_ratio",
+        "high_repetition", "potential_encoding", "extremely_long_prompt", "repetition_kind", "_view"
+    )
+    
+    def __init__(
+        self,
+        prompt: Optional[str],
+        prompt_length: int,
+        user_id: Optional[str],
+        rule_matches: Sequence[RuleMatch] = (),
+        repetition_ratio: Optional[float] = None,
+        high_repetition: bool = False,
+        potential_encoding: Optional[str] = None,
+        extremely_long_prompt: bool = False,
+        repetition_kind: Optional[str] = None
+    ):
+        self.prompt = prompt
+        self.prompt_length = prompt_length
+        self.user_id = user_id
+        self.rule_matches = tuple(rule_matches)
+        self.repetition_ratio = repetition_ratio
+        self.high_repetition = high_repetition
+        self.potential_encoding = potential_encoding
+        self.extremely_long_prompt = extremely_long_prompt
+        self.repetition_kind = repetition_kind
+        self._view = None
+    
+    @property
+    def is_injection(self) -> bool:
+        """Whether any rule or blocking heuristic fired."""
+        return bool(self.rule_matches) or self.high_repetition or self.extremely_long_prompt
+    
+    @property
+    def matched_pattern(self) -> Optional[str]:
+        """Source of the first matched rule, if any."""
+        return self.rule_matches[0].pattern if self.rule_matches else None
+    
+    def with_context(self, prompt: Optional[str], user_id: Optional[str]) -> "DetectionResult":
+        """Return a copy bound to another prompt object and user, sharing the match spans."""
+        return DetectionResult(
+            prompt, self.prompt_length, user_id, self.rule_matches, self.repetition_ratio,
+            self.high_repetition, self.potential_encoding, self.extremely_long_prompt,
+            self.repetition_kind
+        )
+    
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return the legacy metadata dictionary (built once, then reused).
+        
+        Returns:
+            Dictionary with prompt_length, user_id, matched_patterns and any
+            heuristic flags that fired
+        """
+        view = self._view
+        if view is None:
+            view = {
+                "prompt_length": self.prompt_length,
+                "user_id": self.user_id,
+                "matched_patterns": [rule_match.as_dict(self.prompt) for rule_match in self.rule_matches]
+            }
+            if self.high_repetition:
+                view["high_repetition"] = True
+                view["repetition_ratio"] = self.repetition_ratio
+                view["repetition_kind"] = self.repetition_kind
+            if self.potential_encoding:
+                view["potential_encoding"] = self.potential_encoding
+            if self.extremely_long_prompt:
+                view["extremely_long_prompt"] = True
+            self._view = view
+        return view
+    
+    def __getitem__(self, key: str) -> Any:
+        return self.as_dict()[key]
+    
+    def __iter__(self):
+        return iter(self.as_dict())
+    
+    def __len__(self) -> int:
+        return len(self.as_dict())
+    
+    def __repr__(self) -> str:
+        return f"DetectionResult({self.as_dict()!r})"
+
+# Opt-in cache of verdicts, keyed by prompt fingerprint (see enable_verdict_cache)
+_verdict_cache: Optional[TTLCache] = None
+_verdict_cache_rules: Tuple[str, ...] = ()
+# Guards _verdict_cache_rules and the clear/put decisions that depend on it
+_verdict_cache_lock = threading.Lock()
+
+
+def enable_verdict_cache(max_entries: int = 10000, ttl_seconds: Optional[float] = 300.0) -> TTLCache:
+    """
+    Cache detect_prompt_injection verdicts for repeated prompts.
+    
+    Bots resend identical injection strings; with the cache enabled each
+    distinct prompt is scanned once per TTL. The cache is cleared
+    automatically whenever INJECTION_PATTERNS changes.
+    
+    Args:
+        max_entries: Maximum number of cached verdicts (LRU eviction)
+        ttl_seconds: Verdict lifetime in seconds (None: no expiry)
+    
+    Returns:
+        The new TTLCache
+    """
+    global _verdict_cache, _verdict_cache_rules
+    cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    with _verdict_cache_lock:
+        _verdict_cache_rules = tuple(INJECTION_PATTERNS)
+        _verdict_cache = cache
+    return cache
+
+
+def disable_verdict_cache() -> None:
+    """Disable and drop the verdict cache."""
+    global _verdict_cache
+    _verdict_cache = None
+
+
+def verdict_cache_stats() -> Optional[Dict[str, Any]]:
+    """
+    Return verdict cache counters (hits, misses, evictions, ...).
+    
+    Returns:
+        Stats dictionary, or None if the cache is disabled
+    """
+    cache = _verdict_cache
+    return cache.stats() if cache is not None else None
+
+
+# Opt-in profiler (see enable_detector_profiling); None keeps the hot path to
+# a single check per phase
+_profiler: Optional["DetectorProfiler"] = None
+
+
+def enable_detector_profiling(dump_path: Optional[str] = None, dump_interval: float = 60.0) -> "DetectorProfiler":
+    """
+    Record per-rule and per-phase detector timings.
+    
+    Each rule's full-regex evaluations, time and matches are recorded, as
+    are the prefilter, rules, repetition, base64 and cache phases and
+    prompt length buckets. Use detector_profile_stats() or the profiler's
+    report() to decide which rules to prune or reorder.
+    
+    Args:
+        dump_path: JSON file the profile is written to periodically (None: no dumps)
+        dump_interval: Seconds between dumps
+    
+    Returns:
+        The new DetectorProfiler
+    """
+    global _profiler
+    from detector_profiler import DetectorProfiler
+    
+    disable_detector_profiling()
+    _profiler = DetectorProfiler(INJECTION_PATTERNS, dump_path=dump_path, dump_interval=dump_interval)
+    return _profiler
+
+
+def disable_detector_profiling() -> None:
+    """Stop profiling and drop the collected profile."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.close()
+
+
+def detector_profile_stats() -> Optional[Dict[str, Any]]:
+    """
+    Return the detector profile.
+    
+    Returns:
+        DetectorProfiler.stats() snapshot, or None if profiling is disabled
+    """
+    profiler = _profiler
+    return profiler.stats() if profiler is not None else None
+
+
+if os.getenv("DETECTOR_PROFILE_DUMP"):
+    enable_detector_profiling(
+        dump_path=os.environ["DETECTOR_PROFILE_DUMP"],
+        dump_interval=float(os.getenv("DETECTOR_PROFILE_INTERVAL", "60"))
+    )
+
+
+def _prompt_fingerprint(prompt: str) -> bytes:
+    """128-bit BLAKE2b digest of the prompt text."""
+    import hashlib
+    return hashlib.blake2b(prompt.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def detect_prompt_injection(prompt: str, user_id: Optional[str] = None) -> Tuple[bool, Optional[str], DetectionResult]:
     """
     Detect potential prompt injection in a user's input.
     
+    Emits sentinel.detector.* metrics (latency, injections by reason, hits
+    per rule) when metrics are enabled (see metrics.py).
+    
     Args:
         prompt: User's input prompt to analyze
         user_id: Optional user ID for logging/context
     
     Returns:
-        Tuple of (is_injection: bool, matched_pattern: Optional[str], metadata: Dict)
+        Tuple of (is_injection: bool, matched_pattern: Optional[str], metadata),
+        where metadata is a DetectionResult (with no matches for blank prompts)
     """
+    metrics = get_metrics()
+    if metrics is None:
+        return _detect_prompt_injection(prompt, user_id)
+    
+    started = time.perf_counter()
+    verdict = _detect_prompt_injection(prompt, user_id)
+    # The histogram's .count doubles as the number of prompts checked
+    metrics.timing("sentinel.detector.latency", started)
+    if verdict[0]:
+        result = verdict[2]
+        for match in result.rule_matches:
+            metrics.increment("sentinel.detector.rule_hits", tags=(_rule_tag(match.pattern),))
+        metrics.increment("sentinel.detector.injections", tags=(f"reason:{_injection_reason(result)}",))
+    return verdict
+
+
+def _injection_reason(result: DetectionResult) -> str:
+    """Why a flagged prompt was flagged: "rule", "repetition" or "length"."""
+    if result.rule_matches:
+        return "rule"
+    if result.high_repetition:
+        return "repetition"
+    return "length"
+
+
+def _rule_index(pattern: str) -> int:
+    """Index of a rule in INJECTION_PATTERNS (-1 if it is no longer there)."""
+    try:
+        return INJECTION_PATTERNS.index(pattern)
+    except ValueError:
+        return -1
+
+
+def _rule_tag(pattern: str) -> str:
+    """Metric tag naming a rule by its index in INJECTION_PATTERNS."""
+    index = _rule_index(pattern)
+    return f"rule:{index}" if index >= 0 else "rule:unknown"
+
+
+def _detect_prompt_injection(prompt: str, user_id: Optional[str]) -> Tuple[bool, Optional[str], DetectionResult]:
+    """detect_prompt_injection() without metrics."""
     if not prompt or len(prompt.strip()) == 0:
-        return False, None, {}
+        return False, None, DetectionResult(prompt, len(prompt or ""), user_id)
     
-    prompt_lower = prompt.lower()
-    metadata = {
-        "prompt_length": len(prompt),
-        "user_id": user_id,
-        "matched_patterns": []
-    }
+    profiler = _profiler
+    if profiler is not None:
+        started = time.perf_counter_ns()
     
-    # Check for suspicious patterns
-    for pattern in INJECTION_PATTERNS:
-        matches = re.findall(pattern, prompt)
-        if matches:
-            metadata["matched_patterns"].append({
-                "pattern": pattern,
-                "matches": matches
-            })
+    # The fingerprint covers the exact text: case, whitespace and length all
+    # feed into the metadata, so no lossy normalization is applied
+    global _verdict_cache_rules
+    cache = _verdict_cache
+    if cache is not None:
+        rules = tuple(INJECTION_PATTERNS)
+        if rules != _verdict_cache_rules:
+            with _verdict_cache_lock:
+                # Re-checked: another thread may have cleared it already
+                if rules != _verdict_cache_rules:
+                    cache.clear()
+                    _verdict_cache_rules = rules
+        cache_key = _prompt_fingerprint(prompt)
+        cached = cache.get(cache_key)
+        if profiler is not None:
+            profiler.record_phase("cache", time.perf_counter_ns() - started)
+        if cached is not None:
+            # Per-call fields are filled in again on every hit
+            result = cached.with_context(prompt, user_id)
+            if profiler is not None:
+                profiler.record_prompt(len(prompt), time.perf_counter_ns() - started, result.is_injection)
+            return result.is_injection, result.matched_pattern, result
+    
+    result = DetectionResult(prompt, len(prompt), user_id)
+    
+    # Check for suspicious patterns (single keyword prefilter pass, then full
+    # regex only for rules whose keywords appeared). Long prompts switch to
+    # linear-time evaluation so `.*` rules cannot backtrack quadratically.
+    if profiler is not None:
+        phase_started = time.perf_counter_ns()
+    result.rule_matches = tuple(
+        get_compiled_ruleset(INJECTION_PATTERNS).evaluate(prompt, max_spans=MAX_MATCH_SPANS, profiler=profiler)
+    )
+    if profiler is not None:
+        now = time.perf_counter_ns()
+        profiler.record_phase("rules", now - phase_started)
+        phase_started = now
     
     # Additional heuristics
     # Check for excessive repetition (potential token flooding)
-    words = prompt.split()
-    if len(words) > 0:
-        unique_words = set(words)
-        repetition_ratio = len(words) / len(unique_words) if len(unique_words) > 0 else 0
-        if repetition_ratio > 5 and len(words) > 50:
-            metadata["high_repetition"] = True
-            metadata["repetition_ratio"] = repetition_ratio
+    flood = FloodDetector(
+        track_characters=len(prompt) > FloodDetector.CHAR_BLOCK * REPETITION_MIN_CHAR_BLOCKS
+    )
+    flood.feed(prompt)
+    _apply_flood_verdict(result, flood)
+    if profiler is not None:
+        now = time.perf_counter_ns()
+        profiler.record_phase("repetition", now - phase_started)
+        phase_started = now
     
     # Check for suspicious encoding attempts
-    if re.search(r'[A-Za-z0-9+/]{20,}={0,2}', prompt):
+    if BASE64_PATTERN.search(prompt):
         # Potential base64 encoding
-        metadata["potential_encoding"] = "base64"
+        result.potential_encoding = "base64"
+    if profiler is not None:
+        profiler.record_phase("base64", time.perf_counter_ns() - phase_started)
     
     # Check for suspicious length (potential DoW)
-    if len(prompt) > 10000:
-        metadata["extremely_long_prompt"] = True
-    
-    # Determine if injection detected
-    is_injection = (
-        len(metadata.get("matched_patterns", [])) > 0 or
-        metadata.get("high_repetition", False) or
-        metadata.get("extremely_long_prompt", False)
+    if len(prompt) > EXTREMELY_LONG_PROMPT_CHARS:
+        result.extremely_long_prompt = True
+    
+    if cache is not None:
+        with _verdict_cache_lock:
+            # Not stored if the rules changed while this prompt was scanned
+            if rules == _verdict_cache_rules == tuple(INJECTION_PATTERNS):
+                cache.put(cache_key, result.with_context(None, None))
+    
+    if profiler is not None:
+        profiler.record_prompt(len(prompt), time.perf_counter_ns() - started, result.is_injection)
+    return result.is_injection, result.matched_pattern, result
+
+
+DetectionVerdict = Tuple[bool, Optional[str], DetectionResult]
+
+
+def _apply_flood_verdict(result: DetectionResult, flood: FloodDetector) -> None:
+    """Record word or character flooding from a FloodDetector on a result."""
+    flood.finish()
+    verdict = flood.verdict(
+        ratio_threshold=REPETITION_RATIO_THRESHOLD,
+        min_words=REPETITION_MIN_WORDS,
+        min_blocks=REPETITION_MIN_CHAR_BLOCKS
     )
+    if verdict is not None:
+        result.high_repetition = True
+        result.repetition_ratio = verdict["ratio"]
+        result.repetition_kind = verdict["kind"]
+
+
+def _init_batch_worker(patterns: List[str]) -> None:
+    """Process pool initializer: adopt the parent's rule set and compile it once."""
+    INJECTION_PATTERNS[:] = patterns
+    get_compiled_ruleset(INJECTION_PATTERNS)
+
+
+def _detect_chunk(chunk: List[Tuple[int, str, Optional[str]]]) -> List[Tuple[int, DetectionVerdict]]:
+    """Run detect_prompt_injection over a chunk of (index, prompt, user_id) items."""
+    results = []
+    for index, prompt, user_id in chunk:
+        is_injection, matched_pattern, metadata = detect_prompt_injection(prompt, user_id)
+        if isinstance(metadata, DetectionResult):
+            # The parent re-attaches its own prompt instead of receiving a pickled copy
+            metadata = metadata.with_context(None, user_id)
+        results.append((index, (is_injection, matched_pattern, metadata)))
+    return results
+
+
+def _indexed_pairs(
+    prompts: Iterable[str],
+    user_ids: Iterable[Optional[str]]
+) -> Iterator[Tuple[int, str, Optional[str]]]:
+    """Yield (index, prompt, user_id), raising ValueError if the iterables differ in length."""
+    user_ids = iter(user_ids)
+    missing = object()
+    index = -1
+    for index, prompt in enumerate(prompts):
+        user_id = next(user_ids, missing)
+        if user_id is missing:
+            raise ValueError("user_ids must have the same length as prompts")
+        yield index, prompt, user_id
+    if next(user_ids, missing) is not missing:
+        raise ValueError("user_ids must have the same length as prompts")
+
+
+def iter_detect_prompt_injection_batch(
+    prompts: Iterable[str],
+    user_ids: Optional[Iterable[Optional[str]]] = None,
+    max_workers: Optional[int] = None,
+    chunk_size: int = 64
+) -> Iterator[Tuple[int, DetectionVerdict]]:
+    """
+    Detect prompt injection across many prompts, yielding results as they finish.
+    
+    Prompts are sent to a process pool in chunks; each worker compiles the
+    rule set once at startup. Results arrive in completion order, so a slow
+    prompt only delays its own chunk. At most a few chunks per worker are in
+    flight, so arbitrarily long iterables can be streamed.
+    
+    Args:
+        prompts: Prompts to analyze
+        user_ids: Optional user IDs, parallel to prompts
+        max_workers: Number of worker processes (default: CPU count)
+        chunk_size: Prompts per task sent to a worker
+    
+    Returns:
+        Iterator of (input index, (is_injection, matched_pattern, metadata))
+    
+    Raises:
+        ValueError: If user_ids and prompts have different lengths (raised
+            once the shorter one runs out)
+    """
+    if user_ids is None:
+        items = ((index, prompt, None) for index, prompt in enumerate(prompts))
+    else:
+        items = _indexed_pairs(prompts, user_ids)
     
-    matched_pattern = None
-    if metadata.get("matched_patterns"):
-        matched_pattern = metadata["matched_patterns"][0]["pattern"]
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        for index, prompt, user_id in items:
+            yield index, detect_prompt_injection(prompt, user_id)
+        return
     
-    return is_injection, matched_pattern, metadata
+    # Only batch callers pay for importing the process pool machinery
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+    
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_batch_worker,
+        initargs=(list(INJECTION_PATTERNS),)
+    ) as executor:
+        chunks = {}
+        max_pending = max_workers * 4
+        exhausted = False
+        while True:
+            while not exhausted and len(chunks) < max_pending:
+                chunk = list(islice(items, chunk_size))
+                if not chunk:
+                    exhausted = True
+                    break
+                chunks[executor.submit(_detect_chunk, chunk)] = chunk
+            if not chunks:
+                break
+            done, _ = wait(chunks, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = chunks.pop(future)
+                for (index, verdict), (_, prompt, user_id) in zip(future.result(), chunk):
+                    is_injection, matched_pattern, metadata = verdict
+                    if isinstance(metadata, DetectionResult):
+                        verdict = (is_injection, matched_pattern, metadata.with_context(prompt, user_id))
+                    yield index, verdict
+
+
+def detect_prompt_injection_batch(
+    prompts: Sequence[str],
+    user_ids: Optional[Sequence[Optional[str]]] = None,
+    max_workers: Optional[int] = None,
+    chunk_size: int = 256
+) -> List[DetectionVerdict]:
+    """
+    Detect prompt injection for a batch of prompts using a process pool.
+    
+    Batches smaller than two chunks are processed in the calling process,
+    where pool startup would cost more than it saves.
+    
+    Args:
+        prompts: Prompts to analyze
+        user_ids: Optional user IDs, parallel to prompts
+        max_workers: Number of worker processes (default: CPU count)
+        chunk_size: Prompts per task sent to a worker
+    
+    Returns:
+        List of (is_injection, matched_pattern, metadata) tuples in input order
+    """
+    if user_ids is not None and len(user_ids) != len(prompts):
+        raise ValueError("user_ids must have the same length as prompts")
+    
+    if len(prompts) < chunk_size * 2:
+        max_workers = 1
+    
+    results: List[Optional[DetectionVerdict]] = [None] * len(prompts)
+    for index, verdict in iter_detect_prompt_injection_batch(prompts, user_ids, max_workers, chunk_size):
+        results[index] = verdict
+    return results
+
+
+class StreamingDetector:
+    """
+    Incremental prompt injection detector for prompts received in chunks.
+    
+    Memory stays bounded regardless of prompt size: rules are evaluated by a
+    RuleStream that carries only a short tail between chunks, and the length,
+    repetition and encoding heuristics are running counters (repetition via
+    the constant-memory FloodDetector).
+    
+    injection_detected becomes True as soon as a rule fires or the prompt
+    exceeds EXTREMELY_LONG_PROMPT_CHARS, so callers can reject early. The
+    repetition heuristic depends on the whole prompt and is applied in
+    finish(). matched_patterns holds one witness match per rule.
+    
+    Example:
+        detector = StreamingDetector(user_id)
+        for chunk in chunks:
+            if detector.feed(chunk):
+                break
+        is_injection, matched_pattern, metadata = detector.finish()
+    """
+    
+    def __init__(self, user_id: Optional[str] = None):
+        self.user_id = user_id
+        self.prompt_length = 0
+        self.injection_detected = False
+        self.potential_encoding = False
+        self._rules = get_compiled_ruleset(INJECTION_PATTERNS).stream()
+        self._has_text = False
+        self._flood = FloodDetector()
+        self._base64_run = 0
+    
+    def feed(self, chunk: str) -> bool:
+        """
+        Consume the next chunk of the prompt.
+        
+        Args:
+            chunk: Next piece of the prompt
+        
+        Returns:
+            True if an injection has been detected so far
+        """
+        if not chunk:
+            return self.injection_detected
+        
+        self.prompt_length += len(chunk)
+        if not self._has_text and not chunk.isspace():
+            self._has_text = True
+        
+        if self._rules.feed(chunk):
+            self.injection_detected = True
+        if self.prompt_length > EXTREMELY_LONG_PROMPT_CHARS:
+            self.injection_detected = True
+        
+        self._flood.feed(chunk)
+        self._track_base64(chunk)
+        return self.injection_detected
+    
+    def _track_base64(self, chunk: str) -> None:
+        """Track base64-alphabet runs, including runs split across chunks."""
+        if self.potential_encoding:
+            return
+        leading = _BASE64_LEADING_RUN.match(chunk).end()
+        if leading == len(chunk):
+            self._base64_run += leading
+        else:
+            if self._base64_run + leading >= BASE64_MIN_RUN or BASE64_PATTERN.search(chunk):
+                self.potential_encoding = True
+                return
+            self._base64_run = len(_BASE64_TRAILING_RUN.search(chunk).group())
+        if self._base64_run >= BASE64_MIN_RUN:
+            self.potential_encoding = True
+    
+    def finish(self) -> DetectionVerdict:
+        """
+        Close the stream and return the final verdict.
+        
+        Returns:
+            Tuple of (is_injection, matched_pattern, metadata), shaped like
+            the result of detect_prompt_injection
+        """
+        if not self._has_text:
+            return False, None, DetectionResult(None, self.prompt_length, self.user_id)
+        
+        result = DetectionResult(None, self.prompt_length, self.user_id, self._rules.rule_matches())
+        
+        _apply_flood_verdict(result, self._flood)
+        
+        if self.potential_encoding:
+            result.potential_encoding = "base64"
+        
+        if self.prompt_length > EXTREMELY_LONG_PROMPT_CHARS:
+            result.extremely_long_prompt = True
+        
+        self.injection_detected = result.is_injection
+        return result.is_injection, result.matched_pattern, result
 
 
 def handle_prompt_injection(
     prompt: str,
     user_id: str,
     create_case: bool = True,
-    additional_context: Optional[Dict[str, Any]] = None
+    additional_context: Optional[Dict[str, Any]] = None,
+    wait_for_case: bool = False,
+    max_input_tokens: Optional[int] = None
 ) -> Dict[str, Any]:
     """
     Detect prompt injection and optionally create a Datadog case.
     
+    Cases are queued for a background worker (see case_queue.py) so the
+    Datadog round trip stays off the request path; the result then carries
+    a PendingCase handle under "case_handle" and "case_pending" is True.
+    Repeated detections from the same user within the coalescing window
+    reuse the user's open case ("case_coalesced" is True) and are appended
+    to it as a summary (see case_coalescer.py).
+    
+    The prompt's token count is estimated locally (see token_estimator.py)
+    and returned as "estimated_tokens"; prompts over the input cap are
+    flagged with "token_limit_exceeded" so callers can refuse them before
+    any model call. Case and prompt size counters are emitted as
+    sentinel.cases.* and sentinel.prompt.* metrics, and the verdict is
+    written to the request log when one is configured (see request_log.py).
+    
     Args:
         prompt: User's input prompt
         user_id: User ID who submitted the prompt
         create_case: Whether to create a Datadog case (default: True)
         additional_context: Optional additional context for the case
+        wait_for_case: Create the case synchronously instead of queueing it
+        max_input_tokens: Input token cap (default: GEMINI_MAX_INPUT_TOKENS env var, if set)
     
     Returns:
         Dictionary with detection results and case creation status
     """
+    started = time.perf_counter()
     is_injection, matched_pattern, metadata = detect_prompt_injection(prompt, user_id)
+    detector_ms = (time.perf_counter() - started) * 1000.0
     
     result = {
         "injection_detected": is_injection,
@@ -113,12 +699,69 @@ def handle_prompt_injection(
         "case_created": False
     }
     
+    max_input_tokens = max_input_tokens or token_caps()[0]
+    result["estimated_tokens"] = get_token_estimator().estimate(prompt)
+    result["token_limit_exceeded"] = (
+        max_input_tokens is not None and result["estimated_tokens"] > max_input_tokens
+    )
+    
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.histogram("sentinel.prompt.estimated_tokens", result["estimated_tokens"])
+        if result["token_limit_exceeded"]:
+            metrics.increment("sentinel.prompt.too_long")
+    
+    request_log = get_request_log()
+    if request_log is not None:
+        # Serialized on the log's writer thread, not here
+        request_log.log({
+            "type": "detection",
+            "user_id": user_id,
+            "prompt": prompt,
+            "injection": is_injection,
+            "reason": _injection_reason(metadata) if is_injection else None,
+            "rules": [_rule_index(match.pattern) for match in metadata.rule_matches] if is_injection else [],
+            "estimated_tokens": result["estimated_tokens"],
+            "token_limit_exceeded": result["token_limit_exceeded"],
+            "detector_ms": round(detector_ms, 3)
+        })
+    
     if is_injection and create_case:
         # Merge additional context with detection metadata
         case_context = {**metadata}
         if additional_context:
             case_context.update(additional_context)
         
+        if not wait_for_case:
+            from case_coalescer import get_case_coalescer
+            
+            coalesced = get_case_coalescer().record(
+                user_id=user_id,
+                prompt=prompt,
+                matched_pattern=matched_pattern,
+                additional_context=case_context
+            )
+            handle = coalesced["handle"]
+            if handle is None:
+                result["case_message"] = "Case could not be queued"
+                return result
+            result["case_pending"] = not handle.done()
+            result["case_handle"] = handle
+            result["case_coalesced"] = coalesced["coalesced"]
+            if handle.case_id:
+                result["case_id"] = handle.case_id
+            if coalesced["coalesced"]:
+                result["case_message"] = (
+                    f"Detection {coalesced['count']} for this user added to case {handle.case_id or handle.case_key}"
+                )
+            else:
+                result["case_message"] = f"Case queued for submission ({handle.case_key})"
+            if metrics is not None:
+                metrics.increment("sentinel.cases.coalesced" if coalesced["coalesced"] else "sentinel.cases.queued")
+            return result
+        
+        from datadog_monitoring import create_prompt_injection_case
+        
         case_result = create_prompt_injection_case(
             user_id=user_id,
             offending_prompt=prompt,
@@ -131,6 +774,11 @@ def handle_prompt_injection(
         
         if not case_result.get("success"):
             result["case_error"] = case_result.get("error")
+        if metrics is not None:
+            metrics.increment(
+                "sentinel.cases.created",
+                tags=(f"success:{str(result['case_created']).lower()}",)
+            )
     
     return result
 
@@ -0,0 +1,142 @@
+"""
+Quantile Sketch
+Mergeable DDSketch with bounded memory for streaming quantile estimates
+"""
+
+import math
+from typing import Optional, Dict, Any
+
+
+# Values at or below this are counted as zero
+MIN_POSITIVE_VALUE = 1e-9
+
+
+class DDSketch:
+    """
+    DDSketch (Masson, Rim and Lee, 2019) for non-negative values.
+
+    Values are counted in logarithmic buckets of ratio gamma, so every
+    quantile is returned within relative_accuracy of an actual value in the
+    data. At most max_buckets buckets are kept: beyond that the lowest ones
+    are folded together, which only affects low quantiles (the high ones
+    thresholds are derived from stay accurate). Two sketches with the same
+    relative_accuracy can be merged, e.g. per-process or per-run sketches.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        """
+        Args:
+            relative_accuracy: Maximum relative error of returned quantiles
+            max_buckets: Bucket limit (memory is O(max_buckets))
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count: int = 1) -> None:
+        """
+        Add a value (count times).
+
+        Args:
+            value: Non-negative value
+            count: Number of occurrences
+        """
+        if value < 0:
+            raise ValueError("DDSketch only accepts non-negative values")
+        self.count += count
+        self.sum += value * count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= MIN_POSITIVE_VALUE:
+            self.zero_count += count
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_buckets
+        folded = sum(self.bins.pop(key) for key in keys[:excess])
+        self.bins[keys[excess]] += folded
+
+    def merge(self, other: "DDSketch") -> None:
+        """
+        Add another sketch's values to this one.
+
+        Args:
+            other: Sketch with the same relative_accuracy
+        """
+        if not math.isclose(other.gamma, self.gamma):
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self.bins) > self.max_buckets:
+            self._collapse()
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile.
+
+        Args:
+            q: Quantile between 0 and 1
+
+        Returns:
+            Estimated value, or None if the sketch is empty
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        running = self.zero_count
+        for key in sorted(self.bins):
+            running += self.bins[key]
+            if running > rank:
+                # Midpoint (in relative terms) of the bucket (gamma^(key-1), gamma^key]
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return a JSON-serializable representation (see from_dict)."""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_buckets": self.max_buckets,
+            "bins": {str(key): count for key, count in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DDSketch":
+        """Rebuild a sketch saved with to_dict()."""
+        sketch = cls(data["relative_accuracy"], data["max_buckets"])
+        sketch.bins = {int(key): count for key, count in data["bins"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
@@ -0,0 +1,318 @@
+"""
+Cross-Process Quota Store
+SQLite (WAL mode) backed token and request budgets shared by every worker
+process on a host
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, Tuple
+
+from token_budget import TokenBudget, TokenBudgetExceeded
+
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS quota_counters (
+        key TEXT PRIMARY KEY,
+        window INTEGER NOT NULL,
+        tokens INTEGER NOT NULL,
+        prev_tokens INTEGER NOT NULL,
+        requests INTEGER NOT NULL,
+        prev_requests INTEGER NOT NULL
+    ) WITHOUT ROWID
+"""
+
+_COLUMNS = "window, tokens, prev_tokens, requests, prev_requests"
+
+# Adds (?3 tokens, ?4 requests) to key ?1 in window ?2, first rolling the
+# row's current window into the previous one if the window has moved on
+_UPSERT = """
+    INSERT INTO quota_counters (key, window, tokens, prev_tokens, requests, prev_requests)
+    VALUES (?1, ?2, max(0, ?3), 0, ?4, 0)
+    ON CONFLICT (key) DO UPDATE SET
+        prev_tokens = CASE WHEN window >= ?2 THEN prev_tokens WHEN window = ?2 - 1 THEN tokens ELSE 0 END,
+        prev_requests = CASE WHEN window >= ?2 THEN prev_requests WHEN window = ?2 - 1 THEN requests ELSE 0 END,
+        tokens = max(0, CASE WHEN window >= ?2 THEN tokens ELSE 0 END + ?3),
+        requests = CASE WHEN window >= ?2 THEN requests ELSE 0 END + ?4,
+        window = max(window, ?2)
+"""
+
+# UPSERT ... RETURNING saves a query per key (SQLite 3.35+)
+_RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Key of the global counters (user keys are prefixed with "u:")
+GLOBAL_KEY = "*"
+
+
+class SQLiteQuotaStore(TokenBudget):
+    """
+    TokenBudget whose counters live in a SQLite database shared by processes.
+
+    Uses the same sliding window counters as TokenBudget, stored as one row
+    per key holding the current and previous window's tokens and requests.
+    acquire() increments the user and global rows and checks the result
+    inside a single BEGIN IMMEDIATE transaction (rolled back if a budget is
+    exceeded), so the check and the increment are atomic across every
+    process using the same file. Besides token budgets, per-user and global
+    request counts can be limited too. Rows of users idle for two windows
+    are deleted once per window.
+
+    Wall-clock time is used for windows so every process agrees on them.
+    Each thread (and each process after fork) opens its own connection.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        user_limit: Optional[int] = None,
+        global_limit: Optional[int] = None,
+        user_request_limit: Optional[int] = None,
+        global_request_limit: Optional[int] = None,
+        window_seconds: float = 300.0,
+        mode: str = "reject",
+        max_wait_seconds: float = 30.0,
+        busy_timeout: float = 5.0
+    ):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            user_limit: Tokens each user may consume per window (None: unlimited)
+            global_limit: Tokens all users together may consume per window (None: unlimited)
+            user_request_limit: Requests each user may make per window (None: unlimited)
+            global_request_limit: Requests all users together may make per window (None: unlimited)
+            window_seconds: Sliding window length
+            mode: "reject" or "throttle"
+            max_wait_seconds: Longest wait in throttle mode
+            busy_timeout: Seconds to wait for another process's write lock
+        """
+        super().__init__(
+            user_limit=user_limit,
+            global_limit=global_limit,
+            window_seconds=window_seconds,
+            mode=mode,
+            max_wait_seconds=max_wait_seconds
+        )
+        self.path = path
+        self.user_request_limit = user_request_limit
+        self.global_request_limit = global_request_limit
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connection()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Connections and locks are per process; rebuilt after unpickling
+        state = dict(self.__dict__)
+        del state["_local"], state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        connection = getattr(local, "connection", None)
+        if connection is None or local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # WAL with synchronous=NORMAL stays consistent on crash and only
+            # syncs at checkpoints; losing the last counters on power loss is fine
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_SCHEMA)
+            local.connection = connection
+            local.pid = os.getpid()
+            local.expired_before = None
+        return connection
+
+    def _upsert(self, connection: sqlite3.Connection, key: str, index: int, tokens: int, requests: int) -> tuple:
+        """Add to a key's counters and return its updated row."""
+        if _RETURNING_SUPPORTED:
+            return connection.execute(f"{_UPSERT} RETURNING {_COLUMNS}", (key, index, tokens, requests)).fetchone()
+        connection.execute(_UPSERT, (key, index, tokens, requests))
+        return connection.execute(f"SELECT {_COLUMNS} FROM quota_counters WHERE key = ?", (key,)).fetchone()
+
+    def _read(self, connection: sqlite3.Connection, keys: Tuple[str, ...]) -> Dict[str, tuple]:
+        """Return {key: (window, tokens, prev_tokens, requests, prev_requests)} for existing keys."""
+        placeholders = ", ".join("?" * len(keys))
+        rows = connection.execute(
+            f"SELECT key, {_COLUMNS} FROM quota_counters WHERE key IN ({placeholders})", keys
+        )
+        return {row[0]: row[1:] for row in rows}
+
+    def _evaluate(
+        self,
+        rows: Dict[str, tuple],
+        user_key: Optional[str],
+        tokens: int,
+        now: float
+    ) -> Optional[TokenBudgetExceeded]:
+        """Check token and request budgets against counters before this request."""
+        checks = [(GLOBAL_KEY, "global", self.global_limit, self.global_request_limit)]
+        if user_key is not None:
+            checks.append((user_key, "user", self.user_limit, self.user_request_limit))
+        exceeded = None
+        for key, scope, token_limit, request_limit in checks:
+            window, used_tokens, prev_tokens, requests, prev_requests = rows.get(key, (0, 0, 0, 0, 0))
+            for suffix, state, limit, amount in (
+                ("", [window, used_tokens, prev_tokens], token_limit, tokens),
+                (" requests", [window, requests, prev_requests], request_limit, 1),
+            ):
+                if limit is None:
+                    continue
+                usage = self._estimate(state, now)
+                if usage + amount > limit:
+                    retry_after = self._retry_after(state, limit, amount, now)
+                    if exceeded is None or retry_after > exceeded.retry_after:
+                        exceeded = TokenBudgetExceeded(scope + suffix, usage, limit, retry_after)
+        return exceeded
+
+    def _expire(self, connection: sqlite3.Connection, index: int) -> None:
+        # Once per window per connection; rows last charged before the
+        # previous window no longer contribute to any estimate
+        if self._local.expired_before != index - 1:
+            connection.execute("DELETE FROM quota_counters WHERE window < ?", (index - 1,))
+            self._local.expired_before = index - 1
+
+    def _try_acquire(self, user_id: Optional[str], tokens: int) -> Optional[TokenBudgetExceeded]:
+        connection = self._connection()
+        now = time.time()
+        index = int(now // self.window_seconds)
+        keys = (GLOBAL_KEY,) if user_id is None else (GLOBAL_KEY, f"u:{user_id}")
+        # The write lock is taken up front, so no other process can change
+        # the counters between the increment and the check
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            before = {}
+            for key in keys:
+                window, used_tokens, prev_tokens, requests, prev_requests = self._upsert(
+                    connection, key, index, tokens, 1
+                )
+                before[key] = (window, used_tokens - tokens, prev_tokens, requests - 1, prev_requests)
+            exceeded = self._evaluate(before, keys[1] if user_id is not None else None, tokens, now)
+            if exceeded is not None:
+                connection.execute("ROLLBACK")
+                return exceeded
+            self._expire(connection, index)
+            connection.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        return None
+
+    def check(self, user_id: Optional[str] = None, tokens: int = 0) -> float:
+        """
+        Check whether a request fits the budgets, without charging it.
+
+        Args:
+            user_id: User making the request (None: global budgets only)
+            tokens: Tokens the request is expected to use
+
+        Returns:
+            Seconds until the request would fit (0.0 if it fits now)
+        """
+        user_key = f"u:{user_id}" if user_id is not None else None
+        keys = (GLOBAL_KEY,) if user_key is None else (GLOBAL_KEY, user_key)
+        rows = self._read(self._connection(), keys)
+        exceeded = self._evaluate(rows, user_key, tokens, time.time())
+        return exceeded.retry_after if exceeded else 0.0
+
+    def acquire(self, user_id: Optional[str] = None, tokens: int = 0) -> None:
+        """
+        Atomically check the budgets and count the request.
+
+        Counts one request and reserves `tokens` for the user and globally
+        if every budget has room; pass the same number as `reserved` to
+        record() once the real usage is known.
+
+        Args:
+            user_id: User making the request (None: global budgets only)
+            tokens: Tokens the request is expected to use
+
+        Raises:
+            TokenBudgetExceeded: If the request does not fit
+        """
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            exceeded = self._try_acquire(user_id, tokens)
+            if exceeded is None:
+                return
+            with self._lock:
+                if self.mode == "reject" or time.monotonic() + exceeded.retry_after > deadline:
+                    self.rejected += 1
+                    raise exceeded
+                self.throttled += 1
+            time.sleep(exceeded.retry_after + 0.01)
+
+    def record(self, user_id: Optional[str], tokens: int, reserved: int = 0) -> None:
+        """
+        Charge tokens actually used by a request.
+
+        Args:
+            user_id: User who made the request (None: global budget only)
+            tokens: Tokens used (e.g. usage_metadata.total_token_count)
+            reserved: Tokens already reserved for the request by acquire()
+        """
+        delta = tokens - reserved
+        if not delta:
+            return
+        index = int(time.time() // self.window_seconds)
+        rows = [(GLOBAL_KEY, index, delta, 0)]
+        if user_id is not None:
+            rows.append((f"u:{user_id}", index, delta, 0))
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(_UPSERT, rows)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def usage(self, user_id: Optional[str] = None) -> float:
+        """
+        Return tokens used in the sliding window.
+
+        Args:
+            user_id: User to report (None: global usage)
+
+        Returns:
+            Estimated tokens used in the last window_seconds
+        """
+        key = f"u:{user_id}" if user_id is not None else GLOBAL_KEY
+        row = self._read(self._connection(), (key,)).get(key)
+        if row is None:
+            return 0.0
+        return self._estimate([row[0], row[1], row[2]], time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the store state.
+
+        Returns:
+            Dictionary with limits, global usage, tracked users and this
+            process's rejected/throttled counts
+        """
+        now = time.time()
+        connection = self._connection()
+        row = self._read(connection, (GLOBAL_KEY,)).get(GLOBAL_KEY, (0, 0, 0, 0, 0))
+        (tracked_users,) = connection.execute(
+            "SELECT COUNT(*) FROM quota_counters WHERE window >= ? AND key != ?",
+            (int(now // self.window_seconds) - 1, GLOBAL_KEY)
+        ).fetchone()
+        return {
+            "path": self.path,
+            "user_limit": self.user_limit,
+            "global_limit": self.global_limit,
+            "user_request_limit": self.user_request_limit,
+            "global_request_limit": self.global_request_limit,
+            "window_seconds": self.window_seconds,
+            "global_usage": self._estimate([row[0], row[1], row[2]], now),
+            "global_requests": self._estimate([row[0], row[3], row[4]], now),
+            "tracked_users": tracked_users,
+            "rejected": self.rejected,
+            "throttled": self.throttled
+        }
@@ -0,0 +1,268 @@
+"""
+Request Log
+Append-only JSONL log of prompts, verdicts, token usage and latency,
+written in batches from a background thread with size/time rotation
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, Deque, List
+
+
+# Records buffered before log() starts dropping them (the writer is stuck)
+DEFAULT_MAX_PENDING = 100_000
+
+# Buffered records that wake the writer before the flush interval ends
+DEFAULT_BATCH_SIZE = 5_000
+
+
+class RequestLog:
+    """
+    Buffered, rotating JSONL writer.
+
+    log() only appends the record to an in-memory deque; serialization,
+    writes and fsync happen on a daemon thread every flush_interval seconds
+    (sooner once batch_size records are waiting), so a crash loses at most
+    one interval of records. Each record is one JSON line, in the shape
+    corpus_scanner.py reads ("prompt", "user_id").
+
+    The file is rotated once it reaches max_bytes or is rotate_seconds old:
+    it is renamed to <name>.<YYYYmmdd-HHMMSS><ext> and, with compress=True,
+    gzipped in the background. A "{pid}" in the path is replaced by the
+    process ID, giving each worker process its own file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 1.0,
+        max_bytes: Optional[int] = 100 * 1024 * 1024,
+        rotate_seconds: Optional[float] = None,
+        compress: bool = False,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_pending: int = DEFAULT_MAX_PENDING
+    ):
+        """
+        Args:
+            path: Log file path (may contain "{pid}")
+            flush_interval: Seconds between writes
+            max_bytes: Rotate once the file reaches this size (None: never)
+            rotate_seconds: Rotate once the file is this old (None: never)
+            compress: Gzip rotated files
+            batch_size: Buffered records that trigger an early write
+            max_pending: Buffered records beyond which new records are dropped
+        """
+        self.path_template = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._handle = None
+        self._opened_at = 0.0
+        self._compressors: List[threading.Thread] = []
+        self.path = path
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+    def log(self, record: Dict[str, Any]) -> None:
+        """
+        Queue a record for the next write.
+
+        Args:
+            record: JSON-serializable dictionary; "ts" (epoch seconds) is
+                added if missing
+        """
+        if self._thread_pid != os.getpid():
+            self._ensure_started()
+        pending = self._pending
+        if len(pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        if "ts" not in record:
+            record["ts"] = time.time()
+        pending.append(record)
+        if len(pending) >= self.batch_size:
+            self._wake.set()
+
+    def _ensure_started(self) -> None:
+        # Threads do not survive fork; worker processes start their own (and a
+        # fresh write lock, which the parent's writer may have held at fork)
+        with self._start_lock:
+            if self._thread_pid != os.getpid():
+                self._write_lock = threading.Lock()
+                self._pending = deque()
+                self._handle = None
+                self._compressors = []
+                self._stop.clear()
+                self.path = self.path_template.replace("{pid}", str(os.getpid()))
+                self._thread = threading.Thread(target=self._run, name="sentinel-request-log", daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._handle = open(self.path, "ab")
+        self._opened_at = time.time()
+
+    def _rotated_path(self) -> str:
+        root, extension = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        candidate = f"{root}.{stamp}{extension}"
+        suffix = 1
+        while os.path.exists(candidate) or os.path.exists(f"{candidate}.gz"):
+            candidate = f"{root}.{stamp}-{suffix}{extension}"
+            suffix += 1
+        return candidate
+
+    def _rotate(self) -> None:
+        self._handle.close()
+        self._handle = None
+        rotated = self._rotated_path()
+        os.replace(self.path, rotated)
+        self.rotations += 1
+        if self.compress:
+            compressor = threading.Thread(target=_gzip_file, args=(rotated,), name="sentinel-request-log-gzip", daemon=True)
+            compressor.start()
+            self._compressors = [thread for thread in self._compressors if thread.is_alive()] + [compressor]
+
+    def flush(self) -> int:
+        """
+        Write everything buffered so far and fsync it.
+
+        Returns:
+            Number of records written
+        """
+        # Imported here: the detector imports this module on its startup path
+        import json
+
+        with self._write_lock:
+            pending = self._pending
+            if not pending:
+                return 0
+            lines = []
+            # popleft() is safe against concurrent log() appends
+            for _ in range(len(pending)):
+                record = pending.popleft()
+                try:
+                    lines.append(json.dumps(record, separators=(",", ":"), default=str))
+                except ValueError:
+                    self.write_errors += 1
+            if not lines:
+                return 0
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            try:
+                if self._handle is None:
+                    self._open()
+                self._handle.write(data)
+                self._handle.flush()
+                os.fsync(self._handle.fileno())
+                if (
+                    (self.max_bytes and self._handle.tell() >= self.max_bytes)
+                    or (self.rotate_seconds and time.time() - self._opened_at >= self.rotate_seconds)
+                ):
+                    self._rotate()
+            except OSError as e:
+                self.write_errors += 1
+                print(f"Error writing request log: {e}")
+                return 0
+            self.written += len(lines)
+            return len(lines)
+
+    def close(self) -> None:
+        """Write what is buffered, stop the background thread and close the file."""
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+        with self._write_lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+            compressors = list(self._compressors)
+        for compressor in compressors:
+            compressor.join()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return writer counters.
+
+        Returns:
+            Dictionary with written, pending, dropped, rotations and write_errors
+        """
+        return {
+            "written": self.written,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "write_errors": self.write_errors
+        }
+
+
+def _gzip_file(path: str) -> None:
+    """Compress a rotated log to path + ".gz" and remove the original."""
+    import gzip
+    import shutil
+
+    try:
+        with open(path, "rb") as source, gzip.open(f"{path}.gz.tmp", "wb") as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        os.replace(f"{path}.gz.tmp", f"{path}.gz")
+        os.remove(path)
+    except OSError as e:
+        print(f"Error compressing request log {path}: {e}")
+
+
+_default_log: Optional[RequestLog] = None
+_default_log_loaded = False
+_default_log_lock = threading.Lock()
+
+
+def get_request_log() -> Optional[RequestLog]:
+    """
+    Return the process-wide request log.
+
+    Enabled by REQUEST_LOG_PATH (may contain "{pid}"). REQUEST_LOG_FLUSH_INTERVAL
+    sets the seconds between writes (default 1), REQUEST_LOG_MAX_BYTES and
+    REQUEST_LOG_ROTATE_SECONDS the rotation size (default 100 MB) and age
+    (default: none), and REQUEST_LOG_COMPRESS=1 gzips rotated files.
+
+    Returns:
+        Shared RequestLog, or None if not configured
+    """
+    global _default_log, _default_log_loaded
+    with _default_log_lock:
+        if not _default_log_loaded:
+            path = os.getenv("REQUEST_LOG_PATH")
+            if path:
+                rotate_seconds = os.getenv("REQUEST_LOG_ROTATE_SECONDS")
+                _default_log = RequestLog(
+                    path,
+                    flush_interval=float(os.getenv("REQUEST_LOG_FLUSH_INTERVAL", "1")),
+                    max_bytes=int(os.getenv("REQUEST_LOG_MAX_BYTES", str(100 * 1024 * 1024))) or None,
+                    rotate_seconds=float(rotate_seconds) if rotate_seconds else None,
+                    compress=os.getenv("REQUEST_LOG_COMPRESS", "0").lower() in ("1", "true", "yes")
+                )
+                atexit.register(_default_log.close)
+            _default_log_loaded = True
+        return _default_log
@@ -0,0 +1,265 @@
+"""
+Chat Response Cache
+Two-tier (in-memory LRU + optional SQLite) cache of Gemini responses for
+repeated prompts, with hit-rate, bytes-saved and tokens-saved metrics
+"""
+
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, TYPE_CHECKING
+
+from ttl_cache import TTLCache
+
+# sqlite3 and hashlib are imported on first use to keep app startup fast
+if TYPE_CHECKING:
+    import sqlite3
+
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        tokens INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID
+"""
+
+# Disk tier writes between expiry/size sweeps
+_PRUNE_EVERY = 256
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalize a prompt for cache lookups.
+
+    Case and runs of whitespace are ignored, so "What is X?" and
+    "what  is x?\\n" share an entry.
+
+    Args:
+        prompt: User prompt
+
+    Returns:
+        Normalized prompt
+    """
+    return " ".join(prompt.split()).casefold()
+
+
+def cache_key(model: str, prompt: str, max_output_tokens: Optional[int] = None) -> str:
+    """
+    Return the cache key for a request.
+
+    Args:
+        model: Model name
+        prompt: User prompt (normalized here)
+        max_output_tokens: Output cap sent with the request (it can truncate responses)
+
+    Returns:
+        Hex digest identifying the request
+    """
+    import hashlib
+
+    material = f"{model}\0{max_output_tokens or ''}\0{normalize_prompt(prompt)}"
+    return hashlib.blake2b(material.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache of model responses keyed on (model, output cap, normalized prompt).
+
+    The memory tier is a TTLCache. With a path, responses are also kept in
+    a SQLite database (WAL mode) so they survive restarts and are shared by
+    worker processes; disk hits are promoted to the memory tier. The disk
+    tier is swept for expired entries and trimmed to max_disk_entries every
+    few hundred writes.
+
+    Each hit records the response size (bytes_saved) and the tokens the
+    original call used (tokens_saved).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: float = 3600.0,
+        path: Optional[str] = None,
+        max_disk_entries: int = 100000
+    ):
+        """
+        Args:
+            max_entries: Responses kept in memory
+            ttl_seconds: Response lifetime in seconds (both tiers)
+            path: SQLite database file for the disk tier (None: memory only)
+            max_disk_entries: Responses kept on disk
+        """
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self._memory = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bytes_saved = 0
+        self.tokens_saved = 0
+        if path:
+            self._connection()
+
+    def _connection(self) -> "sqlite3.Connection":
+        import sqlite3
+
+        local = self._local
+        connection = getattr(local, "connection", None)
+        if connection is None or local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(_SCHEMA)
+            local.connection = connection
+            local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Key from cache_key()
+
+        Returns:
+            Cached response text, or None on a miss
+        """
+        entry = self._memory.get(key)
+        tier = "memory"
+        if entry is None and self.path:
+            row = self._connection().execute(
+                "SELECT response, tokens, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            remaining = row[2] - time.time() if row is not None else 0
+            if remaining > 0:
+                entry = (row[0], row[1])
+                tier = "disk"
+                # Promoted for what is left of its disk lifetime, not a new TTL
+                self._memory.put(key, entry, ttl_seconds=remaining)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if tier == "memory":
+                self.memory_hits += 1
+            else:
+                self.disk_hits += 1
+            self.bytes_saved += len(entry[0].encode("utf-8"))
+            self.tokens_saved += entry[1]
+        return entry[0]
+
+    def put(self, key: str, response: str, tokens: int = 0) -> None:
+        """
+        Store a response.
+
+        Args:
+            key: Key from cache_key()
+            response: Response text
+            tokens: Tokens the call used (counted as saved on each hit)
+        """
+        entry = (response, int(tokens))
+        self._memory.put(key, entry)
+        with self._lock:
+            self.stores += 1
+            self._writes += 1
+            prune = self._writes % _PRUNE_EVERY == 0
+        if not self.path:
+            return
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (key, response, tokens, expires_at) VALUES (?, ?, ?, ?)",
+            (key, response, entry[1], time.time() + self.ttl_seconds)
+        )
+        if prune:
+            self._prune(connection)
+
+    def _prune(self, connection: "sqlite3.Connection") -> None:
+        connection.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        # Entries expiring first were stored first
+        connection.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def clear(self) -> None:
+        """Drop every cached response from both tiers."""
+        self._memory.clear()
+        if self.path:
+            self._connection().execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache metrics.
+
+        Returns:
+            Dictionary with hits (memory/disk), misses, hit_rate, stores,
+            bytes_saved, tokens_saved and the memory tier size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "bytes_saved": self.bytes_saved,
+                "tokens_saved": self.tokens_saved,
+                "memory_size": len(self._memory),
+                "path": self.path
+            }
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_cache_loaded = False
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Return the process-wide response cache configured from environment variables.
+
+    RESPONSE_CACHE_SIZE sets the responses kept in memory (unset or 0:
+    caching disabled), RESPONSE_CACHE_TTL their lifetime in seconds
+    (default 3600) and RESPONSE_CACHE_PATH a SQLite file for the disk tier.
+
+    Returns:
+        Shared ResponseCache, or None if caching is disabled
+    """
+    global _default_cache, _default_cache_loaded
+    with _default_cache_lock:
+        if not _default_cache_loaded:
+            size = int(os.getenv("RESPONSE_CACHE_SIZE", "0") or 0)
+            if size > 0:
+                _default_cache = ResponseCache(
+                    max_entries=size,
+                    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+                    path=os.getenv("RESPONSE_CACHE_PATH") or None
+                )
+            _default_cache_loaded = True
+        return _default_cache
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """
+    Replace the process-wide response cache.
+
+    Args:
+        cache: Cache to use (None disables caching); any object with
+            get(key) and put(key, response, tokens) works
+    """
+    global _default_cache, _default_cache_loaded
+    with _default_cache_lock:
+        _default_cache = cache
+        _default_cache_loaded = True
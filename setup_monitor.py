@@ -18,8 +18,37 @@ from datadog_monitoring import create_dow_monitor, create_monitor_from_json
 def main():
     """
     Create the DoW monitor either programmatically or from JSON.
+    
+    "adaptive" derives the thresholds from request logs instead of
+    DOW_THRESHOLD (see dow_thresholds.py):
+        python setup_monitor.py adaptive logs/requests*.jsonl*
     """
-    if len(sys.argv) > 1 and sys.argv[1] == "from-json":
+    evaluation_window = os.getenv("DOW_EVALUATION_WINDOW", "last_5m")
+    if len(sys.argv) > 2 and sys.argv[1] == "adaptive":
+        from dow_thresholds import compute_thresholds, format_proposal, load_tiers
+        
+        print(f"Computing DoW thresholds from {len(sys.argv) - 2} log file(s)...")
+        try:
+            proposal, _ = compute_thresholds(
+                sys.argv[2:],
+                evaluation_window,
+                tiers=load_tiers(os.getenv("DOW_TIERS_FILE")),
+                state_path=os.getenv("DOW_BASELINE_STATE")
+            )
+        except ValueError as e:
+            # Refused baselines (bad timestamps, gaps) must not become monitors
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(format_proposal(proposal))
+        if not proposal.get("windows"):
+            sys.exit(1)
+        print(f"Creating DoW monitor with warning {proposal['warning']:,} / critical {proposal['critical']:,} tokens...")
+        result = create_dow_monitor(
+            threshold=proposal["critical"],
+            evaluation_window=evaluation_window,
+            warning_threshold=proposal["warning"]
+        )
+    elif len(sys.argv) > 1 and sys.argv[1] == "from-json":
         # Create monitor from JSON file
         json_path = "monitor_dow.json"
         if not os.path.exists(json_path):
@@ -31,8 +60,13 @@ def main():
     else:
         # Create monitor programmatically
         threshold = int(os.getenv("DOW_THRESHOLD", "100000"))
+        warning = os.getenv("DOW_WARNING_THRESHOLD")
         print(f"Creating DoW monitor with threshold: {threshold:,} tokens...")
-        result = create_dow_monitor(threshold=threshold)
+        result = create_dow_monitor(
+            threshold=threshold,
+            evaluation_window=evaluation_window,
+            warning_threshold=float(warning) if warning else None
+        )
     
     if result.get("success"):
         print(f"[SUCCESS] {result.get('message')}")
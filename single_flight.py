@@ -0,0 +1,188 @@
+"""
+Single-Flight Request Coalescing
+Concurrent identical chat requests share one upstream model call
+"""
+
+import os
+import threading
+from typing import Optional, Dict, Any, Awaitable, Callable, Hashable, Tuple
+
+
+def flight_key(model: str, prompt: str, max_output_tokens: Optional[int] = None) -> str:
+    """
+    Return the single-flight key for a request.
+
+    Unlike response_cache.cache_key() the prompt is not normalized: only
+    byte-identical requests may share a response.
+
+    Args:
+        model: Model name
+        prompt: User prompt, exactly as sent
+        max_output_tokens: Output cap sent with the request
+
+    Returns:
+        Hex digest identifying the request
+    """
+    import hashlib
+
+    material = f"{model}\0{max_output_tokens or ''}\0{prompt}"
+    return hashlib.blake2b(material.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Flight:
+    """One in-progress call and the callers waiting for it."""
+
+    __slots__ = ("done", "value", "tokens", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.tokens = 0
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; callers arriving while it is
+    in progress wait for it and get the same result (or exception).
+
+    Calls return (value, tokens); tokens is the call's token usage, counted
+    as saved for every caller that shares it. A key is forgotten as soon as
+    its call finishes, so nothing is cached beyond the call's lifetime.
+
+    do() is for threads and ado() for asyncio. In ado(), a waiter that is
+    cancelled (e.g. by a deadline) leaves the shared call running for the
+    others; the call itself is cancelled only when every waiter is gone.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Flight] = {}
+        self._async_calls: Dict[Tuple[int, Hashable], list] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.tokens_saved = 0
+
+    def do(self, key: Hashable, func: Callable[[], Tuple[Any, int]]) -> Tuple[Any, bool]:
+        """
+        Run func for key, or wait for the call already running for key.
+
+        Args:
+            key: Request identity
+            func: Performs the call; returns (value, tokens used)
+
+        Returns:
+            (value, shared) where shared is True if another caller's call was used
+        """
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Flight()
+                self.calls += 1
+        if not leader:
+            flight.done.wait()
+            return self._shared_result(flight), True
+
+        try:
+            flight.value, flight.tokens = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+        return flight.value, False
+
+    async def ado(self, key: Hashable, factory: Callable[[], Awaitable[Tuple[Any, int]]]) -> Tuple[Any, bool]:
+        """
+        Asyncio version of do().
+
+        Args:
+            key: Request identity
+            factory: Returns a coroutine performing the call; it resolves to
+                (value, tokens used)
+
+        Returns:
+            (value, shared) where shared is True if another caller's call was used
+        """
+        import asyncio
+
+        loop_key = (id(asyncio.get_running_loop()), key)
+        entry = self._async_calls.get(loop_key)
+        if entry is None:
+            task = asyncio.ensure_future(factory())
+            # [task, waiters]
+            entry = self._async_calls[loop_key] = [task, 0]
+            task.add_done_callback(lambda _: self._async_calls.pop(loop_key, None))
+            with self._lock:
+                self.calls += 1
+            leader = True
+        else:
+            leader = False
+        task = entry[0]
+        entry[1] += 1
+        try:
+            value, tokens = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+            raise
+        if not leader:
+            with self._lock:
+                self.coalesced += 1
+                self.tokens_saved += tokens
+        return value, not leader
+
+    def _shared_result(self, flight: _Flight) -> Any:
+        if flight.error is not None:
+            raise flight.error
+        with self._lock:
+            self.coalesced += 1
+            self.tokens_saved += flight.tokens
+        return flight.value
+
+    def in_flight(self) -> int:
+        """Number of calls currently in progress."""
+        return len(self._calls) + len(self._async_calls)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return coalescing counters.
+
+        Returns:
+            Dictionary with calls (upstream calls made), coalesced (requests
+            that shared another call), tokens_saved and in_flight
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "tokens_saved": self.tokens_saved,
+                "in_flight": self.in_flight()
+            }
+
+
+_default_flights: Optional[SingleFlight] = None
+_default_flights_loaded = False
+_default_flights_lock = threading.Lock()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """
+    Return the process-wide single-flight group.
+
+    Enabled by CHAT_SINGLE_FLIGHT=1 (default: disabled).
+
+    Returns:
+        Shared SingleFlight, or None if disabled
+    """
+    global _default_flights, _default_flights_loaded
+    with _default_flights_lock:
+        if not _default_flights_loaded:
+            if os.getenv("CHAT_SINGLE_FLIGHT", "0").lower() in ("1", "true", "yes"):
+                _default_flights = SingleFlight()
+            _default_flights_loaded = True
+        return _default_flights
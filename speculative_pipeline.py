@@ -0,0 +1,214 @@
+"""
+Speculative Chat Pipeline
+Runs prompt injection detection and the Gemini call concurrently, so
+detector and case-creation latency are hidden behind the model's time to
+first token on clean traffic
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator, List, TYPE_CHECKING
+
+from app import chat_stream
+from prompt_injection_detector import handle_prompt_injection
+
+if TYPE_CHECKING:
+    from google import genai
+
+
+# What to do with model output produced before the detection verdict:
+# "hold" buffers it and only releases it once the prompt is known to be
+# clean; "release" shows it immediately and stops the stream (marking the
+# response as retracted) if the prompt is flagged afterwards
+STREAM_POLICIES = ("hold", "release")
+
+stats = {"requests": 0, "blocked": 0, "retracted": 0, "verdict_before_first_chunk": 0}
+_stats_lock = threading.Lock()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Two tasks per request: detection and the model stream
+            workers = int(os.getenv("PIPELINE_WORKERS", "16"))
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sentinel-pipeline")
+        return _executor
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        stats[key] += 1
+
+
+class SpeculativeChat:
+    """
+    A chat request whose detection and model call run at the same time.
+
+    Iterating yields response text. If detection flags the prompt, the model
+    stream is abandoned (its connection is closed at the next chunk and the
+    token budget settled for what was generated), iteration stops and
+    `blocked` is True. With the "release" policy, chunks yielded before
+    the verdict cannot be taken back; `retracted` tells the caller to
+    discard what it showed.
+
+    After iteration, `detection` holds the handle_prompt_injection() result
+    and `metrics` the chat_stream() metrics plus detector_seconds.
+    """
+
+    def __init__(
+        self,
+        client: "genai.Client",
+        prompt: str,
+        user_id: str,
+        additional_context: Optional[Dict[str, Any]] = None,
+        stream_policy: Optional[str] = None
+    ):
+        """
+        Args:
+            client: Initialized genai.Client instance
+            prompt: User's input prompt
+            user_id: User ID who submitted the prompt
+            additional_context: Optional additional context for the case
+            stream_policy: "hold" or "release" (default: PIPELINE_STREAM_POLICY
+                env var or "hold")
+        """
+        stream_policy = stream_policy or os.getenv("PIPELINE_STREAM_POLICY", "hold")
+        if stream_policy not in STREAM_POLICIES:
+            raise ValueError(f"stream_policy must be one of {STREAM_POLICIES}")
+        self.client = client
+        self.prompt = prompt
+        self.user_id = user_id
+        self.additional_context = additional_context
+        self.stream_policy = stream_policy
+        self.detection: Optional[Dict[str, Any]] = None
+        self.blocked = False
+        self.retracted = False
+        self.metrics: Dict[str, Any] = {}
+        self._events: "queue.Queue[tuple]" = queue.Queue()
+        self._cancel = threading.Event()
+        self._started = False
+
+    def _detect(self, started: float) -> None:
+        try:
+            result = handle_prompt_injection(
+                prompt=self.prompt,
+                user_id=self.user_id,
+                create_case=True,
+                additional_context=self.additional_context
+            )
+        except BaseException as e:
+            self._events.put(("verdict_error", e))
+            return
+        self.metrics["detector_seconds"] = time.perf_counter() - started
+        self._events.put(("verdict", result))
+
+    def _pump(self) -> None:
+        stream = chat_stream(self.client, self.prompt, user_id=self.user_id, metrics=self.metrics)
+        try:
+            for chunk in stream:
+                if self._cancel.is_set():
+                    break
+                self._events.put(("chunk", chunk))
+        except BaseException as e:
+            self._events.put(("error", e))
+            return
+        finally:
+            # Closing the generator drops the HTTP stream and settles the budget
+            stream.close()
+        self._events.put(("done", None))
+
+    def start(self) -> "SpeculativeChat":
+        """Submit detection and the model call (idempotent)."""
+        if not self._started:
+            self._started = True
+            _count("requests")
+            executor = _get_executor()
+            executor.submit(self._detect, time.perf_counter())
+            executor.submit(self._pump)
+        return self
+
+    def cancel(self) -> None:
+        """Stop the model stream at its next chunk."""
+        self._cancel.set()
+
+    def __iter__(self) -> Iterator[str]:
+        self.start()
+        clean = False
+        finished = False
+        error: Optional[BaseException] = None
+        held: List[str] = []
+        released = 0
+        try:
+            while True:
+                kind, value = self._events.get()
+                if kind == "verdict":
+                    self.detection = value
+                    if value["injection_detected"] or value.get("token_limit_exceeded"):
+                        self.blocked = True
+                        self.retracted = released > 0
+                        self.cancel()
+                        _count("blocked")
+                        if self.retracted:
+                            _count("retracted")
+                        return
+                    clean = True
+                    if not released and not held:
+                        _count("verdict_before_first_chunk")
+                    for chunk in held:
+                        yield chunk
+                    held.clear()
+                    if error is not None:
+                        raise error
+                    if finished:
+                        return
+                elif kind == "verdict_error":
+                    # Fail closed: no verdict, no output
+                    self.cancel()
+                    raise value
+                elif kind == "chunk":
+                    if clean or self.stream_policy == "release":
+                        released += 1
+                        yield value
+                    else:
+                        held.append(value)
+                elif kind == "error":
+                    # A flagged prompt is reported as blocked, not as an error
+                    if clean:
+                        raise value
+                    error = value
+                else:
+                    if clean:
+                        return
+                    finished = True
+        finally:
+            self.cancel()
+
+
+def speculative_chat(
+    client: "genai.Client",
+    prompt: str,
+    user_id: str,
+    additional_context: Optional[Dict[str, Any]] = None,
+    stream_policy: Optional[str] = None
+) -> SpeculativeChat:
+    """
+    Start detection and the model call for a prompt at the same time.
+
+    Args:
+        client: Initialized genai.Client instance
+        prompt: User's input prompt
+        user_id: User ID who submitted the prompt
+        additional_context: Optional additional context for the case
+        stream_policy: "hold" or "release" (see STREAM_POLICIES)
+
+    Returns:
+        SpeculativeChat to iterate for the response text
+    """
+    return SpeculativeChat(client, prompt, user_id, additional_context, stream_policy).start()
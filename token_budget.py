@@ -0,0 +1,306 @@
+"""
+Token Budget Enforcement
+In-process per-user and global sliding-window token budgets for Denial of
+Wallet (DoW) protection, enforced before each LLM call
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised when a request would exceed a token budget."""
+
+    def __init__(self, scope: str, usage: float, limit: int, retry_after: float):
+        self.scope = scope
+        self.usage = usage
+        self.limit = limit
+        self.retry_after = retry_after
+        wait = "never" if math.isinf(retry_after) else f"in {retry_after:.1f}s"
+        unit = "requests" if scope.endswith("requests") else "tokens"
+        kind = "" if unit == "requests" else " token"
+        super().__init__(
+            f"{scope.capitalize()}{kind} budget exhausted ({usage:,.0f}/{limit:,} {unit}); retry {wait}"
+        )
+
+
+class TokenBudget:
+    """
+    Sliding-window token accountant for one global and many per-user budgets.
+
+    Each budget uses a sliding window counter: token counts for the current
+    and previous fixed window, with the previous one weighted by how much of
+    it still overlaps the sliding window. Updates and checks are O(1) and
+    each user costs three numbers. Users are kept in least-recently-charged
+    order; users with no usage in the last two windows are dropped as new
+    usage arrives, and at most max_users users are tracked (the least
+    recently charged is dropped when exceeded; the global budget still
+    covers their traffic).
+
+    mode "reject" raises TokenBudgetExceeded as soon as a budget is
+    exhausted; mode "throttle" waits up to max_wait_seconds for the window
+    to slide before raising.
+    """
+
+    def __init__(
+        self,
+        user_limit: Optional[int] = None,
+        global_limit: Optional[int] = None,
+        window_seconds: float = 300.0,
+        max_users: int = 1_000_000,
+        mode: str = "reject",
+        max_wait_seconds: float = 30.0
+    ):
+        """
+        Args:
+            user_limit: Tokens each user may consume per window (None: unlimited)
+            global_limit: Tokens all users together may consume per window (None: unlimited)
+            window_seconds: Sliding window length (default matches the DoW monitor's last_5m)
+            max_users: Maximum number of users tracked
+            mode: "reject" or "throttle"
+            max_wait_seconds: Longest wait in throttle mode
+        """
+        if mode not in ("reject", "throttle"):
+            raise ValueError("mode must be 'reject' or 'throttle'")
+        if window_seconds <= 0:
+            raise ValueError("window_seconds must be positive")
+        if max_users <= 0:
+            raise ValueError("max_users must be positive")
+        self.user_limit = user_limit
+        self.global_limit = global_limit
+        self.window_seconds = window_seconds
+        self.max_users = max_users
+        self.mode = mode
+        self.max_wait_seconds = max_wait_seconds
+        # [window index, current window tokens, previous window tokens]
+        self._global: List[float] = [0, 0, 0]
+        self._users: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.throttled = 0
+
+    def _roll(self, state: List[float], index: int) -> None:
+        if state[0] == index:
+            return
+        if state[0] == index - 1:
+            state[2] = state[1]
+        else:
+            state[2] = 0
+        state[1] = 0
+        state[0] = index
+
+    def _estimate(self, state: List[float], now: float) -> float:
+        self._roll(state, int(now // self.window_seconds))
+        overlap = 1.0 - (now % self.window_seconds) / self.window_seconds
+        return state[2] * overlap + state[1]
+
+    def _retry_after(self, state: List[float], limit: int, tokens: int, now: float) -> float:
+        """Seconds until usage + tokens fits in the limit (0 if it already fits)."""
+        window = self.window_seconds
+        elapsed = now % window
+        current, previous = state[1], state[2]
+        available = limit - tokens - current
+        if available >= 0:
+            if previous <= available:
+                return 0.0
+            # Wait until the previous window's weight has decayed enough
+            return max(0.0, (1.0 - available / previous) * window - elapsed)
+        if limit - tokens < 0:
+            return math.inf
+        # The current window has to become the previous one and decay
+        return (window - elapsed) + (1.0 - (limit - tokens) / current) * window
+
+    def _check(self, user_id: Optional[str], tokens: int, now: float) -> Optional[TokenBudgetExceeded]:
+        checks = []
+        if self.global_limit is not None:
+            checks.append(("global", self._global, self.global_limit))
+        if self.user_limit is not None and user_id is not None:
+            state = self._users.get(user_id)
+            if state is not None:
+                checks.append(("user", state, self.user_limit))
+            elif tokens > self.user_limit:
+                checks.append(("user", [0, 0, 0], self.user_limit))
+        exceeded = None
+        for scope, state, limit in checks:
+            usage = self._estimate(state, now)
+            if usage + tokens > limit:
+                retry_after = self._retry_after(state, limit, tokens, now)
+                if exceeded is None or retry_after > exceeded.retry_after:
+                    exceeded = TokenBudgetExceeded(scope, usage, limit, retry_after)
+        return exceeded
+
+    def check(self, user_id: Optional[str] = None, tokens: int = 0) -> float:
+        """
+        Check whether a request fits the budgets, without charging it.
+
+        Args:
+            user_id: User making the request (None: global budget only)
+            tokens: Tokens the request is expected to use
+
+        Returns:
+            Seconds until the request would fit (0.0 if it fits now)
+        """
+        with self._lock:
+            exceeded = self._check(user_id, tokens, time.monotonic())
+        return exceeded.retry_after if exceeded else 0.0
+
+    def acquire(self, user_id: Optional[str] = None, tokens: int = 0) -> None:
+        """
+        Admit a request or refuse it before any tokens are spent.
+
+        Admitted requests reserve `tokens` immediately, so concurrent
+        requests cannot all pass on the same remaining budget; pass the same
+        number as `reserved` to record() once the real usage is known. In
+        throttle mode this blocks until the budgets have room (at most
+        max_wait_seconds).
+
+        Args:
+            user_id: User making the request (None: global budget only)
+            tokens: Tokens the request is expected to use
+
+        Raises:
+            TokenBudgetExceeded: If the request does not fit
+        """
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                exceeded = self._check(user_id, tokens, now)
+                if exceeded is None:
+                    self._charge(user_id, tokens, now)
+                    return
+                if self.mode == "reject" or now + exceeded.retry_after > deadline:
+                    self.rejected += 1
+                    raise exceeded
+                self.throttled += 1
+            # Slightly past the computed time so the next check succeeds
+            time.sleep(exceeded.retry_after + 0.01)
+
+    def record(self, user_id: Optional[str], tokens: int, reserved: int = 0) -> None:
+        """
+        Charge tokens actually used by a request.
+
+        Args:
+            user_id: User who made the request (None: global budget only)
+            tokens: Tokens used (e.g. usage_metadata.total_token_count)
+            reserved: Tokens already reserved for the request by acquire()
+        """
+        with self._lock:
+            self._charge(user_id, tokens - reserved, time.monotonic())
+
+    def _charge(self, user_id: Optional[str], tokens: int, now: float) -> None:
+        # Negative amounts return unused reservations
+        if not tokens:
+            return
+        index = int(now // self.window_seconds)
+        self._roll(self._global, index)
+        self._global[1] = max(0, self._global[1] + tokens)
+        if user_id is None or self.user_limit is None:
+            return
+        users = self._users
+        state = users.get(user_id)
+        if state is None:
+            if tokens < 0:
+                return
+            state = users[user_id] = [index, 0, 0]
+        else:
+            users.move_to_end(user_id)
+            self._roll(state, index)
+        state[1] = max(0, state[1] + tokens)
+        # Users at the front have not been charged for the longest time
+        while users:
+            oldest = next(iter(users.values()))
+            if oldest[0] >= index - 1 and len(users) <= self.max_users:
+                break
+            users.popitem(last=False)
+
+    def usage(self, user_id: Optional[str] = None) -> float:
+        """
+        Return tokens used in the sliding window.
+
+        Args:
+            user_id: User to report (None: global usage)
+
+        Returns:
+            Estimated tokens used in the last window_seconds
+        """
+        now = time.monotonic()
+        with self._lock:
+            if user_id is None:
+                return self._estimate(self._global, now)
+            state = self._users.get(user_id)
+            return self._estimate(state, now) if state is not None else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the budget state.
+
+        Returns:
+            Dictionary with limits, global usage, tracked users and
+            rejected/throttled counts
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "user_limit": self.user_limit,
+                "global_limit": self.global_limit,
+                "window_seconds": self.window_seconds,
+                "global_usage": self._estimate(self._global, now),
+                "tracked_users": len(self._users),
+                "rejected": self.rejected,
+                "throttled": self.throttled
+            }
+
+
+_default_budget: Optional[TokenBudget] = None
+_default_budget_loaded = False
+_default_budget_lock = threading.Lock()
+
+
+def get_token_budget() -> Optional[TokenBudget]:
+    """
+    Return the process-wide token budget configured from environment variables.
+
+    TOKEN_BUDGET_USER and TOKEN_BUDGET_GLOBAL set the per-user and global
+    limits (tokens per window), TOKEN_BUDGET_WINDOW the window in seconds
+    (default 300) and TOKEN_BUDGET_MODE "reject" (default) or "throttle".
+    With TOKEN_BUDGET_STORE set to a file path, counters are kept in a
+    SQLite database shared by all worker processes (see quota_store.py),
+    which can also limit requests per window through
+    TOKEN_BUDGET_USER_REQUESTS and TOKEN_BUDGET_GLOBAL_REQUESTS.
+
+    Returns:
+        Shared TokenBudget, or None if no limit is configured
+    """
+    global _default_budget, _default_budget_loaded
+    with _default_budget_lock:
+        if not _default_budget_loaded:
+            limits = {
+                name: int(os.environ[variable]) if os.getenv(variable) else None
+                for name, variable in (
+                    ("user_limit", "TOKEN_BUDGET_USER"),
+                    ("global_limit", "TOKEN_BUDGET_GLOBAL"),
+                    ("user_request_limit", "TOKEN_BUDGET_USER_REQUESTS"),
+                    ("global_request_limit", "TOKEN_BUDGET_GLOBAL_REQUESTS"),
+                )
+            }
+            options = {
+                "window_seconds": float(os.getenv("TOKEN_BUDGET_WINDOW", "300")),
+                "mode": os.getenv("TOKEN_BUDGET_MODE", "reject")
+            }
+            store_path = os.getenv("TOKEN_BUDGET_STORE")
+            if store_path and any(limit is not None for limit in limits.values()):
+                from quota_store import SQLiteQuotaStore
+                _default_budget = SQLiteQuotaStore(store_path, **limits, **options)
+            elif limits["user_limit"] is not None or limits["global_limit"] is not None:
+                _default_budget = TokenBudget(
+                    user_limit=limits["user_limit"],
+                    global_limit=limits["global_limit"],
+                    **options
+                )
+            _default_budget_loaded = True
+        return _default_budget
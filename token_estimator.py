@@ -0,0 +1,209 @@
+"""
+Pre-flight Token Estimation
+Microsecond-cost token estimates for Gemini-style (SentencePiece) tokenization,
+calibrated online against usage_metadata from real responses
+"""
+
+import os
+import threading
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+
+
+class PromptTooLong(Exception):
+    """Raised when a prompt's estimated token count exceeds the input cap."""
+
+    def __init__(self, estimated_tokens: int, limit: int):
+        self.estimated_tokens = estimated_tokens
+        self.limit = limit
+        super().__init__(
+            f"Prompt is too long: about {estimated_tokens:,} tokens (limit {limit:,})"
+        )
+
+
+# Feature order: ASCII characters, word breaks, non-ASCII characters, intercept.
+# Defaults: ~4 ASCII characters per token, roughly one token per CJK
+# character (UTF-8 non-ASCII characters are mostly 2-3 bytes)
+DEFAULT_COEFFICIENTS = (0.25, 0.0, 1.0, 1.0)
+
+# Weight of the defaults when fitting, in equivalent observations
+PRIOR_WEIGHT = 20.0
+
+
+def token_features(text: str) -> Tuple[float, float, float, float]:
+    """
+    Return the estimator features for a text.
+
+    Every feature is computed by a C-level scan (len, count, encode), so
+    the cost is a few microseconds even for long prompts.
+
+    Returns:
+        (ASCII characters, word breaks, non-ASCII characters, 1.0)
+    """
+    length = len(text)
+    breaks = text.count(" ") + text.count("\n")
+    if text.isascii():
+        return (float(length), float(breaks), 0.0, 1.0)
+    # Extra UTF-8 bytes over the character count; two per character covers
+    # CJK (3 bytes) while Latin accents (2 bytes) count about half
+    extra = len(text.encode("utf-8", "surrogatepass")) - length
+    non_ascii = extra / 2.0
+    return (max(length - non_ascii, 0.0), float(breaks), non_ascii, 1.0)
+
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> Optional[List[float]]:
+    """Solve a small linear system by Gaussian elimination (None if singular)."""
+    size = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            return None
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(size):
+            if row != column:
+                factor = rows[row][column] / rows[column][column]
+                for k in range(column, size + 1):
+                    rows[row][k] -= factor * rows[column][k]
+    return [rows[i][size] / rows[i][i] for i in range(size)]
+
+
+class TokenEstimator:
+    """
+    Linear token estimator over cheap text features.
+
+    estimate() is a dot product of token_features() with the coefficients.
+    observe() feeds (text, actual prompt_token_count) pairs from real
+    responses into running least-squares sums (constant memory); the
+    coefficients are refit every refit_every observations, regularised
+    towards the defaults so a handful of samples cannot skew them.
+    """
+
+    def __init__(
+        self,
+        coefficients: Sequence[float] = DEFAULT_COEFFICIENTS,
+        refit_every: int = 50
+    ):
+        """
+        Args:
+            coefficients: Initial (ASCII, word break, non-ASCII, intercept) weights
+            refit_every: Observations between automatic refits (0: never)
+        """
+        if len(coefficients) != 4:
+            raise ValueError("coefficients must have 4 values")
+        self.coefficients = tuple(float(c) for c in coefficients)
+        self.prior = self.coefficients
+        self.refit_every = refit_every
+        self.observations = 0
+        self._xtx = [[0.0] * 4 for _ in range(4)]
+        self._xty = [0.0] * 4
+        self._abs_error = 0.0
+        self._lock = threading.Lock()
+
+    def estimate(self, text: str) -> int:
+        """
+        Estimate the number of tokens in a text.
+
+        Args:
+            text: Prompt or response text
+
+        Returns:
+            Estimated token count (at least 1 for non-empty text)
+        """
+        if not text:
+            return 0
+        a, b, c, d = self.coefficients
+        ascii_chars, breaks, non_ascii, one = token_features(text)
+        return max(1, int(a * ascii_chars + b * breaks + c * non_ascii + d * one + 0.5))
+
+    def observe(self, text: str, actual_tokens: int) -> None:
+        """
+        Record the real token count for a text (e.g. usage_metadata.prompt_token_count).
+
+        Args:
+            text: Text that was sent
+            actual_tokens: Tokens the API counted for it
+        """
+        if not text or actual_tokens is None:
+            return
+        features = token_features(text)
+        estimate = self.estimate(text)
+        with self._lock:
+            for i in range(4):
+                self._xty[i] += features[i] * actual_tokens
+                row = self._xtx[i]
+                for j in range(4):
+                    row[j] += features[i] * features[j]
+            self.observations += 1
+            self._abs_error += abs(estimate - actual_tokens) / max(actual_tokens, 1)
+            refit = self.refit_every and self.observations % self.refit_every == 0
+        if refit:
+            self.calibrate()
+
+    def calibrate(self) -> Tuple[float, ...]:
+        """
+        Refit the coefficients from the observations so far.
+
+        Returns:
+            The new coefficients (unchanged if the system is singular)
+        """
+        with self._lock:
+            # Ridge regression towards the prior coefficients
+            matrix = [list(row) for row in self._xtx]
+            vector = list(self._xty)
+            for i in range(4):
+                matrix[i][i] += PRIOR_WEIGHT
+                vector[i] += PRIOR_WEIGHT * self.prior[i]
+            solution = _solve(matrix, vector)
+            if solution is not None:
+                self.coefficients = tuple(max(value, 0.0) for value in solution)
+            return self.coefficients
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return calibration state.
+
+        Returns:
+            Dictionary with coefficients, observations and the mean relative
+            error of estimates made before each observation
+        """
+        with self._lock:
+            return {
+                "coefficients": self.coefficients,
+                "observations": self.observations,
+                "mean_relative_error": self._abs_error / self.observations if self.observations else None
+            }
+
+
+_default_estimator: Optional[TokenEstimator] = None
+_default_estimator_lock = threading.Lock()
+
+
+def get_token_estimator() -> TokenEstimator:
+    """
+    Return the process-wide token estimator.
+
+    Returns:
+        Shared TokenEstimator
+    """
+    global _default_estimator
+    with _default_estimator_lock:
+        if _default_estimator is None:
+            _default_estimator = TokenEstimator()
+        return _default_estimator
+
+
+def token_caps() -> Tuple[Optional[int], Optional[int]]:
+    """
+    Return the configured (input, output) token caps.
+
+    Read from GEMINI_MAX_INPUT_TOKENS and GEMINI_MAX_OUTPUT_TOKENS; unset
+    means no cap.
+
+    Returns:
+        (max input tokens, max output tokens)
+    """
+    caps = []
+    for variable in ("GEMINI_MAX_INPUT_TOKENS", "GEMINI_MAX_OUTPUT_TOKENS"):
+        value = os.getenv(variable)
+        caps.append(int(value) if value else None)
+    return caps[0], caps[1]
@@ -2,7 +2,6 @@
 Script to view and review the DoW monitor in Datadog
 """
 
-import os
 import sys
 import json
 try:
@@ -11,34 +10,13 @@ try:
 except ImportError:
     pass
 
-from datadog_api_client import ApiClient, Configuration
 from datadog_api_client.v1.api.monitors_api import MonitorsApi
-
-
-def get_datadog_config() -> Configuration:
-    """Initialize Datadog API configuration"""
-    api_key = os.getenv("DD_API_KEY")
-    app_key = os.getenv("DD_APP_KEY")
-    site = os.getenv("DD_SITE", "datadoghq.com")
-    
-    if not api_key:
-        raise ValueError("DD_API_KEY environment variable must be set")
-    if not app_key:
-        raise ValueError("DD_APP_KEY environment variable must be set")
-    
-    configuration = Configuration()
-    configuration.api_key["apiKeyAuth"] = api_key
-    configuration.api_key["appKeyAuth"] = app_key
-    configuration.server_variables["site"] = site
-    
-    return configuration
+from datadog_client import get_api_client
 
 
 def list_monitors():
     """List all monitors, especially DoW monitors"""
-    configuration = get_datadog_config()
-    
-    with ApiClient(configuration) as api_client:
+    with get_api_client() as api_client:
         monitors_api = MonitorsApi(api_client)
         
         # Search for monitors with "dow" tag
@@ -73,9 +51,7 @@ def list_monitors():
 
 def get_monitor_details(monitor_id: int):
     """Get detailed information about a specific monitor"""
-    configuration = get_datadog_config()
-    
-    with ApiClient(configuration) as api_client:
+    with get_api_client() as api_client:
         monitors_api = MonitorsApi(api_client)
         
         try: